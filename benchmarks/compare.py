@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -+- encoding: utf-8 -+-
+"""
+Compares two results of benchmarks/loadtest.py, saved with -o, and tells which
+metrics regressed by more than a threshold. Throughputs regress when they fall,
+latencies, lost events and memory when they grow.
+
+Exits with status 1 if any metric regressed, so that it can be used to check a
+change against a reference run.
+
+usage: python benchmarks/compare.py [-t THRESHOLD] BASE NEW
+"""
+
+from __future__ import unicode_literals, print_function
+
+import sys
+import json
+import argparse
+
+HIGHER_IS_BETTER = ["published_per_sec", "received_per_sec"]
+LOWER_IS_BETTER = ["latency_p50", "latency_p99", "latency_p999", "lost", "rss_per_connection", "rss_peak"]
+
+def change(base, new):
+    if base is None or new is None:
+        return None
+    if base == 0:
+        return 0.0 if new == 0 else float("inf")
+    return (new - base) / float(abs(base))
+
+def main():
+    parser = argparse.ArgumentParser(description="load test results comparison")
+    parser.add_argument("base", help="JSON results of the reference run")
+    parser.add_argument("new", help="JSON results of the run to check")
+    parser.add_argument("-t", dest="threshold", type=float, default=10, help="change counted as a regression, in percent")
+    args = parser.parse_args()
+
+    with open(args.base) as base:
+        base = json.load(base)
+    with open(args.new) as new:
+        new = json.load(new)
+
+    print("base: {revision} python {python} tornado {tornado} {listener_args}".format(**base["environment"]))
+    print("new:  {revision} python {python} tornado {tornado} {listener_args}".format(**new["environment"]))
+    regressions = 0
+    for scenario in sorted(set(base["results"]) & set(new["results"])):
+        print(scenario)
+        for metric in HIGHER_IS_BETTER + LOWER_IS_BETTER:
+            before = base["results"][scenario].get(metric)
+            after = new["results"][scenario].get(metric)
+            delta = change(before, after)
+            regressed = delta is not None and (-delta if metric in HIGHER_IS_BETTER else delta) * 100 > args.threshold
+            regressions += regressed
+            print("    {:<20} {:>14} {:>14} {:>9} {}".format(
+                metric,
+                "-" if before is None else "{:.6g}".format(before),
+                "-" if after is None else "{:.6g}".format(after),
+                "-" if delta is None else "{:+.1f}%".format(delta * 100),
+                "REGRESSION" if regressed else ""))
+    for scenario in sorted(set(base["results"]) ^ set(new["results"])):
+        print("{}: only in {}".format(scenario, args.base if scenario in base["results"] else args.new))
+
+    print("{} regressions above {}%".format(regressions, args.threshold))
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
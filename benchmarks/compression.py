@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -+- encoding: utf-8 -+-
+"""
+Measures the CPU and bandwidth cost of compressing a stream of JSON events, written
+uncompressed, with a zlib context kept for the whole stream at several levels, and
+with a new zlib context for each write.
+
+Each write holds a batch of frames and ends with a sync flush, as the listener does,
+so that a client can decode every event as soon as it is received.
+
+usage: python benchmarks/compression.py [-n EVENTS] [-b BATCH]
+"""
+
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import time
+import zlib
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from eventsource import encoder
+from eventsource import fastjson
+
+def identity(level):
+    return lambda data: data
+
+def persistent(level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return lambda data: compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+def per_write(level):
+    def compress(data):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+    return compress
+
+def run(name, n, writes, compress):
+    start = time.time()
+    sent = sum(len(compress(data)) for data in writes)
+    elapsed = time.time() - start
+    print("{:<24} {:>12.0f} events/sec {:>10.1f} bytes/event".format(name, n / elapsed, sent / float(n)))
+
+def main():
+    parser = argparse.ArgumentParser(description="stream compression benchmark")
+    parser.add_argument("-n", dest="events", type=int, default=100000, help="number of events")
+    parser.add_argument("-b", dest="batch", type=int, default=1, help="number of events per write")
+    args = parser.parse_args()
+
+    random.seed(0)
+    frames = [encoder.encode_event("quote",
+                                   [fastjson.dumps(dict(symbol = random.choice(["ACME", "INITECH", "GLOBEX"]),
+                                                        price = round(random.uniform(10, 100), 2),
+                                                        volume = random.randint(1, 5000),
+                                                        exchange = "NYSE",
+                                                        currency = "USD"))],
+                                   id = i)
+              for i in range(args.events)]
+    writes = [encoder.encode_batch(frames[i:i + args.batch]) for i in range(0, args.events, args.batch)]
+
+    print("{} events of {:.0f} bytes, {} per write".format(args.events, sum(len(frame) for frame in frames) / float(args.events), args.batch))
+    run("identity", args.events, writes, identity(0))
+    for level in (1, 6, 9):
+        run("stream, level {}".format(level), args.events, writes, persistent(level))
+    run("per write, level 6", args.events, writes, per_write(6))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -+- encoding: utf-8 -+-
+"""
+Compares the events/sec of the legacy per-line `push()` against the
+single-frame encoder, with and without batching several events per flush.
+
+usage: python benchmarks/encoder.py [-n EVENTS] [-l LINES] [-b BATCH]
+"""
+
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import time
+import json
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from eventsource import encoder
+
+class Writer(object):
+    """Mimics the write buffer of a tornado RequestHandler"""
+    def __init__(self):
+        self.buffer = []
+        self.flushes = 0
+
+    def write(self, chunk):
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode("utf-8")
+        self.buffer.append(chunk)
+
+    def flush(self):
+        b"".join(self.buffer)
+        self.buffer = []
+        self.flushes += 1
+
+def legacy_push(writer, id, action, lines):
+    writer.write("id: {}\r\n".format(str(id)))
+    writer.write("event: {}\r\n".format(str(action)))
+    for line in lines:
+        writer.write("data: {}\r\n".format(str(line)))
+    writer.write("\r\n")
+    writer.flush()
+
+def frame_push(writer, id, action, lines):
+    writer.write(encoder.encode_event(action, lines, id = id))
+    writer.flush()
+
+def batch_push(writer, events):
+    writer.write(encoder.encode_batch([encoder.encode_event(action, lines, id = id) for id, action, lines in events]))
+    writer.flush()
+
+def run(name, n, fn):
+    writer = Writer()
+    start = time.time()
+    fn(writer)
+    elapsed = time.time() - start
+    print("{:<24} {:>12.0f} events/sec {:>8d} flushes".format(name, n / elapsed, writer.flushes))
+
+def main():
+    parser = argparse.ArgumentParser(description="event-stream encoder benchmark")
+    parser.add_argument("-n", dest="events", type=int, default=100000, help="number of events")
+    parser.add_argument("-l", dest="lines", type=int, default=20, help="number of fields in the JSON payload")
+    parser.add_argument("-b", dest="batch", type=int, default=16, help="number of events per flush in batch mode")
+    args = parser.parse_args()
+
+    lines = json.dumps(dict(("field{}".format(i), i) for i in range(args.lines)), indent=2).split("\n")
+    events = [(i, "ping", lines) for i in range(args.events)]
+
+    def legacy(writer):
+        for id, action, value in events:
+            legacy_push(writer, id, action, value)
+
+    def frame(writer):
+        for id, action, value in events:
+            frame_push(writer, id, action, value)
+
+    def batch(writer):
+        for i in range(0, len(events), args.batch):
+            batch_push(writer, events[i:i + args.batch])
+
+    print("{} events of {} lines".format(args.events, len(lines)))
+    run("legacy push()", args.events, legacy)
+    run("single frame", args.events, frame)
+    run("batch of {}".format(args.batch), args.events, batch)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -+- encoding: utf-8 -+-
+"""
+Compares selecting the subscribers accepting JSON events, each subscriber parsing
+the value and evaluating its own filter, against `filters.select()`, which parses
+the value once and evaluates each distinct filter once per event.
+
+usage: python benchmarks/filters.py [-n EVENTS] [-c SUBSCRIBERS] [-f FILTERS]
+"""
+
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from eventsource import fastjson
+from eventsource.filters import EventFilter, Predicate, select
+
+SYMBOLS = ["ACME", "INITECH", "GLOBEX", "UMBRELLA", "HOOLI"]
+
+class Handler(object):
+    """Stands for a connected EventSourceHandler"""
+    __slots__ = ("event_filter",)
+
+    def __init__(self, event_filter):
+        self.event_filter = event_filter
+
+def per_subscriber(handlers, values):
+    for value in values:
+        for handler in handlers:
+            handler.event_filter.accepts("quote", lambda: fastjson.loads(value))
+
+def grouped(handlers, values):
+    for value in values:
+        select(handlers, "quote", lambda: fastjson.loads(value))
+
+def run(name, n, fn):
+    start = time.time()
+    fn()
+    elapsed = time.time() - start
+    print("{:<24} {:>12.0f} events/sec".format(name, n / elapsed))
+
+def main():
+    parser = argparse.ArgumentParser(description="subscriber filters benchmark")
+    parser.add_argument("-n", dest="events", type=int, default=2000, help="number of events")
+    parser.add_argument("-c", dest="subscribers", type=int, default=1000, help="number of subscribers")
+    parser.add_argument("-f", dest="filters", type=int, default=10, help="number of distinct filters")
+    args = parser.parse_args()
+
+    random.seed(0)
+    specs = [["symbol={}".format(SYMBOLS[index % len(SYMBOLS)]), "price>{}".format(index * 10)]
+             for index in range(args.filters)]
+    # without compile(), every subscriber gets its own filter
+    private = [Handler(EventFilter(None, [Predicate.parse(p) for p in specs[index % args.filters]]))
+               for index in range(args.subscribers)]
+    shared = [Handler(EventFilter.compile(None, specs[index % args.filters]))
+              for index in range(args.subscribers)]
+    values = [fastjson.dumps(dict(symbol = random.choice(SYMBOLS),
+                                  price = round(random.uniform(10, 100), 2),
+                                  volume = random.randint(1, 5000)))
+              for _ in range(args.events)]
+
+    print("{} events, {} subscribers, {} distinct filters".format(args.events, args.subscribers, args.filters))
+    run("per subscriber", args.events, lambda: per_subscriber(private, values))
+    run("grouped", args.events, lambda: grouped(shared, values))
+
+if __name__ == "__main__":
+    main()
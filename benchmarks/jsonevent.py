@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -+- encoding: utf-8 -+-
+"""
+Compares the events/sec of the legacy JSONEvent, decoding each posted value and
+encoding it again on every read, against JSONEvent keeping its serialization,
+with every installed fastjson backend.
+
+Each event is posted, checked, encoded once into a frame shared by its
+subscribers, and logged at debug level as `push()` used to.
+
+usage: python benchmarks/jsonevent.py [-n EVENTS] [-f FIELDS]
+"""
+
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import time
+import json
+import logging
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tornado.escape import json_decode, json_encode
+
+from eventsource import encoder
+from eventsource import fastjson
+from eventsource.listener import JSONEvent
+
+log = logging.getLogger("benchmark")
+
+class LegacyJSONEvent(JSONEvent):
+    """JSONEvent as it was, encoding its value on every read"""
+    def get_value(self):
+        return [json_encode(self._value)]
+
+    def set_value(self, v):
+        self._value = json_decode(v)
+
+    value = property(get_value, set_value)
+
+def legacy(bodies):
+    for body in bodies:
+        event = LegacyJSONEvent("target", "ping", body)
+        log.debug("push({},{},{})".format(event.id, event.action, event.value))
+        encoder.encode_event(event.action, event.value, id = event.id)
+
+def cached(bodies):
+    for body in bodies:
+        event = JSONEvent("target", "ping", body)
+        log.debug("encode(%s,%s)", event.id, event.action)
+        encoder.encode_event(event.action, event.value, id = event.id)
+
+def run(name, n, fn, bodies):
+    start = time.time()
+    fn(bodies)
+    elapsed = time.time() - start
+    print("{:<24} {:>12.0f} events/sec".format(name, n / elapsed))
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON event benchmark")
+    parser.add_argument("-n", dest="events", type=int, default=100000, help="number of events")
+    parser.add_argument("-f", dest="fields", type=int, default=20, help="number of fields in the JSON payload")
+    args = parser.parse_args()
+
+    body = json.dumps(dict(("field{}".format(i), "value {} é".format(i) if i % 2 else i) for i in range(args.fields)))
+    bodies = [body] * args.events
+
+    print("{} events of {} bytes".format(args.events, len(body.encode("utf-8"))))
+    run("legacy", args.events, legacy, bodies)
+    for name in fastjson.available():
+        fastjson.use(name)
+        run("cached, {}".format(name), args.events, cached, bodies)
+
+if __name__ == "__main__":
+    main()
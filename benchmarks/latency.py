@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -+- encoding: utf-8 -+-
+"""
+Compares the latency of each event, from its POST to its reception by the
+subscribers, between the coroutine handler and the former handler chaining
+its event loop with `Future.add_done_callback`, on asyncio and on uvloop.
+
+Every listener runs in its own process, started by this script with --serve.
+
+usage: python benchmarks/latency.py [-n EVENTS] [-c SUBSCRIBERS] [-P PORT]
+"""
+
+from __future__ import unicode_literals, print_function
+
+import os
+import re
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import subprocess
+import http.client
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tornado.queues import QueueEmpty
+import tornado.concurrent
+import tornado.ioloop
+import tornado.web
+
+from eventsource.listener import EventSourceHandler
+
+DATA = re.compile(br"data: ([0-9.]+)\r\n")
+
+class CallbackHandler(EventSourceHandler):
+    """
+    Forwards events as the handler did before it was a coroutine: every pass of
+    the event loop is chained to the next one with `add_done_callback`, and
+    writes are flushed without waiting for them.
+    """
+    def _chain(self):
+        self._queue.get().add_done_callback(self._callback_loop)
+
+    def _callback_loop(self, future):
+        items = [future.result()]
+        try:
+            while True:
+                items.append(self._queue.get_nowait())
+        except QueueEmpty:
+            pass
+        batch = []
+        for item in items:
+            if item is None:
+                self._done.set_result(None)
+                return
+            event, frame = item
+            if event.action == self._event_class.FINISH:
+                if batch:
+                    self.push_frames(batch)
+                self.set_disconnected()
+                self.finish()
+                self._done.set_result(None)
+                return
+            batch.append(frame)
+        self.push_frames(batch)
+        self._chain()
+
+    async def get(self, action, target):
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        self.set_connected(target)
+        self.flush()
+        self._done = tornado.concurrent.Future()
+        self._chain()
+        await self._done
+
+class CoroutineHandler(EventSourceHandler):
+    """
+    Sends the headers at once, for the subscribers to know they are connected
+    """
+    async def get(self, action, target):
+        self.flush()
+        await EventSourceHandler.get(self, action, target)
+
+HANDLERS = dict(coroutine = CoroutineHandler, callback = CallbackHandler)
+
+def serve(handler, port, use_uvloop):
+    if use_uvloop:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    application = tornado.web.Application([(r"/(.*)/(.*)", HANDLERS[handler])])
+    application.listen(port, "127.0.0.1")
+    tornado.ioloop.IOLoop.current().start()
+
+def connect(port):
+    for _ in range(100):
+        try:
+            return socket.create_connection(("127.0.0.1", port))
+        except socket.error:
+            time.sleep(0.05)
+    raise RuntimeError("listener did not start on port {}".format(port))
+
+def subscribe(port, target):
+    sock = connect(port)
+    sock.sendall("GET /poll/{} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n".format(target).encode("utf-8"))
+    data = b""
+    while b"\r\n\r\n" not in data:
+        data += sock.recv(4096)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return [sock, data.split(b"\r\n\r\n", 1)[1]]
+
+def receive(subscriber, stamp):
+    """reads the subscriber's stream until the event of stamp is received"""
+    sock, data = subscriber
+    while True:
+        for match in DATA.finditer(data):
+            if match.group(1) == stamp:
+                subscriber[1] = data[match.end():]
+                return
+        data += sock.recv(65536)
+
+def run(name, args, use_uvloop):
+    command = [sys.executable, os.path.abspath(__file__), "--serve", name, "-P", str(args.port)]
+    if use_uvloop:
+        command.append("--uvloop")
+    server = subprocess.Popen(command)
+    try:
+        subscribers = [subscribe(args.port, "bench") for _ in range(args.subscribers)]
+        connection = http.client.HTTPConnection("127.0.0.1", args.port)
+        latencies = []
+        for i in range(args.events):
+            stamp = "{:.6f}".format(time.time()).encode("utf-8")
+            connection.request("POST", "/ping/bench", stamp)
+            connection.getresponse().read()
+            for subscriber in subscribers:
+                receive(subscriber, stamp)
+            latencies.append(time.time() - float(stamp))
+        for sock, _ in subscribers:
+            sock.close()
+        connection.close()
+    finally:
+        server.terminate()
+        server.wait()
+    latencies.sort()
+    print("{:<24} {:>10.0f} us median {:>10.0f} us p99".format(
+        "{}{}".format(name, ", uvloop" if use_uvloop else ""),
+        latencies[len(latencies) // 2] * 1e6,
+        latencies[int(len(latencies) * 0.99)] * 1e6))
+
+def main():
+    parser = argparse.ArgumentParser(description="event latency benchmark")
+    parser.add_argument("-n", dest="events", type=int, default=2000, help="number of events")
+    parser.add_argument("-c", dest="subscribers", type=int, default=10, help="number of subscribers")
+    parser.add_argument("-P", dest="port", type=int, default=8890, help="port of the listeners")
+    parser.add_argument("--serve", dest="serve", choices=sorted(HANDLERS), help=argparse.SUPPRESS)
+    parser.add_argument("--uvloop", dest="use_uvloop", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.use_uvloop)
+        return
+
+    try:
+        import uvloop
+        loops = [False, True]
+    except ImportError:
+        print("uvloop is not installed, only asyncio is measured")
+        loops = [False]
+    print("{} events, {} subscribers".format(args.events, args.subscribers))
+    for use_uvloop in loops:
+        for name in ("callback", "coroutine"):
+            run(name, args, use_uvloop)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -+- encoding: utf-8 -+-
+"""
+Load test of the listener: starts it in its own process, opens subscribers with
+EventSourceClient over one shared AsyncHTTPClient, and drives publishers posting
+events one by one with AsyncPublisher.
+
+Scenarios:
+    - **one-to-one** every subscriber has its own target
+    - **fan-out** all the subscribers follow the same target
+    - **bursty** like one-to-one, events being posted by bursts followed by a pause
+    - **large-payload** like fan-out, with large events
+
+Each event carries the time it was posted at, and every subscriber measures the
+latency of each event it receives, from its POST to its reception. Publishers and
+subscribers run in the same process and IOLoop, so they share the same clock, and
+the results include the time the harness takes to parse events.
+
+For each scenario are reported the events posted per second, the events received
+per second by all the subscribers, the p50, p99 and p999 latencies, the events lost,
+and the memory taken by the listener for each connection, read from /proc.
+
+The results are saved as JSON with -o, along with the versions and the arguments of
+the listener, to be compared with benchmarks/compare.py. Runs are only comparable on
+the same idle machine, with the same arguments.
+
+usage: python benchmarks/loadtest.py [-s SCENARIO] [-c SUBSCRIBERS] [-p PUBLISHERS]
+                                     [-n EVENTS] [-b BURST] [-l LARGE] [-t TIMEOUT]
+                                     [-P PORT] [-a LISTENER_ARGS] [-o OUTPUT]
+"""
+
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import json
+import time
+import shlex
+import socket
+import argparse
+import platform
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import tornado
+import tornado.gen
+import tornado.ioloop
+from tornado.httpclient import AsyncHTTPClient
+
+from eventsource.client import EventSourceClient
+from eventsource.request import AsyncPublisher, PublishError
+
+SCENARIOS = ["one-to-one", "fan-out", "bursty", "large-payload"]
+
+def rss(pid):
+    """
+    :returns: the resident memory of a process in bytes, or `None` without /proc
+    """
+    try:
+        with open("/proc/{}/status".format(pid)) as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        return None
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def wait_for_port(port):
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return
+        except socket.error:
+            time.sleep(0.05)
+    raise RuntimeError("listener did not start on port {}".format(port))
+
+class Subscribers(object):
+    """
+    Subscribers of a run, recording the latency of every event they receive
+    """
+    def __init__(self, port, targets, count):
+        self.latencies = []
+        self.received = 0
+        self.last = None
+        self._ready = set()
+        self._closed = 0
+        self.http_client = AsyncHTTPClient(force_instance = True, max_clients = count)
+        self.clients = [EventSourceClient("127.0.0.1:{}".format(port), "poll", targets[index % len(targets)],
+                                          callback = self._receive(index),
+                                          retry = -1,
+                                          http_client = self.http_client,
+                                          close_callback = self._close)
+                        for index in range(count)]
+
+    def _receive(self, index):
+        def receive(event):
+            now = time.time()
+            stamp, _, _ = event.data.partition(" ")
+            if stamp == "warmup":
+                self._ready.add(index)
+                return
+            self.latencies.append(now - float(stamp))
+            self.received += 1
+            self.last = now
+        return receive
+
+    def _close(self):
+        self._closed += 1
+
+    def connect(self):
+        for client in self.clients:
+            client.connect()
+
+    def unready_targets(self):
+        return set(client.target for index, client in enumerate(self.clients) if index not in self._ready)
+
+    async def close(self):
+        """waits for the streams to be closed by the listener, and ends the ones still open after a while"""
+        for _ in range(100):
+            if self._closed == len(self.clients):
+                break
+            await tornado.gen.sleep(0.05)
+        for client in self.clients:
+            client.end()
+        for client in self.clients:
+            if client._response is not None:
+                try:
+                    await client._response
+                except Exception:
+                    pass
+        self.http_client.close()
+
+async def post(publisher, target, data):
+    try:
+        await publisher.publish(target, "ping", data)
+    except PublishError:
+        pass
+
+async def warmup(publisher, subscribers):
+    """posts warmup events until every subscriber received one, so that all of them are connected"""
+    for _ in range(200):
+        targets = subscribers.unready_targets()
+        if not targets:
+            return
+        await tornado.gen.multi([post(publisher, target, "warmup") for target in targets])
+        await tornado.gen.sleep(0.05)
+    raise RuntimeError("{} targets did not get their subscribers connected".format(len(subscribers.unready_targets())))
+
+async def publish(publisher, targets, events, payload, burst, pause):
+    """
+    posts events on targets, by turns, from one publisher
+
+    :param burst: number of events posted at once before pausing, `0` to post them one after the other
+    """
+    if not burst:
+        for index in range(events):
+            await post(publisher, targets[index % len(targets)], "{:.6f} {}".format(time.time(), payload))
+        return
+    for start in range(0, events, burst):
+        await tornado.gen.multi([post(publisher, targets[index % len(targets)], "{:.6f} {}".format(time.time(), payload))
+                                 for index in range(start, min(events, start + burst))])
+        await tornado.gen.sleep(pause)
+
+async def run(scenario, args, pid):
+    if scenario in ("fan-out", "large-payload"):
+        targets = ["bench"]
+    else:
+        targets = ["bench{}".format(index) for index in range(args.subscribers)]
+    payload = "x" * (args.large if scenario == "large-payload" else 100)
+    events = args.events // 10 if scenario == "large-payload" else args.events
+    burst = args.burst if scenario == "bursty" else 0
+
+    connections = args.publishers * max(1, burst)
+    publisher = AsyncPublisher(port = args.port, max_clients = connections)
+    # opens all the connections of the publisher, before measuring the memory of the subscribers
+    await tornado.gen.multi([post(publisher, "warmup", "warmup") for _ in range(connections)])
+    base = rss(pid)
+    subscribers = Subscribers(args.port, targets, args.subscribers)
+    subscribers.connect()
+    await warmup(publisher, subscribers)
+    connected = rss(pid)
+
+    per_publisher = [targets[index::args.publishers] or targets for index in range(args.publishers)]
+    start = time.time()
+    await tornado.gen.multi([publish(publisher, per_publisher[index], events // args.publishers, payload, burst, 0.05)
+                             for index in range(args.publishers)])
+    posted = time.time()
+    posted_events = events // args.publishers * args.publishers
+    expected = posted_events * args.subscribers // len(targets)
+    deadline = posted + args.timeout
+    while subscribers.received < expected and time.time() < deadline:
+        await tornado.gen.sleep(0.01)
+    peak = rss(pid)
+
+    for target in targets:
+        try:
+            await publisher.publish(target, "close")
+        except PublishError:
+            pass
+    await subscribers.close()
+    publisher.close()
+
+    latencies = sorted(subscribers.latencies)
+    end = subscribers.last or posted
+    return dict(subscribers = args.subscribers,
+                targets = len(targets),
+                publishers = args.publishers,
+                events = posted_events,
+                payload = len(payload),
+                published_per_sec = posted_events / (posted - start),
+                received_per_sec = subscribers.received / (end - start),
+                lost = expected - subscribers.received,
+                latency_p50 = percentile(latencies, 0.5),
+                latency_p99 = percentile(latencies, 0.99),
+                latency_p999 = percentile(latencies, 0.999),
+                rss_per_connection = None if base is None else (connected - base) / float(args.subscribers),
+                rss_peak = peak)
+
+def environment(args):
+    try:
+        revision = subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd = ROOT,
+                                           stderr = subprocess.STDOUT).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return dict(revision = revision,
+                python = platform.python_version(),
+                tornado = tornado.version,
+                platform = platform.platform(),
+                cpus = os.cpu_count(),
+                listener_args = args.listener_args,
+                date = time.strftime("%Y-%m-%dT%H:%M:%S"))
+
+def report(scenario, result):
+    def us(value):
+        return float("nan") if value is None else value * 1e6
+    print("{:<16} {:>10.0f} posted/sec {:>10.0f} received/sec {:>8.0f} us p50 {:>8.0f} us p99 {:>8.0f} us p999 {:>8} lost {:>8.0f} bytes/connection".format(
+        scenario, result["published_per_sec"], result["received_per_sec"],
+        us(result["latency_p50"]), us(result["latency_p99"]), us(result["latency_p999"]),
+        result["lost"], result["rss_per_connection"] or float("nan")))
+
+def main():
+    parser = argparse.ArgumentParser(description="listener load test")
+    parser.add_argument("-s", dest="scenarios", action="append", choices=SCENARIOS, help="scenario to run, all of them by default")
+    parser.add_argument("-c", dest="subscribers", type=int, default=100, help="number of subscribers")
+    parser.add_argument("-p", dest="publishers", type=int, default=4, help="number of publishers")
+    parser.add_argument("-n", dest="events", type=int, default=2000, help="number of events, a tenth of them for large-payload")
+    parser.add_argument("-b", dest="burst", type=int, default=25, help="number of events per burst and publisher, for bursty")
+    parser.add_argument("-l", dest="large", type=int, default=64 * 1024, help="size of the payload, for large-payload")
+    parser.add_argument("-t", dest="timeout", type=float, default=10, help="time to wait for the events after the last POST, in seconds")
+    parser.add_argument("-P", dest="port", type=int, default=8891, help="port of the listener")
+    parser.add_argument("-a", dest="listener_args", default="", help="arguments given to the listener, like \"-q 1000 -o drop\"")
+    parser.add_argument("-o", dest="output", help="JSON file the results are saved to")
+    args = parser.parse_args()
+
+    results = dict(environment = environment(args), results = {})
+    print("{} subscribers, {} publishers, {} events".format(args.subscribers, args.publishers, args.events))
+    for scenario in args.scenarios or SCENARIOS:
+        command = [sys.executable, "-m", "eventsource.listener", "-H", "127.0.0.1", "-P", str(args.port)]
+        listener = subprocess.Popen(command + shlex.split(args.listener_args), cwd = ROOT,
+                                    stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+        try:
+            wait_for_port(args.port)
+            result = tornado.ioloop.IOLoop.current().run_sync(lambda: run(scenario, args, listener.pid))
+        finally:
+            listener.terminate()
+            listener.wait()
+        results["results"][scenario] = result
+        report(scenario, result)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent = 2, sort_keys = True)
+
+if __name__ == "__main__":
+    main()
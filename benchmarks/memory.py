@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -+- encoding: utf-8 -+-
+"""
+Measures the memory taken by each queued event, with the legacy events holding
+a dict against the slotted ones, and by each frame of a replay buffer, with the
+legacy ring of tuples against the packed rings.
+
+Values and frames are allocated before measuring, so that only the overhead of
+the events and of the buffer is counted.
+
+usage: python benchmarks/memory.py [-n EVENTS]
+"""
+
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from eventsource.listener import StringIdEvent
+from eventsource.replay import ReplayBuffer
+
+class LegacyEvent(object):
+    """Event as it was, with a dict, an id counter read through a property and a value split on every read"""
+    cnt = 0
+
+    def __init__(self, target, action, value = None):
+        self.target = target
+        self.action = action
+        self._value = value
+
+    def get_id(self):
+        if self.cnt == LegacyEvent.cnt:
+            self.cnt = LegacyEvent.cnt
+            LegacyEvent.cnt += 1
+        return self.cnt
+
+    id = property(get_id)
+
+    @property
+    def value(self):
+        return [line for line in self._value.split("\n")]
+
+class LegacyReplayBuffer(ReplayBuffer):
+    """ReplayBuffer as it was, with a ring of (id, time, frame) tuples"""
+    def __init__(self, size = 1000, max_age = 0):
+        ReplayBuffer.__init__(self, 1, max_age)
+        self.size = size
+        self._ring = [None] * size
+
+    def append(self, id, frame):
+        id = "{}".format(id)
+        self._ring[self._next % self.size] = (id, time.time(), frame)
+        self._index[id] = self._next
+        self._next += 1
+
+def measure(name, n, fn):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = fn()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print("{:<24} {:>12.1f} bytes/event {:>10.1f} MB".format(name, (after - before) / float(n), (after - before) / 1e6))
+    return kept
+
+def main():
+    parser = argparse.ArgumentParser(description="event and replay buffer memory benchmark")
+    parser.add_argument("-n", dest="events", type=int, default=1000000, help="number of events")
+    args = parser.parse_args()
+
+    values = ["value {}".format(i) for i in range(args.events)]
+    frames = [b"id: %d\r\nevent: ping\r\ndata: value %d\r\n\r\n" % (i, i) for i in range(args.events)]
+
+    def queue(cls):
+        def fill():
+            items = deque()
+            for value, frame in zip(values, frames):
+                event = cls("target", "ping", value)
+                event.id
+                items.append((event, frame))
+            return items
+        return fill
+
+    def replay(cls):
+        def fill():
+            buffer = cls(args.events)
+            for i, frame in enumerate(frames):
+                buffer.append(i, frame)
+            return buffer
+        return fill
+
+    print("{} events".format(args.events))
+    measure("legacy queued event", args.events, queue(LegacyEvent))
+    measure("slotted queued event", args.events, queue(StringIdEvent))
+    measure("legacy replay buffer", args.events, replay(LegacyReplayBuffer))
+    measure("packed replay buffer", args.events, replay(ReplayBuffer))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -+- encoding: utf-8 -+-
+"""
+Checks the incremental event-stream parser of the client against randomly
+fragmented streams, then measures its throughput on small and large events.
+
+usage: python benchmarks/parser.py [-n EVENTS] [-f FUZZ] [-s SIZE] [--seed SEED]
+"""
+
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from eventsource.client import EventParser
+
+EOLS = ["\r\n", "\n", "\r"]
+TEXT = "abcdefghij klmnopqrstuvwxyz:0123456789 éàü€"
+
+def random_stream(rnd, n):
+    """
+    :returns: the bytes of a stream of n events, with random line endings,
+        comments and unknown fields, and the list of expected (name, data, id)
+    """
+    parts = []
+    expected = []
+    last_id = None
+    for i in range(n):
+        eol = rnd.choice(EOLS)
+        if rnd.random() < 0.1:
+            parts.append(": comment {}{}".format(i, eol))
+        if rnd.random() < 0.1:
+            parts.append("unknown: field{}".format(eol))
+        name = rnd.choice([None, "ping", "update"])
+        if name is not None:
+            parts.append("event: {}{}".format(name, eol))
+        if rnd.random() < 0.7:
+            last_id = "{}".format(i)
+            parts.append("id: {}{}".format(last_id, eol))
+        lines = ["".join(rnd.choice(TEXT) for _ in range(rnd.randint(0, 40))) for _ in range(rnd.randint(1, 5))]
+        for line in lines:
+            space = " " if line.startswith(" ") else rnd.choice(["", " "])
+            parts.append("data:{}{}{}".format(space, line, eol))
+        parts.append(eol)
+        expected.append((name or "message", "\n".join(lines), last_id))
+    return "".join(parts).encode("utf-8"), expected
+
+def fragment(rnd, stream):
+    """
+    :returns: the stream cut in chunks of 1 to 512 bytes, cutting through lines,
+        CRLF pairs and multibyte characters
+    """
+    chunks = []
+    pos = 0
+    while pos < len(stream):
+        size = rnd.choice([1, 2, 3, rnd.randint(1, 512)])
+        chunks.append(stream[pos:pos + size])
+        pos += size
+    return chunks
+
+def parse(chunks):
+    parser = EventParser()
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    return events
+
+def fuzz(rnd, rounds, n):
+    for i in range(rounds):
+        stream, expected = random_stream(rnd, n)
+        got = [(e.name, e.data, e.id) for e in parse(fragment(rnd, stream))]
+        if got != expected:
+            for index, (a, b) in enumerate(zip(got, expected)):
+                if a != b:
+                    break
+            print("fuzz round {} failed at event {}: got {!r}, expected {!r}".format(i, index, a, b))
+            return False
+    print("{:<24} {:>12d} rounds of {} events".format("fuzz ok", rounds, n))
+    return True
+
+def run(name, n, chunks):
+    start = time.time()
+    events = parse(chunks)
+    elapsed = time.time() - start
+    assert len(events) == n
+    size = sum(len(chunk) for chunk in chunks)
+    print("{:<24} {:>12.0f} events/sec {:>8.1f} MB/sec".format(name, n / elapsed, size / elapsed / 1e6))
+
+def main():
+    parser = argparse.ArgumentParser(description="event-stream parser fuzzing and benchmark")
+    parser.add_argument("-n", dest="events", type=int, default=100000, help="number of small events")
+    parser.add_argument("-f", dest="fuzz", type=int, default=200, help="number of fuzzing rounds")
+    parser.add_argument("-s", dest="size", type=int, default=1024 * 1024, help="size of a large event, in bytes")
+    parser.add_argument("--seed", dest="seed", type=int, default=None, help="random seed")
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    if not fuzz(rnd, args.fuzz, 50):
+        sys.exit(1)
+
+    frame = "id: 42\r\nevent: ping\r\ndata: {\"value\": 42}\r\n\r\n".encode("utf-8")
+    stream = frame * args.events
+    run("small, 4KiB chunks", args.events, [stream[i:i + 4096] for i in range(0, len(stream), 4096)])
+
+    line = "data: {}\r\n".format("x" * 78).encode("utf-8")
+    large = b"event: blob\r\n" + line * (args.size // len(line)) + b"\r\n"
+    run("large, 16KiB chunks", 10, [large[i:i + 16384] for i in range(0, len(large), 16384)] * 10)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -+- encoding: utf-8 -+-
+"""
+Compares the lookups done on each POST with the legacy handler→target dict
+against the two ways ConnectionRegistry, for a large number of open connections.
+
+usage: python benchmarks/registry.py [-c CONNECTIONS] [-t TARGETS] [-n LOOKUPS]
+"""
+
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from eventsource.registry import ConnectionRegistry
+
+class Handler(object):
+    """Stands for a connected EventSourceHandler"""
+    __slots__ = ()
+
+def run(name, n, fn):
+    start = time.time()
+    fn()
+    elapsed = time.time() - start
+    print("{:<36} {:>14.0f} ops/sec".format(name, n / elapsed))
+
+def main():
+    parser = argparse.ArgumentParser(description="connection registry benchmark")
+    parser.add_argument("-c", dest="connections", type=int, default=100000, help="number of open connections")
+    parser.add_argument("-t", dest="targets", type=int, default=50000, help="number of distinct targets")
+    parser.add_argument("-n", dest="lookups", type=int, default=200, help="number of lookups")
+    args = parser.parse_args()
+
+    handlers = [Handler() for _ in range(args.connections)]
+    targets = ["target{}".format(i % args.targets) for i in range(args.connections)]
+    lookups = [random.choice(targets) for _ in range(args.lookups)]
+
+    legacy = {}
+    registry = ConnectionRegistry()
+    print("{} connections on {} targets".format(args.connections, args.targets))
+    run("legacy: register", args.connections, lambda: [legacy.__setitem__(h, t) for h, t in zip(handlers, targets)])
+    run("registry: register", args.connections, lambda: [registry.add(t, h) for h, t in zip(handlers, targets)])
+
+    run("legacy: is_connected", args.lookups, lambda: [t in legacy.values() for t in lookups])
+    run("registry: is_connected", args.lookups, lambda: [registry.is_connected(t) for t in lookups])
+    run("legacy: POST check + subscribers", args.lookups,
+        lambda: [(t in list(legacy.values()), [h for h, s in legacy.items() if s == t]) for t in lookups])
+    run("registry: POST check + subscribers", args.lookups,
+        lambda: [(registry.is_connected(t), list(registry.subscribers(t))) for t in lookups])
+    run("registry: count", args.lookups, lambda: [registry.count(t) for t in lookups])
+    run("registry: unregister", args.connections, lambda: [registry.remove(h) for h in handlers])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -+- encoding: utf-8 -+-
+"""
+Compares finding the subscriptions matching the topic of a published event, with
+a linear scan of the patterns against the TopicTrie, as the number of patterns grows.
+
+Topics have three levels, like `region3.shop12.item7`, and patterns replace one or
+two of their levels by `*`, or their last levels by `#`.
+
+usage: python benchmarks/topics.py [-p PATTERNS] [-n LOOKUPS]
+"""
+
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from eventsource.topics import TopicTrie, SEPARATOR, ANY_LEVEL, ANY_LEVELS
+
+def topic():
+    return SEPARATOR.join(["region{}".format(random.randint(0, 9)),
+                           "shop{}".format(random.randint(0, 99)),
+                           "item{}".format(random.randint(0, 999))])
+
+def pattern():
+    levels = topic().split(SEPARATOR)
+    kind = random.randint(0, 3)
+    if kind == 0:
+        levels[1] = ANY_LEVEL
+    elif kind == 1:
+        levels[2] = ANY_LEVEL
+    elif kind == 2:
+        levels[0] = levels[2] = ANY_LEVEL
+    else:
+        levels[random.randint(1, 2):] = [ANY_LEVELS]
+    return SEPARATOR.join(levels)
+
+def pattern_matches(pattern, levels):
+    for index, level in enumerate(pattern):
+        if level == ANY_LEVELS:
+            return True
+        if index == len(levels) or (level != ANY_LEVEL and level != levels[index]):
+            return False
+    return len(pattern) == len(levels)
+
+def scan_match(patterns, topic):
+    """matches every pattern against topic, level by level"""
+    levels = topic.split(SEPARATOR)
+    matched = set()
+    for pattern, values in patterns:
+        if pattern_matches(pattern, levels):
+            matched.update(values)
+    return matched
+
+def run(name, n, fn):
+    start = time.time()
+    fn()
+    elapsed = time.time() - start
+    print("{:<36} {:>14.0f} ops/sec".format(name, n / elapsed))
+
+def main():
+    parser = argparse.ArgumentParser(description="topic matching benchmark")
+    parser.add_argument("-p", dest="patterns", type=int, action="append", help="number of patterns, 10, 1000 and 100000 by default")
+    parser.add_argument("-n", dest="lookups", type=int, default=2000, help="number of lookups")
+    args = parser.parse_args()
+
+    random.seed(0)
+    lookups = [topic() for _ in range(args.lookups)]
+    for count in args.patterns or [10, 1000, 100000]:
+        trie = TopicTrie()
+        scanned = {}
+        for index in range(count):
+            followed = pattern()
+            trie.add(followed, index)
+            scanned.setdefault(followed, set()).add(index)
+        scanned = [(followed.split(SEPARATOR), values) for followed, values in scanned.items()]
+        assert all(trie.match(t) == scan_match(scanned, t) for t in lookups[:100])
+        print("{} patterns".format(count))
+        run("scan: match", args.lookups, lambda: [scan_match(scanned, t) for t in lookups])
+        run("trie: match", args.lookups, lambda: [trie.match(t) for t in lookups])
+
+if __name__ == "__main__":
+    main()
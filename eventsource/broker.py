@@ -0,0 +1,341 @@
+# -+- encoding: utf-8 -+-
+"""
+.. module:: broker
+:platform: Unix
+:synopsis: This module relays events between the nodes of a cluster of listeners
+
+A node is a listener process, either one of the workers of a host, or a listener
+running on another host. Every node keeps a directory telling which nodes have
+subscribers for each target, fed by the announcements of the other nodes, so that
+an event posted on any node is only sent to the nodes holding subscribers of its
+target. Directories are `TopicTrie`, so that a node following a pattern of topics
+gets the events posted on every topic it matches. When events are kept to be replayed,
+a `SocketBroker` can replicate the events having an id to every node, so that each
+node's store holds the events posted on all of them.
+
+Two brokers are available:
+    - **LocalBroker** links nodes running in the same process
+    - **SocketBroker** links nodes over TCP or unix domain sockets
+
+.. note::
+Messages of `SocketBroker` are a header giving the length of a JSON object and of an
+optional frame, followed by the JSON object, and by the bytes of the frame::
+
+    {"op": "sync", "node": "10.0.0.1:9000", "targets": ["a", "b"]}   all the targets of a node, on connection
+    {"op": "sub", "target": "a"}                                     a node got its first subscriber of a target
+    {"op": "unsub", "target": "a"}                                   a node lost its last subscriber of a target
+    {"op": "event", "target": "a", "action": "ping", "id": 42} + frame
+"""
+
+from __future__ import unicode_literals
+
+import socket
+import struct
+import logging
+
+from tornado.escape import json_decode, json_encode
+import tornado.gen
+import tornado.ioloop
+import tornado.iostream
+import tornado.netutil
+
+from eventsource.topics import TopicTrie
+
+log = logging.getLogger("eventsource.broker")
+
+HEADER = struct.Struct("!II")
+
+def encode_message(message, frame = None):
+    """
+    :param message: dict to be sent
+    :param frame: bytes of an encoded event, or `None`
+    :returns: bytes of the message
+    """
+    meta = json_encode(message).encode("utf-8")
+    frame = frame or b""
+    return b"".join((HEADER.pack(len(meta), len(frame)), meta, frame))
+
+def parse_address(address):
+    """
+    :param address: either `host:port`, or the path of a unix domain socket
+    :returns: a (socket family, socket address) tuple
+    :raises ValueError: if the port is not a number
+    """
+    if "/" in address or ":" not in address:
+        return socket.AF_UNIX, address
+    host, port = address.rsplit(":", 1)
+    return socket.AF_INET, (host, int(port))
+
+class Broker(object):
+    """
+    Interface of the brokers, relaying events to the other nodes having subscribers for their target
+
+    Members:
+        - **deliver** function taking (target, action, id, frame), called for every event
+          relayed from another node, `frame` being `None` for `Event.FINISH` events
+        - **targets** set of the targets having subscribers on the current node
+    """
+    def __init__(self, deliver = None):
+        """
+        :param deliver: function called for every event relayed from another node
+        """
+        self.deliver = deliver
+        self.targets = set()
+
+    def start(self):
+        """
+        Connects to the other nodes
+        """
+        pass
+
+    def close(self):
+        """
+        Disconnects from the other nodes
+        """
+        pass
+
+    def subscribe(self, target):
+        """
+        Announces that the current node has subscribers for a target
+
+        :param target: string identifying a given target
+        """
+        raise NotImplementedError
+
+    def unsubscribe(self, target):
+        """
+        Announces that the current node has no more subscribers for a target
+
+        :param target: string identifying a given target
+        """
+        raise NotImplementedError
+
+    def is_connected(self, target):
+        """
+        :param target: string identifying a given target
+        :returns: true if another node has subscribers for target
+        """
+        raise NotImplementedError
+
+    def publish(self, target, action, id, frame):
+        """
+        Sends an event to the other nodes having subscribers for its target
+
+        :param target: string identifying the target of the event
+        :param action: action of the event
+        :param id: id of the event, or `None`
+        :param frame: bytes of the encoded event, or `None` for `Event.FINISH` events
+        """
+        raise NotImplementedError
+
+class LocalBroker(Broker):
+    """
+    Broker linking the nodes of the same process, which share their directory
+
+    A broker built without directory is a standalone node. Events are delivered
+    to the other nodes from the IOLoop, as if they came from a socket.
+    """
+    def __init__(self, deliver = None, directory = None):
+        """
+        :param deliver: function called for every event relayed from another node
+        :param directory: `TopicTrie` of the nodes having subscribers for each target, shared by the nodes
+        """
+        Broker.__init__(self, deliver)
+        self.directory = TopicTrie() if directory is None else directory
+
+    def subscribe(self, target):
+        self.targets.add(target)
+        self.directory.add(target, self)
+
+    def unsubscribe(self, target):
+        self.targets.discard(target)
+        self.directory.remove(target, self)
+
+    def is_connected(self, target):
+        nodes = self.directory.match(target)
+        return len(nodes) > (1 if self in nodes else 0)
+
+    def publish(self, target, action, id, frame):
+        io_loop = tornado.ioloop.IOLoop.current()
+        for node in self.directory.match(target):
+            if node is not self:
+                io_loop.add_callback(node.deliver, target, action, id, frame)
+
+class _Peer(object):
+    """
+    Outgoing connection to another node, connected again when lost
+
+    messages written while connecting are kept until the connection is up. Once a
+    connection is lost, they are dropped: the node is restarting, and its former
+    subscribers are gone.
+    """
+    RECONNECT_DELAY = 0.1
+
+    def __init__(self, broker, address):
+        self.broker = broker
+        self.address = address
+        self.stream = None
+        self._pending = []
+
+    async def connect(self):
+        family, address = parse_address(self.address)
+        while not self.broker.closed:
+            stream = tornado.iostream.IOStream(socket.socket(family, socket.SOCK_STREAM))
+            try:
+                await stream.connect(address)
+            except tornado.iostream.StreamClosedError:
+                await tornado.gen.sleep(self.RECONNECT_DELAY)
+                continue
+            log.debug("node %s connected to node %s", self.broker.address, self.address)
+            stream.set_nodelay(True)
+            self.stream = stream
+            stream.write(encode_message(dict(op = "sync", node = self.broker.address, targets = list(self.broker.targets))))
+            if self._pending:
+                stream.write(b"".join(self._pending))
+                self._pending = []
+            stream.set_close_callback(self._on_close)
+            return
+
+    def _on_close(self):
+        self.stream = None
+        self._pending = []
+        if not self.broker.closed:
+            tornado.ioloop.IOLoop.current().spawn_callback(self.connect)
+
+    def write(self, data):
+        if self.stream is None:
+            self._pending.append(data)
+        else:
+            self.stream.write(data)
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+
+class SocketBroker(Broker):
+    """
+    Broker linking nodes over sockets
+
+    Every node listens on its address, and connects to the address of every other node.
+    Nodes are identified by their address, which is either `host:port` or the path of a
+    unix domain socket.
+    """
+    def __init__(self, address, peers, deliver = None, replicate = False):
+        """
+        :param address: address of the current node
+        :param peers: list of the addresses of the other nodes
+        :param deliver: function called for every event relayed from another node
+        :param replicate: if true, the events having an id are sent to every node, to be stored for replay
+        """
+        Broker.__init__(self, deliver)
+        self.address = address
+        self.replicate = replicate
+        self.closed = False
+        self._remote = TopicTrie()
+        self._streams = {}
+        self._peers = [_Peer(self, peer) for peer in peers if peer != address]
+        self._sockets = []
+
+    def start(self):
+        """
+        Listens for the other nodes, and connects to them
+        """
+        family, address = parse_address(self.address)
+        if family == socket.AF_UNIX:
+            self._sockets = [tornado.netutil.bind_unix_socket(address)]
+        else:
+            self._sockets = tornado.netutil.bind_sockets(address[1], address[0])
+        for sock in self._sockets:
+            tornado.netutil.add_accept_handler(sock, self._on_accept)
+        for peer in self._peers:
+            tornado.ioloop.IOLoop.current().spawn_callback(peer.connect)
+
+    def close(self):
+        """
+        Closes the connections to and from the other nodes
+        """
+        self.closed = True
+        for peer in self._peers:
+            peer.close()
+        for stream in list(self._streams.values()):
+            stream.close()
+        for sock in self._sockets:
+            tornado.ioloop.IOLoop.current().remove_handler(sock)
+            sock.close()
+
+    def _broadcast(self, data):
+        for peer in self._peers:
+            peer.write(data)
+
+    def subscribe(self, target):
+        if target not in self.targets:
+            self.targets.add(target)
+            self._broadcast(encode_message(dict(op = "sub", target = target)))
+
+    def unsubscribe(self, target):
+        if target in self.targets:
+            self.targets.discard(target)
+            self._broadcast(encode_message(dict(op = "unsub", target = target)))
+
+    def is_connected(self, target):
+        return self._remote.matches(target)
+
+    def publish(self, target, action, id, frame):
+        if self.replicate and id is not None and frame is not None:
+            self._broadcast(encode_message(dict(op = "event", target = target, action = action, id = id), frame))
+            return
+        nodes = self._remote.match(target)
+        if not nodes:
+            return
+        data = encode_message(dict(op = "event", target = target, action = action, id = id), frame)
+        for peer in self._peers:
+            if peer.address in nodes:
+                peer.write(data)
+
+    def _on_accept(self, connection, address):
+        stream = tornado.iostream.IOStream(connection)
+        tornado.ioloop.IOLoop.current().spawn_callback(self._read, stream)
+
+    def _forget(self, node):
+        for target in list(self._remote):
+            self._remote.remove(target, node)
+
+    async def _read(self, stream):
+        """
+        reads the messages of another node until its connection is closed
+
+        the targets of a node are only updated from its latest connection, as the
+        connection of a restarted node may be up before its former one is seen closed.
+        """
+        node = None
+        try:
+            while True:
+                header = await stream.read_bytes(HEADER.size)
+                meta_size, frame_size = HEADER.unpack(header)
+                data = await stream.read_bytes(meta_size + frame_size)
+                message = json_decode(data[:meta_size])
+                op = message["op"]
+                if op == "event":
+                    self.deliver(message["target"], message["action"], message["id"],
+                                 data[meta_size:] if frame_size else None)
+                elif self._streams.get(node) is not stream and op != "sync":
+                    continue
+                elif op == "sub":
+                    self._remote.add(message["target"], node)
+                elif op == "unsub":
+                    self._remote.remove(message["target"], node)
+                elif op == "sync":
+                    node = message["node"]
+                    self._streams[node] = stream
+                    self._forget(node)
+                    for target in message["targets"]:
+                        self._remote.add(target, node)
+        except tornado.iostream.StreamClosedError:
+            pass
+        except Exception as err:
+            log.error("_read(node %s): %s", node, err)
+            stream.close()
+        if node is not None and self._streams.get(node) is stream:
+            log.debug("node %s lost node %s", self.address, node)
+            del(self._streams[node])
+            self._forget(node)
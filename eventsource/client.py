@@ -10,31 +10,271 @@
 
 """
 import sys
-import time
+import random
 import argparse
+import functools
 import logging
+from urllib.parse import quote, urlencode
 log = logging.getLogger("eventsource.client")
 
 from tornado.ioloop import IOLoop
-from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tornado.queues import Queue
+from tornado.httpclient import HTTPRequest
+from tornado.curl_httpclient import CurlAsyncHTTPClient
 
 class Event(object):
     """
     Contains a received event to be processed
+
+    `target` is the topic the event was posted on, given by listeners following topics,
+    or `None`.
     """
-    def __init__(self):
-        self.name = None
-        self.data = None
-        self.id = None
+    def __init__(self, name = None, data = None, id = None, target = None):
+        self.name = name
+        self.data = data
+        self.id = id
+        self.target = target
 
     def __repr__(self):
         return "Event<%s,%s,%s>" % (str(self.id), str(self.name), str(self.data.replace("\n","\\n")))
 
-class EventSourceClient(object):
+class EventParser(object):
+    """
+    Incremental parser of an event stream
+
+    Chunks of the stream are fed as they come, and every event completed by a chunk
+    is returned. Lines can end with CRLF, LF or CR, and be split anywhere between two
+    chunks. The parts of an incomplete line, and the data lines of an incomplete event,
+    are kept in lists until completed, so a large event split in many chunks is joined
+    only once.
+
+    Members:
+        - **last_event_id** is the value of the last `id` field received
+        - **retry** is the value of the last valid `retry` field received, or `None`
+    """
+    def __init__(self):
+        self.last_event_id = None
+        self.retry = None
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets the incomplete line and event, to parse a new stream
+        """
+        self._line = []
+        self._skip_lf = False
+        self._name = None
+        self._target = None
+        self._data = []
+
+    def feed(self, chunk):
+        """
+        Parses a chunk of the stream
+
+        :param chunk: bytes read from the stream
+        :returns: list of the events completed by the chunk
+        """
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode("utf-8")
+        if self._skip_lf and chunk[:1] == b"\n":
+            chunk = chunk[1:]
+        if not chunk:
+            return []
+        self._skip_lf = chunk[-1:] == b"\r"
+        events = []
+        for line in chunk.splitlines(True):
+            if line[-1:] == b"\n":
+                line = line[:-2] if line[-2:] == b"\r\n" else line[:-1]
+            elif line[-1:] == b"\r":
+                line = line[:-1]
+            else:
+                self._line.append(line)
+                break
+            if self._line:
+                self._line.append(line)
+                line = b"".join(self._line)
+                self._line = []
+            event = self._parse_line(line)
+            if event is not None:
+                events.append(event)
+        return events
+
+    def _parse_line(self, line):
+        """
+        Processes a complete line of the stream
+
+        :returns: the event dispatched by an empty line, if any
+        """
+        if not line:
+            if not self._data:
+                self._name = None
+                self._target = None
+                return None
+            event = Event(self._name or "message", "\n".join(self._data), self.last_event_id, self._target)
+            self._name = None
+            self._target = None
+            self._data = []
+            return event
+        line = line.decode("utf-8", "replace")
+        if line.startswith(":"):
+            log.debug("received comment: %s" % (line[1:],))
+            return None
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if field == "data":
+            self._data.append(value)
+        elif field == "event":
+            self._name = value
+        elif field == "target":
+            self._target = value
+        elif field == "id":
+            if "\0" not in value:
+                self.last_event_id = value
+        elif field == "retry":
+            if value.isdigit():
+                self.retry = int(value)
+        return None
+
+class ReconnectPolicy(object):
+    """
+    Tells how long a client waits before reconnecting
+
+    The delay is the `retry` value, given by the server or the client, plus a random
+    part drawn between 0 and a window growing exponentially with the number of failed
+    connections in a row (full jitter), so that clients disconnected together do not
+    come back together. The window is capped to `max_delay`, and the client gives
+    up after `max_attempts` failed connections in a row.
+
+    A connection failed if it was closed before receiving anything.
+
+    Members (counters):
+        - **attempts** number of failed connections in a row
+        - **reconnects** number of reconnections
+        - **failures** number of failed connections
+        - **total_delay** time spent waiting before reconnections, in milliseconds
+        - **last_delay** last delay before a reconnection, in milliseconds
+    """
+    def __init__(self, retry = 0, backoff = 1000, factor = 2, max_delay = 30000, max_attempts = 0):
+        """
+        :param retry: minimum delay before a reconnection, in milliseconds, updated by the server
+        :param backoff: window of the random delay after the first failure, in milliseconds
+        :param factor: growth of the window after each failure in a row
+        :param max_delay: maximum window of the random delay, in milliseconds
+        :param max_attempts: number of failed connections in a row before giving up, `0` never gives up
+        """
+        self.retry = int(retry)
+        self.backoff = backoff
+        self.factor = factor
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.attempts = 0
+        self.reconnects = 0
+        self.failures = 0
+        self.total_delay = 0
+        self.last_delay = 0
+
+    def connected(self):
+        """
+        Records a connection that received data, resetting the backoff
+        """
+        self.attempts = 0
+
+    def failed(self):
+        """
+        Records a failed connection
+        """
+        self.attempts += 1
+        self.failures += 1
+
+    def next_delay(self):
+        """
+        :returns: the delay before the next reconnection, in milliseconds,
+            or `None` to give up
+        """
+        if self.max_attempts and self.attempts >= self.max_attempts:
+            return None
+        window = min(self.max_delay, self.backoff * self.factor ** max(self.attempts - 1, 0))
+        delay = self.retry + random.uniform(0, window)
+        self.reconnects += 1
+        self.total_delay += delay
+        self.last_delay = delay
+        return delay
+
+    def stats(self):
+        """
+        :returns: a dict of the counters
+        """
+        return dict(attempts = self.attempts,
+                    reconnects = self.reconnects,
+                    failures = self.failures,
+                    total_delay = self.total_delay,
+                    last_delay = self.last_delay)
+
+class EventQueue(object):
+    """
+    Mixin queueing the received events for asynchronous iteration
+
+    Until the iteration starts, events are passed to the callback function. Once it
+    started, they are queued until read::
+
+        async for event in client:
+            ...
+
+    or one at a time::
+
+        event = await client.next_event()
+
+    the iteration ends when the client stops listening.
+    """
+    _events = None
+
+    def _queue(self):
+        if self._events is None:
+            self._events = Queue()
+        return self._events
+
+    def _queue_end(self):
+        if self._events is not None:
+            self._events.put_nowait(None)
+
+    async def next_event(self):
+        """
+        :returns: the next received event, or `None` once the client stopped listening
+        """
+        queue = self._queue()
+        event = await queue.get()
+        if event is None:
+            queue.put_nowait(None)
+        return event
+
+    def __aiter__(self):
+        self._queue()
+        return self
+
+    async def __anext__(self):
+        event = await self.next_event()
+        if event is None:
+            raise StopAsyncIteration()
+        return event
+
+class EventSourceClient(EventQueue):
     """
     This module opens a new connection to an eventsource server, and wait for events.
+
+    The client does not block: `connect()` starts listening in the current IOLoop, and
+    reconnections are scheduled on that IOLoop, so that many clients, and any other
+    tornado code, can run together. `poll()` keeps the former blocking behaviour.
+
+    The delay before each reconnection is given by a ReconnectPolicy, and the same
+    request is sent again, only its `Last-Event-ID` header being updated.
+
+    Compressed streams are accepted, and decompressed as they are received.
+
+    The client may ask the server to only send the events of some actions, or the events
+    which JSON value holds predicates, like `price>10`, see the filters module of the listener.
     """
-    def __init__(self, url, action, target, callback = None, retry = 0, keep_alive = False, ssl = False, validate_cert = False, user = None, password = None):
+    def __init__(self, url, action, target, callback = None, retry = 0, keep_alive = False, ssl = False, validate_cert = False, user = None, password = None, http_client = None, close_callback = None, policy = None, compression = True, actions = None, filters = None):
         """
         Build the event source client
         :param url: string, the url to connect to
@@ -42,26 +282,50 @@ class EventSourceClient(object):
         :param target: string with the listening token
         :param callback: function with one parameter (Event) that gets called for each received event
         :param retry: timeout between two reconnections (0 means no reconnection)
+        :param http_client: CurlAsyncHTTPClient to fetch the stream with, only fetching event streams,
+            a client of its own by default
+        :param close_callback: function without parameter called once the client stopped listening
+        :param policy: ReconnectPolicy of the client, built from retry by default
+        :param compression: if true, the server may send the stream compressed with gzip or deflate
+        :param actions: list of the actions of the events sent by the server, or `None` for all of them
+        :param filters: list of the predicates the values of the events sent by the server shall hold
         """
         log.debug("EventSourceClient(%s,%s,%s,%s,%s)" % (url, action, target, callback, retry))
 
-        self.data_partial = None
+        self.target = target
         self.last_event_id = None
-        self.retry_timeout = int(retry)
+        self._parser = EventParser()
+        self.policy = ReconnectPolicy(retry) if policy is None else policy
         self.keep_alive = keep_alive
-        self._url = "%s://%s/%s/%s" % ("https" if ssl else "http", url, action, target)
+        # quoted, for the `#` level of topic patterns not to be taken for a fragment
+        self._url = "%s://%s/%s/%s" % ("https" if ssl else "http", url, action, quote(target, safe = "/,*"))
+        query = [("filter", predicate) for predicate in filters or []]
+        if actions:
+            query.insert(0, ("action", ",".join(actions)))
+        if query:
+            self._url += "?" + urlencode(query)
         self._headers = {"Accept": "text/event-stream"}
         self._user = user
         self._password = password
-
-        AsyncHTTPClient.configure("tornado.curl_httpclient.CurlAsyncHTTPClient")
-        self.http_client = AsyncHTTPClient()
+        self._close_callback = close_callback
+        self._timeout = None
+        self._response = None
+        self._received = False
+        self._closed = True
+        self._stop_loop = False
+
+        # the progress function set on curl handles stays on them when they are reused, so
+        # that streams are not fetched with the AsyncHTTPClient shared by the other requests
+        self._owns_client = http_client is None
+        self.http_client = http_client
         self.http_request = HTTPRequest(url = self._url,
                                         method="GET",
-                                        headers={"content-type":"text/event-stream"},
+                                        headers = self._headers,
                                         request_timeout = 0,
                                         validate_cert = validate_cert,
+                                        decompress_response = compression,
                                         streaming_callback = self.handle_stream,
+                                        prepare_curl_callback = self._prepare_curl,
                                         auth_username = user,
                                         auth_password = password)
         if callback is None:
@@ -78,91 +342,151 @@ class EventSourceClient(object):
             self._headers["Last-Event-ID"] = self.last_event_id
         return self._headers
 
+    @property
+    def retry_timeout(self):
+        """
+        timeout before reconnecting, in milliseconds, `-1` when the client will not reconnect
+        """
+        return self.policy.retry
+
+    @retry_timeout.setter
+    def retry_timeout(self, value):
+        self.policy.retry = value
+
     def _get_request(self):
         """
-        Return a suitablty initialized HTTPRequest
+        Return the HTTPRequest, with up to date headers
+        """
+        self.http_request.headers.update(self._get_headers())
+        return self.http_request
+
+    def _prepare_curl(self, curl):
+        """
+        Makes curl abort the transfer once the client is closed, from its progress
+        function, called about once per second even when the stream is idle
+
+        as curl handles are reused without resetting their progress function, the
+        CurlAsyncHTTPClient of the client shall only fetch event streams, each one setting its own.
+        """
+        import pycurl
+        curl.setopt(pycurl.NOPROGRESS, 0)
+        curl.setopt(getattr(pycurl, "XFERINFOFUNCTION", pycurl.PROGRESSFUNCTION),
+                    lambda *_: 1 if self._closed else 0)
+
+    def connect(self):
+        """
+        Starts listening in the current IOLoop, without blocking
+
+        :returns: the client itself
         """
-        return HTTPRequest(url = self._url,
-                method="GET",
-                headers = self._get_headers(),
-                request_timeout = 0,
-                streaming_callback = self.handle_stream,
-                auth_username = self._user,
-                auth_password = self._password)
+        log.debug("connect()")
+
+        if self._closed:
+            self._closed = False
+            self._fetch()
+        return self
 
     def poll(self):
         """
-        Function to call to start listening
+        Function to call to start listening, blocking until the client stops listening
         """
         log.debug("poll()")
 
-        while True:
-            self.http_client.fetch(self._get_request(), self.handle_request)
-            IOLoop.instance().start()
-            if self.retry_timeout == -1:
-                break
-            time.sleep(self.retry_timeout/1000)
+        self._stop_loop = True
+        self.connect()
+        IOLoop.current().start()
 
     def end(self):
         """
         Function to call to end listening
         """
         log.debug("end()")
-        
-        self.retry_timeout=-1
-        IOLoop.instance().stop()
-    
+
+        self.retry_timeout = -1
+        if self._closed:
+            return
+        self._closed = True
+        if self._timeout is not None:
+            IOLoop.current().remove_timeout(self._timeout)
+            self._timeout = None
+        self._queue_end()
+        if self._response is None or self._response.done():
+            self._release_client()
+        if self._close_callback is not None:
+            self._close_callback()
+        if self._stop_loop:
+            IOLoop.current().stop()
+
+    def _release_client(self):
+        """
+        closes the CurlAsyncHTTPClient of the client once its stream is over, if it is its own
+        """
+        if self._owns_client and self.http_client is not None:
+            self.http_client.close()
+            self.http_client = None
+
+    def _fetch(self):
+        if self.http_client is None:
+            self.http_client = CurlAsyncHTTPClient(force_instance = True, max_clients = 1)
+        self._timeout = None
+        self._received = False
+        self._parser.reset()
+        self._response = self.http_client.fetch(self._get_request(), raise_error = False)
+        IOLoop.current().add_future(self._response, self._on_response)
+
+    def _on_response(self, future):
+        """
+        Called when the stream ends, to handle the response and schedule the reconnection
+
+        since tornado 6, transfers aborted by `end()` fail with an error, which is ignored.
+        """
+        if self._closed:
+            future.exception()
+            self._release_client()
+            return
+        try:
+            response = future.result()
+        except Exception as err:
+            log.error(err)
+            if not self.keep_alive:
+                self.retry_timeout=-1
+        else:
+            self.handle_request(response)
+        if not self._received:
+            self.policy.failed()
+        delay = None if self.retry_timeout == -1 else self.policy.next_delay()
+        if delay is None:
+            self.end()
+        else:
+            log.info("reconnecting in %dms (%d failures in a row)" % (delay, self.policy.attempts))
+            self._timeout = IOLoop.current().call_later(delay/1000.0, self._fetch)
+
     def handle_stream(self, message):
         """
         Acts on message reception
-        :param message: string of an incoming message
+        :param message: bytes of an incoming chunk of the stream
 
-        parse all the fields and builds an Event object that is passed to the callback function
+        parse all the fields and builds an Event object for each complete event,
+        that is passed to the callback function, or queued if the client is iterated
         """
         log.debug("handle_stream(...)")
 
-        if not message.endswith("\n"):
-            log.debug("got partial chunk")
-            if self.data_partial:
-                self.data_partial += message
-            else:
-                self.data_partial = message
+        if self._closed:
             return
-
-        if self.data_partial:
-            log.debug("rebuiling chunked response")
-            message = self.data_partial + message
-            self.data_partial = None
-
-        event = Event()
-        for line in message.strip().splitlines():
-            (field, value) = line.split(":", 1)
-            field = field.strip()
-            
-            if field == "event":
-                event.name = value.lstrip()
-            elif field == "data":
-                value = value.lstrip()
-                if event.data is None:
-                    event.data = value
-                else:
-                    event.data = "%s\n%s" % (event.data, value)
-            elif field == "id":
-                event.id = value.lstrip()
-                self.last_event_id = event.id
-            elif field == "retry":
-                try:
-                    self.retry_timeout = int(value)
-                    log.info( "timeout reset: %s" % (value,) )
-                except ValueError:
-                    pass
-            elif field == "":
-                log.debug( "received comment: %s" % (value,) )
+        if not self._received:
+            self._received = True
+            self.policy.connected()
+        events = self._parser.feed(message)
+        self.last_event_id = self._parser.last_event_id
+        if self._parser.retry is not None:
+            self.retry_timeout = self._parser.retry
+            self._parser.retry = None
+            log.info( "timeout reset: %s" % (self.retry_timeout,) )
+        for event in events:
+            if self._events is not None:
+                self._events.put_nowait(event)
             else:
-                raise Exception("Unknown field !")
-        if event.name is not None:
-            self.cb(event)
-            
+                self.cb(event)
 
     def handle_request(self, response):
         """
@@ -183,7 +507,112 @@ class EventSourceClient(object):
             log.info("disconnection requested")
             if not self.keep_alive:
                 self.retry_timeout=-1
-        IOLoop.instance().stop()
+
+class EventSourceMultiplexer(EventQueue):
+    """
+    Follows the streams of many targets of a server in one IOLoop
+
+    Every stream is an EventSourceClient, and all of them share one CurlAsyncHTTPClient,
+    allowing `max_clients` simultaneous connections. Streams subscribed beyond that
+    limit wait for a connection to be freed.
+
+    Each event is passed with its target to the callback function, or, once the
+    multiplexer is iterated, queued as a `(target, event)` tuple.
+    """
+    def __init__(self, url, action, callback = None, max_clients = 512, policy = ReconnectPolicy, **kwargs):
+        """
+        :param url: string, the url to connect to
+        :param action: string of the listening action to connect to
+        :param callback: function with two parameters (target, Event) that gets called for each received event
+        :param max_clients: maximum number of simultaneous connections
+        :param policy: function building the ReconnectPolicy of a stream, taking the retry argument
+        :param kwargs: other arguments given to every EventSourceClient
+        """
+        log.debug("EventSourceMultiplexer(%s,%s,%s,%s)" % (url, action, callback, max_clients))
+
+        self._url = url
+        self._action = action
+        self._kwargs = kwargs
+        self._policy = policy
+        self._clients = {}
+        self.max_clients = max_clients
+        self.http_client = CurlAsyncHTTPClient(force_instance = True, max_clients = max_clients)
+        if callback is None:
+            self.cb = lambda target, e: log.info( "received %s on %s" % (e, target) )
+        else:
+            self.cb = callback
+
+    def __len__(self):
+        return len(self._clients)
+
+    def __contains__(self, target):
+        return target in self._clients
+
+    def subscribe(self, target):
+        """
+        Starts listening to a target
+
+        :param target: string with the listening token
+        :returns: the EventSourceClient listening to target
+        """
+        if target in self._clients:
+            return self._clients[target]
+        if len(self._clients) >= self.max_clients:
+            log.warning("subscribe(%s): more than %d streams, waiting for a free connection" % (target, self.max_clients))
+        client = EventSourceClient(self._url, self._action, target,
+                                   callback = functools.partial(self._dispatch, target),
+                                   http_client = self.http_client,
+                                   close_callback = functools.partial(self._on_close, target),
+                                   policy = self._policy(self._kwargs.get("retry", 0)),
+                                   **self._kwargs)
+        self._clients[target] = client
+        return client.connect()
+
+    def unsubscribe(self, target):
+        """
+        Stops listening to a target
+
+        :param target: string with the listening token
+        """
+        client = self._clients.pop(target, None)
+        if client is not None:
+            client.end()
+
+    def stats(self):
+        """
+        :returns: a dict of the ReconnectPolicy counters, summed over the streams
+        """
+        stats = dict(streams = len(self._clients), reconnects = 0, failures = 0, total_delay = 0)
+        for client in self._clients.values():
+            for key in ("reconnects", "failures", "total_delay"):
+                stats[key] += getattr(client.policy, key)
+        return stats
+
+    async def close(self):
+        """
+        Stops listening to every target, and closes the connections once their
+        transfers are aborted
+        """
+        clients = list(self._clients.values())
+        for client in clients:
+            self.unsubscribe(client.target)
+        self._queue_end()
+        for client in clients:
+            if client._response is not None:
+                try:
+                    await client._response
+                except Exception:
+                    pass
+        self.http_client.close()
+
+    def _dispatch(self, target, event):
+        if self._events is not None:
+            self._events.put_nowait((target, event))
+        else:
+            self.cb(target, event)
+
+    def _on_close(self, target):
+        self._clients.pop(target, None)
 
 def start():
     """helper method to create a commandline utility"""
@@ -224,12 +653,42 @@ def start():
                         default="0",
                         help="Reconnection delay (in microseconds)")
 
+    parser.add_argument("-b",
+                        "--backoff",
+                        dest="backoff",
+                        default="1000",
+                        help="Window of the random delay added after the first failed reconnection, doubled after each failure (in milliseconds)")
+
+    parser.add_argument("-m",
+                        "--max-delay",
+                        dest="max_delay",
+                        default="30000",
+                        help="Maximum window of the random reconnection delay (in milliseconds)")
+
     parser.add_argument("-k",
                         "--keep-reconnecting",
                         dest="keep_alive",
                         action="store_true",
                         help="Keep trying to reconnect on disconnection")
 
+    parser.add_argument("-n",
+                        "--no-compression",
+                        dest="compression",
+                        action="store_false",
+                        help="Asks the server not to compress the stream")
+
+    parser.add_argument("-A",
+                        "--accept",
+                        dest="actions",
+                        action="append",
+                        help="Action of the events to be sent by the server, all of them by default")
+
+    parser.add_argument("-f",
+                        "--filter",
+                        dest="filters",
+                        action="append",
+                        help="Predicate the JSON value of the events sent by the server shall hold, like price>10")
+
     parser.add_argument("-a",
                         "--action",
                         dest="action",
@@ -252,7 +711,8 @@ def start():
                         help="Password for basic authentication")
 
     parser.add_argument(dest="token",
-                        help="Token to be used for connection")
+                        nargs="+",
+                        help="Token to be used for connection, many tokens are followed over shared connections")
 
     args = parser.parse_args()
 
@@ -263,6 +723,15 @@ def start():
 
     ###
 
+    try:
+        policy = functools.partial(ReconnectPolicy,
+                                   backoff = int(args.backoff),
+                                   max_delay = int(args.max_delay))
+        policy(int(args.retry))
+    except ValueError:
+        log.error("retry, backoff and max delay take numerical values")
+        sys.exit(1)
+
     if not args.port:
         if args.ssl:
             port = "443"
@@ -276,15 +745,37 @@ def start():
     else:
         dst = "%s:%s" % (args.host, port)
 
-    EventSourceClient(url = dst,
-                      action = args.action,
-                      target = args.token,
-                      retry = args.retry,
-                      keep_alive = args.keep_alive,
-                      ssl = args.ssl,
-                      validate_cert = args.validate_cert,
-                      user = args.user,
-                      password = args.password).poll()
+    if len(args.token) == 1:
+        EventSourceClient(url = dst,
+                          action = args.action,
+                          target = args.token[0],
+                          retry = args.retry,
+                          keep_alive = args.keep_alive,
+                          ssl = args.ssl,
+                          validate_cert = args.validate_cert,
+                          user = args.user,
+                          password = args.password,
+                          compression = args.compression,
+                          actions = args.actions,
+                          filters = args.filters,
+                          policy = policy(args.retry)).poll()
+    else:
+        multiplexer = EventSourceMultiplexer(url = dst,
+                                             action = args.action,
+                                             max_clients = max(len(args.token), 10),
+                                             policy = policy,
+                                             retry = args.retry,
+                                             keep_alive = args.keep_alive,
+                                             ssl = args.ssl,
+                                             validate_cert = args.validate_cert,
+                                             user = args.user,
+                                             password = args.password,
+                                             compression = args.compression,
+                                             actions = args.actions,
+                                             filters = args.filters)
+        for token in args.token:
+            multiplexer.subscribe(token)
+        IOLoop.current().start()
 
     ###
 
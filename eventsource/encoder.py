@@ -0,0 +1,103 @@
+# -+- encoding: utf-8 -+-
+"""
+.. module:: encoder
+:platform: Unix
+:synopsis: This module serializes events into event-stream frames
+
+Each frame is built as a single bytes object, so it can be written on a handler
+with one call, and several frames can be joined to be sent with one flush.
+
+.. note::
+resources:
+    - http://dev.w3.org/html5/eventsource/#event-stream-interpretation
+"""
+
+from __future__ import unicode_literals
+
+EOL = "\r\n"
+
+def _text(value):
+    return value if isinstance(value, type("")) else "{}".format(value)
+
+def encode_event(action, lines, id = None, target = None):
+    """
+    Builds the event-stream frame of an event
+
+    :param action: string used as the event's name
+    :param lines: list of the lines of the value, each one sent as a `data` field
+    :param id: id of the event, no `id` field is sent if `None`
+    :param target: target the event was posted on, sent as a `target` field if not `None`
+    :returns: bytes of the frame, ending with an empty line
+
+    the `target` field is not part of the event-stream format, and is ignored by browsers.
+    """
+    frame = ""
+    if id is not None:
+        frame = "id: " + _text(id) + EOL
+    if target is not None:
+        frame += "target: " + _text(target) + EOL
+    frame += "event: " + _text(action) + EOL
+    if lines:
+        try:
+            frame += "data: " + (EOL + "data: ").join(lines) + EOL
+        except TypeError:
+            frame += "data: " + (EOL + "data: ").join(_text(line) for line in lines) + EOL
+    return (frame + EOL).encode("utf-8")
+
+def decode_frame(frame):
+    """
+    Reads an event back from its frame
+
+    :param frame: bytes of a frame, as returned by `encode_event()`
+    :returns: tuple of the name of the event, or `None`, and of its `data` fields joined by newlines
+    """
+    action = None
+    lines = []
+    for line in frame.decode("utf-8").split(EOL):
+        if line.startswith("data: "):
+            lines.append(line[6:])
+        elif line.startswith("event: "):
+            action = line[7:]
+    return action, "\n".join(lines)
+
+def split_frames(data):
+    """
+    Splits joined frames back into frames
+
+    :param data: bytes of whole frames, as returned by `encode_batch()`
+    :returns: list of the bytes of each frame
+    """
+    end = (EOL + EOL).encode("utf-8")
+    frames = data.split(end)
+    rest = frames.pop()
+    frames = [frame + end for frame in frames]
+    if rest:
+        frames.append(rest)
+    return frames
+
+def encode_retry(retry):
+    """
+    Builds a frame that only sets the reconnection timeout of the client
+
+    :param retry: reconnection timeout, in milliseconds
+    :returns: bytes of the frame
+    """
+    return ("retry: " + _text(retry) + EOL + EOL).encode("utf-8")
+
+def encode_comment(comment):
+    """
+    Builds a comment frame, ignored by clients but keeping the connection busy
+
+    :param comment: string of the comment
+    :returns: bytes of the frame
+    """
+    return (": " + _text(comment) + EOL + EOL).encode("utf-8")
+
+def encode_batch(frames):
+    """
+    Joins several frames to be written at once
+
+    :param frames: list of bytes, as returned by `encode_event()`
+    :returns: bytes of all the frames
+    """
+    return b"".join(frames)
@@ -0,0 +1,110 @@
+# -+- encoding: utf-8 -+-
+"""
+.. module:: fastjson
+:platform: Unix
+:synopsis: This module parses and serializes JSON with the fastest library available
+
+The first installed backend of `PREFERRED` is used, tornado's `json_decode` and
+`json_encode` being the fallback:
+    - **loads(data)** parses a JSON string, raising a `ValueError` if it is invalid
+    - **dumps(value)** serializes a value into a JSON string
+
+Backends may differ in their output, orjson and ujson writing compact JSON, yet
+any of them gives valid JSON. Values which a backend rejects, or writes differently from
+the standard library, are handed over to it, so that all the backends give the same values:
+    - `NaN`, `Infinity` and `-Infinity`, which orjson refuses to read, and writes as `null`
+    - integers wider than 64 bits, which orjson refuses to write
+
+Integers wider than 64 bits are read by orjson as floats, looking for them in every
+value costing more than parsing it: `use("ujson")` or `use("json")` when events hold them.
+
+.. note::
+resources:
+    - https://github.com/ijl/orjson
+    - https://github.com/ultrajson/ultrajson
+"""
+
+from __future__ import unicode_literals
+
+import math
+import logging
+
+from tornado.escape import json_decode, json_encode
+
+log = logging.getLogger("eventsource.fastjson")
+
+PREFERRED = ["orjson", "ujson", "json"]
+
+def _non_finite(value):
+    """tells whether value holds a NaN or infinite float"""
+    if isinstance(value, float):
+        return not math.isfinite(value)
+    if isinstance(value, dict):
+        return any(_non_finite(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return any(_non_finite(item) for item in value)
+    return False
+
+def _orjson():
+    import orjson
+    def loads(data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return json_decode(data)
+    def dumps(value):
+        try:
+            data = orjson.dumps(value)
+        except TypeError:
+            return json_encode(value)
+        if b"null" in data and _non_finite(value):
+            return json_encode(value)
+        return data.decode("utf-8")
+    return loads, dumps
+
+def _ujson():
+    import ujson
+    def loads(data):
+        try:
+            return ujson.loads(data)
+        except (ValueError, OverflowError):
+            return json_decode(data)
+    def dumps(value):
+        try:
+            return ujson.dumps(value, ensure_ascii = False)
+        except OverflowError:
+            return json_encode(value)
+    return loads, dumps
+
+def _json():
+    return json_decode, json_encode
+
+_backends = dict(orjson = _orjson, ujson = _ujson, json = _json)
+
+def available():
+    """
+    :returns: list of the names of the installed backends, by order of preference
+    """
+    names = []
+    for name in PREFERRED:
+        try:
+            _backends[name]()
+            names.append(name)
+        except ImportError:
+            pass
+    return names
+
+def use(name):
+    """
+    Selects the backend used by `loads()` and `dumps()`
+
+    :param name: name of a backend of `PREFERRED`
+    :raises ImportError: if the library of the backend is not installed
+    """
+    global loads, dumps, backend
+    loads, dumps = _backends[name]()
+    backend = name
+    log.debug("use(%s)", name)
+
+loads = dumps = backend = None
+use(available()[0])
@@ -0,0 +1,231 @@
+# -+- encoding: utf-8 -+-
+"""
+.. module:: filters
+:platform: Unix
+:synopsis: This module selects the subscribers accepting an event, before it is encoded
+
+A subscriber gives its filter as query arguments of its `GET`:
+    - **action** comma separated list of the actions it accepts, all of them by default
+    - **filter** predicate on a field of the JSON value of the events, like `price>10` or
+      `user.country=fr`, given as many times as needed, all of them having to hold
+
+A predicate compares a field, given by the keys of nested objects separated by dots, to a
+value, read as JSON when it is valid JSON and as a string otherwise, with one of `OPERATORS`.
+A predicate on a missing field, or comparing values which cannot be ordered, does not hold.
+
+Filters are compiled once, and the subscribers giving the same filter share the same
+`EventFilter`. `select()` groups filters by their normalized form, so that it evaluates each
+distinct filter once per event, however it was written, and parses the value of an event at
+most once, only when a filter has predicates.
+"""
+
+from __future__ import unicode_literals
+
+import weakref
+import operator
+
+from eventsource import fastjson
+
+SEPARATOR = "."
+LIST_SEPARATOR = ","
+
+OPERATORS = {"=": operator.eq, "!=": operator.ne,
+             "<": operator.lt, "<=": operator.le,
+             ">": operator.gt, ">=": operator.ge}
+
+_MISSING = object()
+
+class Predicate(object):
+    """
+    Comparison of a field of the value of an event to a constant
+
+    Members:
+        - **path** tuple of the keys leading to the field
+        - **operator** string of the comparison, one of `OPERATORS`
+        - **value** constant the field is compared to
+    """
+    __slots__ = ("path", "operator", "value", "_compare")
+
+    def __init__(self, path, operator, value):
+        """
+        :param path: tuple of the keys leading to the field
+        :param operator: string of the comparison, one of `OPERATORS`
+        :param value: constant the field is compared to
+        """
+        self.path = tuple(path)
+        self.operator = operator
+        self.value = value
+        self._compare = OPERATORS[operator]
+
+    @classmethod
+    def parse(cls, predicate):
+        """
+        :param predicate: string like `price>10`
+        :returns: the `Predicate` it gives
+        :raises ValueError: if predicate has no operator or no field
+        """
+        for index, char in enumerate(predicate):
+            if char in "!<>=":
+                break
+        else:
+            raise ValueError("no operator in predicate: {}".format(predicate))
+        operator = predicate[index:index + 2] if predicate[index:index + 2] in OPERATORS else char
+        if operator not in OPERATORS:
+            raise ValueError("unknown operator in predicate: {}".format(predicate))
+        field = predicate[:index].strip()
+        if not field or "" in field.split(SEPARATOR):
+            raise ValueError("no field in predicate: {}".format(predicate))
+        value = predicate[index + len(operator):].strip()
+        try:
+            value = fastjson.loads(value)
+        except ValueError:
+            pass
+        return cls(field.split(SEPARATOR), operator, value)
+
+    def holds(self, fields):
+        """
+        :param fields: parsed JSON value of an event
+        :returns: true if the field of fields compares to the value
+        """
+        for key in self.path:
+            if isinstance(fields, dict):
+                fields = fields.get(key, _MISSING)
+                if fields is _MISSING:
+                    return False
+            elif isinstance(fields, list) and key.isdigit() and int(key) < len(fields):
+                fields = fields[int(key)]
+            else:
+                return False
+        try:
+            return self._compare(fields, self.value)
+        except TypeError:
+            return False
+
+    def __str__(self):
+        return SEPARATOR.join(self.path) + self.operator + fastjson.dumps(self.value)
+
+class EventFilter(object):
+    """
+    Filter of the events sent to a subscriber
+
+    Members:
+        - **actions** frozenset of the accepted actions, or `None` to accept all of them
+        - **predicates** tuple of the `Predicate` which shall all hold
+
+    Filters accepting the same actions with the same predicates, whatever their order and spacing,
+    have the same normalized form, given by `str()`, and are equal.
+    """
+    __slots__ = ("actions", "predicates", "_normalized", "__weakref__")
+
+    _compiled = weakref.WeakValueDictionary()
+
+    def __init__(self, actions = None, predicates = ()):
+        """
+        :param actions: iterable of the accepted actions, or `None` to accept all of them
+        :param predicates: iterable of `Predicate`
+        """
+        self.actions = None if actions is None else frozenset(actions)
+        self.predicates = tuple(predicates)
+        arguments = [] if self.actions is None else ["action=" + LIST_SEPARATOR.join(sorted(self.actions))]
+        arguments.extend(sorted("filter={}".format(predicate) for predicate in self.predicates))
+        self._normalized = "&".join(arguments)
+
+    def __str__(self):
+        return self._normalized
+
+    def __eq__(self, other):
+        return isinstance(other, EventFilter) and self._normalized == other._normalized
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._normalized)
+
+    @classmethod
+    def compile(cls, actions = None, predicates = ()):
+        """
+        Builds a filter, or gives the one built for the same actions and predicates
+
+        :param actions: iterable of the accepted actions, or `None` to accept all of them
+        :param predicates: iterable of predicate strings, like `price>10`
+        :returns: an `EventFilter` shared by the subscribers giving the same filter, or `None` if
+            it accepts every event
+        :raises ValueError: if a predicate is not valid
+        """
+        parsed = {}
+        for predicate in predicates:
+            predicate = Predicate.parse(predicate)
+            parsed.setdefault("{}".format(predicate), predicate)
+        actions = None if actions is None else frozenset(actions)
+        if actions is None and not parsed:
+            return None
+        key = (actions, tuple(sorted(parsed)))
+        compiled = cls._compiled.get(key)
+        if compiled is None:
+            compiled = cls(actions, [parsed[predicate] for predicate in key[1]])
+            cls._compiled[key] = compiled
+        return compiled
+
+    @classmethod
+    def from_arguments(cls, actions, predicates):
+        """
+        Builds a filter from the query arguments of a subscriber
+
+        :param actions: list of the `action` arguments, each one a comma separated list of actions
+        :param predicates: list of the `filter` arguments
+        :returns: an `EventFilter`, or `None` if the arguments filter nothing
+        :raises ValueError: if a predicate is not valid
+        """
+        if actions:
+            actions = [action.strip() for argument in actions
+                       for action in argument.split(LIST_SEPARATOR) if action.strip()]
+        return cls.compile(actions or None, predicates)
+
+    def accepts(self, action, fields):
+        """
+        :param action: action of the event
+        :param fields: function giving the parsed JSON value of the event, called only if needed
+        :returns: true if the event is accepted
+        """
+        if self.actions is not None and action not in self.actions:
+            return False
+        if self.predicates:
+            fields = fields()
+            return all(predicate.holds(fields) for predicate in self.predicates)
+        return True
+
+def select(handlers, action, fields):
+    """
+    Keeps the handlers accepting an event, each distinct filter being evaluated once
+
+    filters are grouped by their normalized form, so that `price>10` and `price > 10` are evaluated once.
+
+    :param handlers: iterable of handlers, which `event_filter` member is an `EventFilter`, or `None`
+        to accept every event
+    :param action: action of the event
+    :param fields: function giving the parsed JSON value of the event, called at most once
+    :returns: list of the handlers accepting the event
+    """
+    selected = []
+    results = {}
+    loaded = []
+    def load():
+        if not loaded:
+            try:
+                loaded.append(fields())
+            except ValueError:
+                loaded.append(None)
+        return loaded[0]
+    for handler in handlers:
+        event_filter = handler.event_filter
+        if event_filter is None:
+            selected.append(handler)
+            continue
+        key = str(event_filter)
+        accepted = results.get(key)
+        if accepted is None:
+            accepted = results[key] = event_filter.accepts(action, load)
+        if accepted:
+            selected.append(handler)
+    return selected
@@ -0,0 +1,110 @@
+# -+- encoding: utf-8 -+-
+"""
+.. module:: ids
+:platform: Unix
+:synopsis: This module generates the ids of the events
+
+Two generators are available:
+    - **CounterIdGenerator** counts from 0, and starts again on every restart
+    - **SnowflakeIdGenerator** gives 64 bits ids made of a timestamp, a node number
+      and a sequence number, unique between the nodes and ordered across restarts
+
+Generators can be called from any thread. Ids are handed out from blocks, and only
+taking a new block is done under a lock.
+
+.. note::
+A snowflake id is a 64 bits integer::
+
+    +-------------------------------+--------------+-----------------+
+    | milliseconds since the epoch  | node         | sequence        |
+    | 42 bits                       | 10 bits      | 12 bits         |
+    +-------------------------------+--------------+-----------------+
+
+so that ids grow with time. The ids of a millisecond are a block, and a node getting
+more than 4096 ids in a millisecond takes the block of the next millisecond.
+"""
+
+from __future__ import unicode_literals
+
+import time
+import itertools
+import threading
+
+class IdGenerator(object):
+    """
+    Interface of the id generators
+
+    Members:
+        - **ordered** is true when ids are numbers growing with time, whatever the
+          node and across restarts, so that events can be replayed after an unknown id
+    """
+    ordered = False
+
+    def next_id(self):
+        """
+        :returns: a new id
+        """
+        raise NotImplementedError
+
+class CounterIdGenerator(IdGenerator):
+    """
+    Generator counting from a given number, in memory
+    """
+    def __init__(self, start = 0):
+        """
+        :param start: first id given
+        """
+        # next() on itertools.count does not release the GIL, so it is thread safe
+        self._count = itertools.count(start)
+
+    def next_id(self):
+        return next(self._count)
+
+class SnowflakeIdGenerator(IdGenerator):
+    """
+    Generator of ids made of a timestamp, a node number and a sequence number
+
+    Each node of a cluster, worker process or host, shall have its own node number.
+    """
+    ordered = True
+
+    EPOCH = 1577836800000
+    NODE_BITS = 10
+    SEQUENCE_BITS = 12
+    MAX_NODE = (1 << NODE_BITS) - 1
+
+    def __init__(self, node = 0, epoch = EPOCH):
+        """
+        :param node: number of the node, from 0 to `MAX_NODE`
+        :param epoch: time from which timestamps are counted, in milliseconds since 1970
+        :raises ValueError: if node is out of range
+        """
+        if not 0 <= node <= self.MAX_NODE:
+            raise ValueError("node shall be between 0 and {}".format(self.MAX_NODE))
+        self.node = node
+        self.epoch = epoch
+        self._lock = threading.Lock()
+        self._last = -1
+        self._block = (iter(()), 0, -1)
+
+    def _now(self):
+        return int(time.time() * 1000) - self.epoch
+
+    def _take_block(self, block):
+        with self._lock:
+            if self._block is block:
+                # never goes back, even if the clock does
+                self._last = max(self._now(), self._last + 1)
+                first = ((self._last << self.NODE_BITS) | self.node) << self.SEQUENCE_BITS
+                self._block = (itertools.count(first), first + (1 << self.SEQUENCE_BITS), self._last)
+            return self._block
+
+    def next_id(self):
+        block = self._block
+        while True:
+            ids, end, stamp = block
+            if self._now() <= stamp:
+                id = next(ids, end)
+                if id < end:
+                    return id
+            block = self._take_block(block)
@@ -0,0 +1,118 @@
+# -+- encoding: utf-8 -+-
+"""
+.. module:: keepalive
+:platform: Unix
+:synopsis: This module sends keepalive messages to idle connections from a shared timer wheel
+
+A single timer serves every connection using the same keepalive interval: at each
+tick, only the connections of one slot of the wheel are looked at, and the ones
+that have been idle for the whole interval get the same pre-encoded comment frame.
+"""
+
+from __future__ import unicode_literals
+
+import math
+import time
+import logging
+
+import tornado.ioloop
+
+from eventsource import encoder
+
+log = logging.getLogger("eventsource.keepalive")
+
+class KeepaliveWheel(object):
+    """
+    Hashed timer wheel of connections waiting for a keepalive message
+
+    The interval is split in `slots` ticks. A connection sits in the slot of the tick
+    when it becomes idle for a whole interval. When that tick comes, if the connection
+    did write an event meanwhile, it is moved to the slot matching its new deadline,
+    otherwise it gets a keepalive message and comes back one interval later.
+
+    Connections are handlers having a `last_write` member, holding the time of their
+    last write, and a `push_keepalive(frame)` method.
+    """
+    _wheels = {}
+
+    @classmethod
+    def instance(cls, interval):
+        """
+        Returns the wheel shared by all the connections using a given interval
+
+        :param interval: time lapse between two keepalive messages, in milliseconds
+        """
+        if interval not in cls._wheels:
+            cls._wheels[interval] = cls(interval)
+        return cls._wheels[interval]
+
+    def __init__(self, interval, slots = 32):
+        """
+        :param interval: time lapse between two keepalive messages, in milliseconds
+        :param slots: number of ticks per interval, lowered so that a tick lasts at least 50ms
+        """
+        self.interval = interval / 1000.0
+        slots = max(1, min(slots, int(interval) // 50))
+        self._tick_time = self.interval / slots
+        self._slots = [set() for _ in range(slots)]
+        self._slot_of = {}
+        self._cursor = 0
+        self._timer = tornado.ioloop.PeriodicCallback(self._tick, self._tick_time * 1000)
+
+    def _schedule(self, handler, delay):
+        offset = min(len(self._slots), max(1, int(math.ceil(delay / self._tick_time))))
+        index = (self._cursor + offset) % len(self._slots)
+        self._slots[index].add(handler)
+        self._slot_of[handler] = index
+
+    def add(self, handler):
+        """
+        Starts sending keepalive messages to a connection
+
+        :param handler: the connection, idle from now on
+        """
+        self.remove(handler)
+        handler.last_write = time.time()
+        self._schedule(handler, self.interval)
+        if not self._timer.is_running():
+            self._timer.start()
+
+    def remove(self, handler):
+        """
+        Stops sending keepalive messages to a connection
+
+        :param handler: the connection
+        """
+        index = self._slot_of.pop(handler, None)
+        if index is not None:
+            self._slots[index].discard(handler)
+        if not self._slot_of and self._timer.is_running():
+            self._timer.stop()
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def _tick(self):
+        """
+        callback function called by `tornado.ioloop.PeriodicCallback`
+        """
+        self._cursor = (self._cursor + 1) % len(self._slots)
+        slot = self._slots[self._cursor]
+        if not slot:
+            return
+        self._slots[self._cursor] = set()
+        now = time.time()
+        frame = None
+        for handler in slot:
+            idle = now - handler.last_write
+            if idle < self.interval - self._tick_time:
+                self._schedule(handler, self.interval - idle)
+                continue
+            if frame is None:
+                frame = encoder.encode_comment("keepalive {}".format(now))
+            self._schedule(handler, self.interval)
+            try:
+                handler.push_keepalive(frame)
+            except Exception as err:
+                log.error("push_keepalive(%s): %s", handler, err)
+        log.debug("_tick(%d): %d connections", self._cursor, len(slot))
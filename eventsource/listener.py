@@ -21,23 +21,41 @@ from __future__ import unicode_literals, print_function
 import os
 import sys
 import time
+import atexit
+import shutil
+import signal
+import asyncio
 import logging
 import argparse
+import tempfile
+import functools
 import traceback
+import zlib
 
 log = logging.getLogger("eventsource.listener")
 
-if sys.version_info.major == 3:
-    import http.client as httplib
-else:
-    import httplib
-from tornado.escape import json_decode, json_encode
-from tornado.concurrent import Future
+import http.client as httplib
+from tornado.escape import json_encode, to_unicode
+from tornado.queues import Queue, QueueEmpty, QueueFull
 import tornado.web
 import tornado.gen
 import tornado.ioloop
+import tornado.iostream
+import tornado.netutil
+import tornado.process
 import tornado.httpserver
 
+from eventsource import encoder
+from eventsource import fastjson
+from eventsource.ids import CounterIdGenerator, SnowflakeIdGenerator
+from eventsource.broker import LocalBroker, SocketBroker
+from eventsource.registry import ConnectionRegistry
+from eventsource.filters import EventFilter, select
+from eventsource.keepalive import KeepaliveWheel
+from eventsource.metrics import ListenerMetrics, MetricsHandler
+from eventsource.storage import MemoryEventStore, SegmentEventStore
+from eventsource.topics import LIST_SEPARATOR, is_pattern, split_topics
+
 # Event base
 
 class Event(object):
@@ -48,6 +66,17 @@ class Event(object):
         - **target** is the token that matches an event source channel
         - **action** contains the name of the action (which shall be in `ACTIONS`)
         - **value** contains a list of every lines of the value to be parsed
+        - **id** is the id of the event, or `None`
+        - **published** is the time the event was posted at, only set when metrics are enabled
+
+    Events are records: the value is parsed by `set_value()`, and the id given by
+    `get_id()`, once when the event is created, and both are only read afterwards.
+    `FINISH` and `RETRY` events are not numbered, their frames having no `id` field.
+    `get_value()` is read once, to encode the event, so values are kept as given and
+    only split in lines then. Base classes define `__slots__`, so that events take no
+    dict. Subclasses may define their own `__slots__` for their members, or get a dict otherwise.
+    `get_fields()` gives the value the filters of the subscribers are evaluated on, and is
+    only called when a subscriber filters on fields.
 
     Static members:
         - content_type field is the Accept header value that is returned on new connections
@@ -56,24 +85,41 @@ class Event(object):
             - **LISTEN** is the GET event that will open an event source communication
             - **FINISH** is the POST event that will end a communication started by `LISTEN`
             - **RETRY** is the POST event that defines reconnection timeouts for the client
+            - **BATCH** is the POST action that triggers many events at once, on any targets
     """
     content_type = "text/plain"
 
     LISTEN = "poll"
     FINISH = "close"
     RETRY = "retry"
+    BATCH = "batch"
     ACTIONS=[FINISH]
 
+    __slots__ = ("target", "action", "_value", "_id", "published")
+
     def get_value(self):
         """Property to encapsulate processing on value"""
         return self._value
 
     def set_value(self, v):
+        """Method to parse the value, called once when the event is created"""
         self._value = v
 
-    value = property(get_value, set_value)
+    @property
+    def value(self):
+        return self.get_value()
+
+    def get_fields(self):
+        """Method giving the parsed JSON value, on which the filters of the subscribers are evaluated"""
+        return None
+
+    def get_id(self):
+        """Method to create id generation behaviour, called once when the event is created"""
+        return None
 
-    id = None
+    @property
+    def id(self):
+        return self._id
 
     def __init__(self, target, action, value = None):
         """
@@ -85,43 +131,45 @@ class Event(object):
         self.target = target
         self.action = action
         self.set_value(value)
+        self._id = None if action in (self.FINISH, self.RETRY) else self.get_id()
 
 class EventId(object):
     """
     Class that defines an event with an id
-        - defines field `id` using property, using method `get_id()`
+        - defines method `get_id()`, giving the next id of `generator`, an `IdGenerator`
+          shared by all the event classes, unless one sets its own
     """
-    cnt = 0
+    __slots__ = ()
+
+    generator = CounterIdGenerator()
 
     def get_id(self):
         """Method to create id generation behaviour"""
-        if self.cnt == EventId.cnt:
-            self.cnt = EventId.cnt
-            EventId.cnt+=1
-        return self.cnt
-
-    id = property(get_id)
+        return self.generator.next_id()
 
 # Reusable events
 
 class StringEvent(Event):
     """
     Class that defines a multiline string Event
-        - overloads `Event.get_value()`, and associates it using a property
+        - overloads `Event.get_value()`, splitting the value in lines when read
         - adds a "ping" event
     """
     ACTIONS=["ping", Event.FINISH]
-    def get_value(self):
-        return [line for line in self._value.split("\n")]
 
-    value = property(get_value, Event.set_value)
+    __slots__ = ()
+
+    def get_value(self):
+        return self._value.split("\n")
 
 class JSONEvent(Event):
     """
     Class that defines a JSON-checked Event
-        - overloads `Event.get_value()` and `Event.set_value()`, and associates it using a property
+        - overloads `Event.set_value()`, checking the value and keeping its serialization
         - adds a "ping" event
         - defines content_type to `application/json`
+
+    The value is parsed and serialized with the `fastjson` backend.
     """
     content_type = "application/json"
 
@@ -129,13 +177,16 @@ class JSONEvent(Event):
     FINISH = "close"
     ACTIONS=["ping", FINISH]
 
+    __slots__ = ()
+
     def get_value(self):
-        return [json_encode(self._value)]
+        return [self._value]
 
     def set_value(self, v):
-        self._value = json_decode(v)
+        self._value = fastjson.dumps(fastjson.loads(v))
 
-    value = property(get_value, set_value)
+    def get_fields(self):
+        return fastjson.loads(self._value)
 
 class StringIdEvent(StringEvent, EventId):
     """
@@ -143,7 +194,9 @@ class StringIdEvent(StringEvent, EventId):
     """
     ACTIONS=["ping", Event.RETRY, Event.FINISH]
 
-    id = property(EventId.get_id)
+    __slots__ = ()
+
+    get_id = EventId.get_id
 
 class JSONIdEvent(JSONEvent, EventId):
     """
@@ -151,37 +204,203 @@ class JSONIdEvent(JSONEvent, EventId):
     """
     content_type = JSONEvent.content_type
     ACTIONS=["ping", Event.RETRY, Event.FINISH]
-    
-    id = property(EventId.get_id)
+
+    __slots__ = ()
+
+    get_id = EventId.get_id
+
+class RelayedEvent(Event):
+    """
+    Class that defines an event relayed from another node, already encoded
+        - `id` is the id given by the node the event was posted on
+    """
+    __slots__ = ()
+
+    def __init__(self, target, action, id = None):
+        Event.__init__(self, target, action)
+        self._id = id
 
 # EventSource mechanism
 
 class EventSourceHandler(tornado.web.RequestHandler):
-    _connected = {}
-    _lock = {}
-    def initialize(self, event_class = StringEvent, keepalive = 0):
+    """
+    Handler that opens event source channels on `GET` and feeds them with events on `POST`
+
+    Any number of channels can subscribe to the same target: an event posted on
+    a target is encoded once, and the same frame is sent to every subscriber.
+
+    Each subscriber owns a queue of pending events, which size can be bounded.
+    When a bounded queue is full, the overflow policy tells what happens to the next event:
+        - **OVERFLOW_BLOCK** holds the publisher's `POST` until there is room in the queue
+        - **OVERFLOW_DROP** discards the oldest pending event to make room for the new one
+        - **OVERFLOW_REJECT** refuses the new event, and the `POST` gets an HTTP error 503
+
+    When replay is enabled, the frames of the events having an id are kept in an `EventStore`,
+    and a client reconnecting with a `Last-Event-ID` header gets every frame it missed before
+    live events. Events posted on a target while its clients are reconnecting are kept as well.
+
+    When the listener runs as several nodes, worker processes or hosts, a `Broker` tells which
+    targets have subscribers on the other nodes, and relays the events posted on them to those nodes.
+
+    Each subscriber accounts the bytes of the frames it has pending, queued or being flushed to
+    its client. Once they reach the high watermark, the subscriber is a slow consumer until they
+    fall back to the low watermark, and the slow consumer policy tells what happens to new events:
+        - **SLOW_DROP** discards them
+        - **SLOW_COALESCE** replaces the pending event of the same action by the new one
+        - **SLOW_DISCONNECT** closes the connection of the subscriber
+
+    Targets publishing states, where only the latest value matters, can be conflated: a pending
+    event is replaced in place by the next event having the same key, so that a subscriber gets at
+    most one frame per key each time it is flushed, or each tick if a conflation tick is given:
+        - **CONFLATE_NONE** sends every event
+        - **CONFLATE_TARGET** keys events by target, keeping only the latest one
+        - **CONFLATE_ACTION** keys events by action, keeping the latest one of each action
+
+    When compression is enabled, the stream of a client accepting one of `COMPRESSIONS` is compressed
+    through a zlib context kept for the whole connection, flushed after each write so that the
+    client can decode every event as soon as it is received.
+
+    When topics are enabled, targets are hierarchical topics, like `orders.eu.fr`, and a client
+    follows a comma separated list of topics and of patterns, like `orders.eu.*,alerts.#`, over
+    a single connection, see the topics module. Subscribers are found in a `TopicTrie`, at a cost
+    growing with the depth of the topic an event is posted on, not with the number of patterns
+    followed. Frames then give the topic of their event in a `target` field, and an `Event.FINISH`
+    event only closes the streams following its topic alone.
+
+    Subscribers may give a filter when they connect, as query arguments of their `GET`, see the
+    filters module. Events are then only queued for, and encoded if needed by, the subscribers
+    accepting them, the subscribers giving the same filter sharing its evaluation.
+    `Event.FINISH` and `Event.RETRY` events are sent to every subscriber.
+
+    When given a `ListenerMetrics`, handlers count the events published, pushed and relayed, the
+    bytes written, and the time from the publication of each event to its flush to a client.
+    Without it, they only check that it is `None`.
+    """
+    OVERFLOW_BLOCK = "block"
+    OVERFLOW_DROP = "drop"
+    OVERFLOW_REJECT = "reject"
+    OVERFLOWS = [OVERFLOW_BLOCK, OVERFLOW_DROP, OVERFLOW_REJECT]
+
+    SLOW_DROP = "drop"
+    SLOW_COALESCE = "coalesce"
+    SLOW_DISCONNECT = "disconnect"
+    SLOW_POLICIES = [SLOW_DROP, SLOW_COALESCE, SLOW_DISCONNECT]
+
+    CONFLATE_NONE = "none"
+    CONFLATE_TARGET = "target"
+    CONFLATE_ACTION = "action"
+    CONFLATIONS = [CONFLATE_NONE, CONFLATE_TARGET, CONFLATE_ACTION]
+
+    COMPRESSIONS = ["gzip", "deflate"]
+    _WBITS = dict(gzip = 16 + zlib.MAX_WBITS, deflate = zlib.MAX_WBITS)
+
+    PRUNE_INTERVAL = 60
+    DROP_LOG_INTERVAL = 10
+    REPLAY_CHUNK_SIZE = 64 * 1024
+
+    _registry = ConnectionRegistry()
+    _local_broker = LocalBroker()
+    _pruned = 0
+    _drops_logged = (0, 0)
+    _overflows = 0
+    _counters = {}
+    _filtered = 0
+    totals = dict(dropped = 0, disconnected = 0, conflated = 0)
+    def initialize(self, event_class = StringEvent, keepalive = 0, queue_size = 0, overflow = OVERFLOW_BLOCK,
+                   replay_size = 0, replay_age = 0, store = None, broker = None,
+                   high_watermark = 0, low_watermark = 0, slow_policy = SLOW_DROP,
+                   conflation = CONFLATE_NONE, conflation_tick = 0,
+                   compression = False, compression_level = 6, compression_min_size = 0, metrics = None,
+                   topics = False):
         """
         Takes an Event based class to define the event's handling
         :param event_class: defines the kind of event that is expected
         :param keepalive: time lapse to wait for sending keepalive messages, in milliseconds. If `0`, keepalive is deactivated.
+            Idle handlers sharing the same keepalive get their messages from a single `KeepaliveWheel`.
+        :param queue_size: maximum number of pending events per subscriber. If `0`, the queue is unbounded.
+        :param overflow: policy applied when the queue of a subscriber is full, one of `OVERFLOWS`
+        :param replay_size: number of frames kept in memory per target to be replayed. If `0`, replay is deactivated.
+        :param replay_age: time during which frames are kept in memory to be replayed, in seconds. If `0`, frames do not expire.
+        :param store: `EventStore` keeping the frames to be replayed, in place of the in memory one
+        :param broker: `Broker` relaying events to the subscribers of the other nodes, a standalone `LocalBroker` by default
+        :param high_watermark: bytes pending for a subscriber from which it is a slow consumer. If `0`, pending bytes are not limited.
+        :param low_watermark: bytes pending under which a slow consumer recovers, half the high watermark if `0`
+        :param slow_policy: policy applied to the new events of a slow consumer, one of `SLOW_POLICIES`
+        :param conflation: key of the pending events replaced by the next ones, one of `CONFLATIONS`
+        :param conflation_tick: minimum time between two writes to a subscriber, in milliseconds. If `0`, writes follow each other.
+        :param compression: if true, streams are compressed for the clients accepting it
+        :param compression_level: zlib compression level, from 1 (fastest) to 9 (smallest)
+        :param compression_min_size: size of the first write of a stream from which the stream is compressed, in bytes.
+            A stream which first write is a keepalive comment is compressed.
+        :param metrics: `ListenerMetrics` updated by the handler, or `None` to disable metrics
+        :param topics: if true, clients follow lists of topics and of patterns, and frames give the topic of their event
         """
+        if overflow not in self.OVERFLOWS:
+            raise ValueError("unknown overflow policy: {}".format(overflow))
+        if slow_policy not in self.SLOW_POLICIES:
+            raise ValueError("unknown slow consumer policy: {}".format(slow_policy))
+        if conflation not in self.CONFLATIONS:
+            raise ValueError("unknown conflation: {}".format(conflation))
+        if not 1 <= int(compression_level) <= 9:
+            raise ValueError("compression level shall be between 1 and 9: {}".format(compression_level))
         self._event_class = event_class
-        self._retry = None
-        if keepalive is not 0:
-            self._keepalive = tornado.ioloop.PeriodicCallback(self.push_keepalive, int(keepalive))
+        self._queue = Queue(maxsize = int(queue_size))
+        self._overflow = overflow
+        if store is None and int(replay_size) != 0:
+            generator = getattr(event_class, "generator", None)
+            store = MemoryEventStore.instance(int(replay_size), int(replay_age),
+                                              ordered_ids = generator is not None and generator.ordered)
+        self._store = store
+        self._flushing = False
+        self._high_watermark = int(high_watermark)
+        self._low_watermark = int(low_watermark) or self._high_watermark // 2
+        self._slow_policy = slow_policy
+        self._pending = 0
+        self._slow = False
+        self._conflation = conflation
+        self._conflation_tick = int(conflation_tick)
+        self._conflated = {}
+        self._compression = compression
+        self._compression_level = int(compression_level)
+        self._compression_min_size = int(compression_min_size)
+        self._encoding = None
+        self._compressor = None
+        self._metrics = metrics
+        self._topics = topics
+        self.event_filter = None
+        self._broker = self._local_broker if broker is None else broker
+        self.last_write = time.time()
+        if int(keepalive) != 0:
+            self._keepalive = KeepaliveWheel.instance(int(keepalive))
         else:
             self._keepalive = None
 
     # Tools
 
-    @tornado.web.asynchronous
-    def push_keepalive(self):
+    def push_keepalive(self, frame):
         """
-        callback function called by `tornado.ioloop.PeriodicCallback`
+        callback function called by `KeepaliveWheel` when current handler is idle
+
+        :param frame: keepalive comment frame, shared by all the idle handlers
+
+        nothing is sent while the events written before are being flushed.
         """
-        log.debug("push_keepalive()")
-        self.write(": keepalive {}\r\n\r\n".format(str(time.time())))
-        self.flush()
+        if not self._flushing:
+            self.push_frames([frame], keepalive = True)
+
+    def encode(self, event):
+        """
+        Serializes an event into an event-stream frame
+
+        :param event: Event based incoming event
+        :returns: bytes of the frame
+        :raises ValueError: if the value of a `Event.RETRY` event is not a number
+        """
+        log.debug("encode(%s,%s)", event.id, event.action)
+        if event.action == self._event_class.RETRY and self._event_class.RETRY in self._event_class.ACTIONS:
+            return encoder.encode_retry(int(event.value[0]))
+        return encoder.encode_event(event.action, event.value, id = event.id,
+                                    target = event.target if self._topics else None)
 
     def push(self, event):
         """
@@ -189,66 +408,435 @@ class EventSourceHandler(tornado.web.RequestHandler):
 
         :param event: Event based incoming event
         """
-        log.debug("push({},{},{})".format(event.id, event.action, event.value))
-        if hasattr(event, "id"):
-            self.write("id: {}\r\n".format(str(event.id)))
-        if self._retry is not None:
-            self.write("retry: {}\r\n".format(str(self._retry)))
-            self._retry = None
-        self.write("event: {}\r\n".format(str(event.action)))
-        for line in event.value:
-            self.write("data: {}\r\n".format(str(line)))
-        self.write("\r\n")
-        self.flush()
+        self.push_frames([self.encode(event)])
+
+    def push_frames(self, frames, keepalive = False):
+        """
+        Writes several encoded events at once on current handler, and flush them together
+
+        :param frames: list of frames, as returned by `encode()`
+        :param keepalive: true if frames is a keepalive comment, which size does not tell whether to compress
+        :returns: a Future resolved once the frames are written to the client's socket
+        """
+        data = encoder.encode_batch(frames)
+        if self._encoding is not None:
+            data = self._compress(data, keepalive)
+        if self._metrics is not None:
+            self._metrics.written.inc(len(data))
+        self.write(data)
+        self.last_write = time.time()
+        return self.flush()
+
+    def negotiate_encoding(self):
+        """
+        Chooses the content coding of the stream from the `Accept-Encoding` header of the client
+
+        :returns: the accepted coding of `COMPRESSIONS` having the highest quality value, or `None`
+            if compression is disabled or the client accepts none of them
+        """
+        if not self._compression:
+            return None
+        accepted = {}
+        for coding in self.request.headers.get("Accept-Encoding", "").split(","):
+            name, _, params = coding.partition(";")
+            quality = 1.0
+            params = params.replace(" ", "")
+            if params.startswith("q="):
+                try:
+                    quality = float(params[2:])
+                except ValueError:
+                    quality = 0
+            accepted[name.strip().lower()] = quality
+        quality, _, name = max((accepted.get(name, accepted.get("*", 0)), -index, name)
+                               for index, name in enumerate(self.COMPRESSIONS))
+        return name if quality > 0 else None
+
+    def _compress(self, data, keepalive = False):
+        """
+        compresses data written on the stream of current handler
+
+        the stream is compressed only if its first write, the frames replayed or the first events,
+        reaches the minimum size, as headers are sent along with it. A keepalive comment tells nothing
+        of the size of the events to come: a stream which first write is a keepalive is compressed.
+        The zlib context is then kept for the whole stream, and flushed at the end of each write.
+        """
+        if self._compressor is None:
+            if len(data) < self._compression_min_size and not keepalive:
+                self._encoding = None
+                return data
+            self.set_header("Content-Encoding", self._encoding)
+            self._compressor = zlib.compressobj(self._compression_level, zlib.DEFLATED, self._WBITS[self._encoding])
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def subscribers(self, target):
+        """
+        Lists the handlers subscribed to a target
+
+        :param target: string identifying a given target
+        :returns: set of handlers
+        """
+        return self._registry.subscribers(target)
+
+    def has_replay(self, target):
+        """
+        Tells whether frames are kept to be replayed for a target
+
+        :param target: string identifying a given target
+        @return true if the store has frames for target
+        """
+        return self._store is not None and self._store.has(target)
+
+    def store_replay(self, target, id, frame):
+        """
+        Keeps the frame of an event to be replayed on reconnection
+
+        :param target: string identifying a given target
+        :param id: id of the event
+        :param frame: bytes of the encoded event
+
+        the retention policy of the store is applied every `PRUNE_INTERVAL` seconds.
+        """
+        self._append_replay(self._store, target, id, frame)
+
+    @classmethod
+    def _append_replay(cls, store, target, id, frame):
+        store.append(target, id, frame)
+        now = time.time()
+        if now - EventSourceHandler._pruned > cls.PRUNE_INTERVAL:
+            EventSourceHandler._pruned = now
+            store.prune()
 
     def buffer_event(self, target, action, value = None):
         """
-        creates and store an event for the target
+        creates an event for the target, and store it in the queue of every subscriber
 
         :param target: string identifying current target
         :param action: string matching one of Event.ACTIONS
         :param value: string containing a value
+        :returns: a Future to wait on before the event is queued, when the overflow policy is `OVERFLOW_BLOCK`
+        :raises QueueFull: when a queue is full and the overflow policy is `OVERFLOW_REJECT`
+
+        the event is encoded only once, whatever the number of subscribers, and
+        stored for replay if it has an id and replay is enabled, unless it is rejected.
+        The frame is also sent to the other nodes having subscribers for target.
+        When subscribers give filters, the event is only queued for the ones accepting
+        it, and not even encoded if none of them does, and it is neither kept nor relayed.
+        """
+        log.debug("buffer_event(%s)", target)
+        event = self._event_class(target, action, value)
+        if self._metrics is not None:
+            event.published = time.time()
+            self._metrics.published.inc(labels = (action,))
+        handlers = self.subscribers(target)
+        if EventSourceHandler._filtered and action not in (self._event_class.FINISH, self._event_class.RETRY):
+            selected = select(handlers, action, event.get_fields)
+            if self._metrics is not None:
+                self._metrics.filtered.inc(len(handlers) - len(selected))
+            handlers = selected
+            if not handlers and (self._store is None or event.id is None) and not self._broker.is_connected(target):
+                return None
+        else:
+            handlers = list(handlers)
+        if self._overflow == self.OVERFLOW_REJECT:
+            # a rejected event is neither kept, relayed nor queued, so that it can be posted again
+            if any(handler._queue.full() for handler in handlers):
+                raise QueueFull()
+        if action == self._event_class.FINISH:
+            item = (event, None)
+        else:
+            item = (event, self.encode(event))
+            if self._store is not None and event.id is not None:
+                self.store_replay(target, event.id, item[1])
+        self._broker.publish(target, action, event.id, item[1])
+        futures = [handler.enqueue(item) for handler in handlers]
+        if self._overflow == self.OVERFLOW_BLOCK:
+            return tornado.gen.multi([future for future in futures if future is not None])
+
+    def enqueue(self, item):
         """
-        log.debug("buffer_event({})".format(target))
-        self._lock[target].set_result(self._event_class(target, action, value))
+        stores an (event, frame) item in the queue of current handler
+
+        :param item: tuple of an event, and of its frame or `None` for an `Event.FINISH` event
+        :returns: a Future to wait on before the item is queued, when the overflow policy is `OVERFLOW_BLOCK`
+
+        When the queue is full and the overflow policy is not `OVERFLOW_BLOCK`, the oldest
+        pending event is discarded. When current handler is a slow consumer, its slow
+        consumer policy is applied to the item instead.
+        When events are conflated, an item replaces the pending one having the same key,
+        if any, without taking room in the queue. Control events are never conflated.
+        """
+        event, frame = item
+        if frame is None and self._topics and self._registry.topics(self) != [event.target]:
+            # streams following other topics or patterns are not closed by this one
+            return None
+        if frame is not None and self._conflation != self.CONFLATE_NONE:
+            key = self._conflation_key(event)
+            pending = self._conflated.get(key)
+            if pending is not None:
+                self._pending += len(frame) - len(pending[1])
+                pending[0], pending[1] = event, frame
+                self._count(event.target, "conflated")
+                return None
+        if frame is not None and self.is_slow(event.target):
+            if self._slow_policy == self.SLOW_DISCONNECT:
+                self.evict()
+            elif self._slow_policy == self.SLOW_COALESCE:
+                self._coalesce(item)
+            else:
+                self._count(event.target, "dropped")
+            return None
+        if self._conflation != self.CONFLATE_NONE:
+            if frame is None:
+                # events following an Event.FINISH are not moved before it
+                self._conflated.clear()
+            elif key is not None:
+                # queued as a list, for the next events of the same key to replace it in place
+                item = self._conflated[key] = [event, frame]
+        queue = self._queue
+        if queue.full() and self._overflow != self.OVERFLOW_BLOCK:
+            dropped = queue.get_nowait()
+            self._release(dropped)
+            dropped, dropped_frame = dropped
+            self._pending -= len(dropped_frame or b"")
+            self._count(event.target, "dropped")
+            self._log_drops(event.target)
+        self._pending += len(frame or b"")
+        if self._overflow == self.OVERFLOW_BLOCK:
+            return queue.put(item)
+        queue.put_nowait(item)
+
+    def is_slow(self, target):
+        """
+        Tells whether current handler is a slow consumer
+
+        :param target: string identifying the target of current handler
+        :returns: true if the bytes pending reached the high watermark, and did not fall back to the low watermark since
+        """
+        if not self._slow and self._high_watermark and self._pending >= self._high_watermark:
+            log.warning("is_slow(%s): slow consumer, %d bytes pending", target, self._pending)
+            self._slow = True
+        return self._slow
+
+    def _coalesce(self, item):
+        """
+        replaces the pending events having the same action as the event of item by item
+
+        the queue is drained and filled again, without waiting. If the events left do not fit
+        in a bounded queue, the oldest one is dropped, control events being kept.
+        """
+        items = []
+        try:
+            while True:
+                items.append(self._queue.get_nowait())
+        except QueueEmpty:
+            pass
+        items.append(item)
+        self._pending += len(item[1])
+        latest = dict((event.action, index) for index, (event, frame) in enumerate(items) if frame is not None)
+        kept = []
+        for index, pending in enumerate(items):
+            if pending[1] is not None and latest[pending[0].action] != index:
+                self._drop(pending)
+            else:
+                kept.append(pending)
+        if self._queue.maxsize and len(kept) > self._queue.maxsize:
+            oldest = next(index for index, pending in enumerate(kept) if pending[1] is not None)
+            dropped = kept.pop(oldest)
+            self._drop(dropped)
+            self._log_drops(dropped[0].target)
+        for pending in kept:
+            self._queue.put_nowait(pending)
+
+    def _drop(self, item):
+        """
+        discards an item taken out of the queue, undoing its accounting
+        """
+        self._release(item)
+        self._pending -= len(item[1] or b"")
+        self._count(item[0].target, "dropped")
+
+    def _conflation_key(self, event):
+        """
+        events are keyed by the target they were posted on, which is the one of current
+        handler, unless it follows several topics. `Event.RETRY` and `Event.FINISH` events
+        have no key, so that they are always queued, and never replace a pending event.
+        """
+        if event.action in (self._event_class.RETRY, self._event_class.FINISH):
+            return None
+        return event.action if self._conflation == self.CONFLATE_ACTION else event.target
+
+    def _release(self, item):
+        """
+        called for an item leaving the queue, for the next events of its key to be queued again
+        """
+        if self._conflation != self.CONFLATE_NONE and item is not None and item[1] is not None:
+            key = self._conflation_key(item[0])
+            if self._conflated.get(key) is item:
+                del(self._conflated[key])
+
+    def evict(self):
+        """
+        Closes the connection of current handler, as a slow consumer
+        """
+        target = self._registry.target(self)
+        log.warning("evict(%s): disconnected slow consumer, %d bytes pending", target, self._pending)
+        self._count(target, "disconnected")
+        self.set_disconnected()
+        self.request.connection.close()
+
+    @classmethod
+    def _log_drops(cls, target):
+        """
+        counts an event dropped by a full queue, and warns about them every `DROP_LOG_INTERVAL` seconds
+        at most, giving the number of events dropped by full queues since the previous warning.
+        The events dropped from slow consumers are only counted in `totals`.
+        """
+        EventSourceHandler._overflows += 1
+        now = time.time()
+        logged, overflows = EventSourceHandler._drops_logged
+        if now - logged > cls.DROP_LOG_INTERVAL:
+            EventSourceHandler._drops_logged = (now, EventSourceHandler._overflows)
+            log.warning("enqueue(%s): queue is full, %d events dropped since the last warning",
+                        target, EventSourceHandler._overflows - overflows)
+
+    @classmethod
+    def _count(cls, target, counter):
+        cls.totals[counter] += 1
+        counters = cls._counters.setdefault(target, dict(dropped = 0, disconnected = 0, conflated = 0))
+        counters[counter] += 1
+
+    def backpressure(self, target):
+        """
+        Gives the backpressure counters of a target
+
+        :param target: string identifying a given target
+        :returns: dict of the bytes `pending` and of the `slow` consumers among the subscribers of target,
+            with the number of events `dropped`, of slow consumers `disconnected`, and of events replaced
+            by `conflated` ones since it has subscribers
+        """
+        handlers = self.subscribers(target)
+        counters = self._counters.get(target, {})
+        return dict(pending = sum(handler._pending for handler in handlers),
+                    slow = sum(1 for handler in handlers if handler._slow),
+                    dropped = counters.get("dropped", 0),
+                    disconnected = counters.get("disconnected", 0),
+                    conflated = counters.get("conflated", 0))
+
+    @classmethod
+    def collect_metrics(cls, metrics):
+        """
+        Updates the gauges of metrics, and the counters kept by the handlers, from all the open connections
+
+        :param metrics: `ListenerMetrics` about to be rendered
+
+        called when metrics are scraped, as the `collect` function of a `ListenerMetrics`.
+        """
+        handlers = list(cls._registry)
+        metrics.connections.clear()
+        for target in cls._registry.targets():
+            metrics.connections.set(cls._registry.count(target), (target,))
+        metrics.queued.set(sum(handler._queue.qsize() for handler in handlers))
+        metrics.pending.set(sum(handler._pending for handler in handlers))
+        metrics.slow.set(sum(1 for handler in handlers if handler._slow))
+        metrics.dropped.set(cls.totals["dropped"])
+        metrics.conflated.set(cls.totals["conflated"])
+        metrics.disconnected.set(cls.totals["disconnected"])
+
+    @classmethod
+    def deliver(cls, target, action, id, frame, store = None, metrics = None):
+        """
+        stores an event relayed from another node in the queue of every local subscriber of target
+
+        :param target: string identifying the target of the event
+        :param action: string matching one of Event.ACTIONS
+        :param id: id of the event, or `None`
+        :param frame: bytes of the encoded event, or `None` for an `Event.FINISH` event
+        :param store: `EventStore` keeping the frame to be replayed, or `None`
+        :param metrics: `ListenerMetrics` counting relayed events, or `None`
+
+        the publisher cannot be held nor rejected: the queues of subscribers which overflow policy
+        is `OVERFLOW_BLOCK` grow beyond their size, and the other ones drop their oldest event.
+        """
+        log.debug("deliver(%s)", target)
+        event = RelayedEvent(target, action, id)
+        if metrics is not None:
+            # latencies of relayed events are measured from their arrival on this node
+            event.published = time.time()
+            metrics.relayed.inc()
+        item = (event, frame)
+        if store is not None and id is not None and frame is not None:
+            cls._append_replay(store, target, id, frame)
+        handlers = cls._registry.subscribers(target)
+        if EventSourceHandler._filtered and frame is not None and action != Event.RETRY:
+            # the value is read back from the frame, only if a filter has predicates
+            selected = select(handlers, action, lambda: fastjson.loads(encoder.decode_frame(frame)[1]))
+            if metrics is not None:
+                metrics.filtered.inc(len(handlers) - len(selected))
+            handlers = selected
+        for handler in list(handlers):
+            handler.enqueue(item)
 
     def is_connected(self, target):
         """
-        Tells whether an eventsource channel identified by `target` is opened.
+        Tells whether an eventsource channel identified by `target` is opened, on any node.
 
         :param target: string identifying a given target
         @return true if target is connected
         """
-        return target in self._connected.values()
+        return self._registry.is_connected(target) or self._broker.is_connected(target)
 
-    def set_connected(self, target):
+    def set_connected(self, target, topics = None):
         """
         registers target as being connected
 
         :param target: string identifying a given target
+        :param topics: list of the topics and patterns of target, when topics are enabled
 
-        this method will add target to the connected list and create an empty event buffer
+        this method will add current handler to the subscribers of target, or of its topics
         """
-        log.debug("set_connected({})".format(target))
-        self._connected[self] = target
-        self._lock[target] = Future()
+        log.debug("set_connected(%s)", target)
+        self._registry.add(target, self, topics)
+        if self.event_filter is not None:
+            EventSourceHandler._filtered += 1
+        for topic in topics or [target]:
+            self._broker.subscribe(topic)
 
     def set_disconnected(self):
         """
         unregisters current handler as being connected
 
-        this method will remove target from the connected list and delete the event buffer
+        this method will remove current handler from the subscribers of its target,
+        release the publishers waiting on its event buffer, and stop its event loop
         """
+        if self not in self._registry:
+            return
         target = None
         try:
-            target = self._connected[self]
-            log.debug("set_disconnected({})".format(target))
-            if self._keepalive:
-                self._keepalive.stop()
-            del(self._lock[target])
-            del(self._connected[self])
+            target = self._registry.target(self)
+            log.debug("set_disconnected(%s)", target)
+            if self._keepalive is not None:
+                self._keepalive.remove(self)
+            topics = self._registry.topics(self)
+            self._registry.remove(self)
+            if self.event_filter is not None:
+                EventSourceHandler._filtered -= 1
+            for topic in topics or [target]:
+                if not self._registry.is_followed(topic):
+                    self._broker.unsubscribe(topic)
+                    self._counters.pop(topic, None)
+            if topics is not None:
+                # counters of the topics only followed through patterns
+                for topic in [topic for topic in self._counters if not self._registry.is_connected(topic)]:
+                    del(self._counters[topic])
+            self._conflated.clear()
+            # release the publishers blocked on a full queue
+            while True:
+                self._queue.get_nowait()
+        except QueueEmpty:
+            self._pending = 0
+            self._queue.put_nowait(None)
         except Exception as err:
-            log.error("set_disconnected({},{}): {}", str(self), target, err)
+            log.error("set_disconnected(%s,%s): %s", str(self), target, err)
 
     def write_error(self, status_code, **kwargs):
         """
@@ -268,92 +856,332 @@ class EventSourceHandler(tornado.web.RequestHandler):
             self.finish()
         else:
             if "mesg" in kwargs:
-                self.finish("<html><title>%(code)d: %(message)s</title>"
-                            "<body>%(code)d: %(mesg)s</body></html>\n".format(
+                self.finish("<html><title>{code}: {message}</title>"
+                            "<body>{code}: {mesg}</body></html>\n".format(
                                 code=status_code,
                                 message=httplib.responses[status_code],
                                 mesg=kwargs["mesg"],
                                 ))
             else:
-                self.finish("<html><title>%(code)d: %(message)s</title>"
-                            "<body>%(code)d: %(message)s</body></html>\n".format(
+                self.finish("<html><title>{code}: {message}</title>"
+                            "<body>{code}: {message}</body></html>\n".format(
                                 code=status_code,
                                 message=httplib.responses[status_code],
                                 ))
 
     # Synchronous actions
 
-    def post(self, action, target):
+    def check_event(self, target, action):
+        """
+        Tells whether an event can be triggered
+
+        :param target: string defining the target handler to send it to
+        :param action: string defining the type of event
+        :returns: `None` if the event can be triggered, or a (HTTP error code, message) tuple
+        """
+        if self._topics and (LIST_SEPARATOR in target or is_pattern(target)):
+            return 400, "Events are posted on a topic, not on patterns"
+        if not self.is_connected(target) and not self.has_replay(target):
+            return 404, "Target is not connected"
+        if action not in self._event_class.ACTIONS:
+            return 404, "Unknown action requested"
+        return None
+
+    def check_filter(self, event_filter):
+        """
+        Tells whether the events can be filtered as a subscriber asks
+
+        :param event_filter: `EventFilter` of the subscriber, or `None`
+        :returns: `None` if the filter can be applied, or a (HTTP error code, message) tuple
+        """
+        if event_filter is None:
+            return None
+        if event_filter.actions is not None and not event_filter.actions <= set(self._event_class.ACTIONS):
+            return 400, "Unknown action in filter"
+        if event_filter.predicates and self._event_class.get_fields is Event.get_fields:
+            return 400, "Events have no fields to filter on"
+        return None
+
+    def parse_batch(self, body, target):
+        """
+        Reads the records of a batch of events
+
+        :param body: string holding either a JSON array of records, or one JSON record per line
+        :param target: string defining the target of the records that do not give one
+        :returns: list of (target, action, value) tuples, or (HTTP error code, message) tuples for invalid records
+        :raises ValueError: if the body is not valid JSON
+
+        each record is an object with `action`, `value` and optionally `target` members, `action` and
+        `target` being strings. A value that is not a string is passed to the event as its JSON encoding.
+        """
+        body = body.strip()
+        if body.startswith("["):
+            records = fastjson.loads(body)
+        else:
+            records = [fastjson.loads(line) for line in body.splitlines() if line.strip()]
+        events = []
+        for record in records:
+            if not isinstance(record, dict) or not isinstance(record.get("action"), type("")):
+                events.append((400, "Record is not an object with an action"))
+                continue
+            if not isinstance(record.get("target", target), type("")):
+                events.append((400, "Record target is not a string"))
+                continue
+            value = record.get("value", "")
+            if not isinstance(value, type("")):
+                value = fastjson.dumps(value)
+            events.append((record.get("target", target), record["action"], value))
+        return events
+
+    async def post_batch(self, target):
+        """
+        Triggers all the events of a batch
+
+        :param target: string defining the target of the records that do not give one
+        :returns: HTTP error 400 if the body is not a valid batch
+
+        every record is checked and queued as if it were posted on its own, and the response is a JSON
+        object giving the number of `accepted` events, and the index, HTTP error code and message of
+        every `rejected` one.
+        """
+        log.debug("post_batch(%s)", target)
+        try:
+            events = self.parse_batch(to_unicode(self.request.body), target)
+        except ValueError as ve:
+            self.send_error(400, mesg="Batch is not properly formatted: <br />{}".format(ve))
+            return
+        rejected = []
+        futures = []
+        for index, event in enumerate(events):
+            error = event if len(event) == 2 else self.check_event(event[0], event[1])
+            if error is None:
+                try:
+                    future = self.buffer_event(*event)
+                    if future is not None:
+                        futures.append(future)
+                except ValueError as ve:
+                    error = 400, "Data is not properly formatted: {}".format(ve)
+                except QueueFull:
+                    error = 503, "Event queue is full"
+            if error is not None:
+                rejected.append(dict(index = index, status = error[0], mesg = error[1]))
+        if futures:
+            await tornado.gen.multi(futures)
+        self.set_header("Content-Type", "application/json")
+        self.finish(json_encode(dict(accepted = len(events) - len(rejected), rejected = rejected)))
+
+    async def post(self, action, target):
         """
         Triggers an event
 
         :param action: string defining the type of event
         :param target: string defining the target handler to send it to
-        :returns: HTTP error 404 if `target` is not connected
+        :returns: HTTP error 404 if `target` is not connected, and has no frames kept for replay
         :returns: HTTP error 404 if `action` is not in Event.ACTIONS
         :returns: HTTP error 400 if data is not properly formatted.
+        :returns: HTTP error 400 if topics are enabled, and `target` is a pattern or a list
+        :returns: HTTP error 503 if the target's queue is full and the overflow policy is `OVERFLOW_REJECT`
 
         this method will look for the request body to get post's data.
+        When action is `Event.BATCH`, the body holds many events, see `post_batch()`.
         """
-        log.debug("post({},{})".format(target, action))
+        log.debug("post(%s,%s)", target, action)
         self.set_header("Accept", self._event_class.content_type)
-        if target not in list(self._connected.values()):
-            self.send_error(404, mesg="Target is not connected")
-        elif action not in self._event_class.ACTIONS:
-            self.send_error(404, mesg="Unknown action requested")
+        if action == self._event_class.BATCH:
+            await self.post_batch(target)
+            return
+        error = self.check_event(target, action)
+        if error is not None:
+            self.send_error(error[0], mesg=error[1])
         else:
             try:
-                self.buffer_event(target, action, self.request.body)
+                future = self.buffer_event(target, action, to_unicode(self.request.body))
+                if future is not None:
+                    await future
             except ValueError as ve:
                 self.send_error(400, mesg="Data is not properly formatted: <br />{}".format(ve))
+            except QueueFull:
+                self.send_error(503, mesg="Event queue is full")
 
     # Asynchronous actions
-    
-    def _event_loop(self, future):
+
+    async def _send(self, frames):
+        """
+        writes frames, and waits for them to be flushed to the client
+        """
+        self._flushing = True
+        try:
+            await self.push_frames(frames)
+        finally:
+            self._flushing = False
+
+    async def _event_loop(self):
         """
         for target matching current handler, gets and forwards all events
         until Event.FINISH is reached, and then closes the channel.
+
+        every event pending in the queue is processed in the same pass, and the
+        next pass waits for the events of the previous one to be flushed, so that
+        a slow client is not sent more than it reads, and for the conflation tick if any.
+        The loop ends when the handler is disconnected.
         """
-        event = future.result()
-        log.debug("_event_loop({})".format(event.target))
-        if self._event_class.RETRY in self._event_class.ACTIONS:
-            if event.action == self._event_class.RETRY:
-                try:
-                    self._retry = int(event.value[0])
+        while True:
+            items = [await self._queue.get()]
+            try:
+                while True:
+                    items.append(self._queue.get_nowait())
+            except QueueEmpty:
+                pass
+            batch = []
+            for item in items:
+                if item is None:
                     return
-                except ValueError:
-                    log.error("incorrect retry value: {}".format(event.value))
-        if event.action == self._event_class.FINISH:
-            self.set_disconnected()
-            self.finish()
-            return
-        self.push(event)
-        self._lock[event.target] = Future()
-        self._lock[event.target].add_done_callback(self._event_loop)
-        
+                self._release(item)
+                event, frame = item
+                if event.action == self._event_class.FINISH:
+                    if batch:
+                        await self._send(batch)
+                    self.set_disconnected()
+                    if self._compressor is not None:
+                        self.write(self._compressor.flush())
+                    self.finish()
+                    return
+                batch.append(frame)
+            log.debug("_event_loop(%s): %d events", items[0][0].target, len(batch))
+            await self._send(batch)
+            self._sent(batch)
+            if self._metrics is not None:
+                self._flushed([item[0] for item in items])
+            if self._conflation_tick:
+                await tornado.gen.sleep(self._conflation_tick / 1000.0)
+
+    def _flushed(self, events):
+        """
+        counts events flushed to the client, and the time since they were published
+        """
+        self._metrics.pushed.inc(len(events))
+        now = time.time()
+        for event in events:
+            published = getattr(event, "published", None)
+            if published is not None:
+                self._metrics.latency.observe(now - published)
+
+    def _sent(self, frames):
+        """
+        accounts frames flushed to the client, current handler recovering from being
+        a slow consumer once its pending bytes fall to the low watermark
+        """
+        self._pending -= sum(len(frame) for frame in frames)
+        if self._slow and self._pending <= self._low_watermark:
+            log.info("_sent(): slow consumer recovered, %d bytes pending", self._pending)
+            self._slow = False
 
-    @tornado.web.asynchronous
-    def get(self, action, target):
+    async def _replay(self, replay):
         """
-        Opens a new event_source connection and wait for events to come
+        sends the frames given by the store for a replay
 
-        :returns: error 423 if the target token already exists
+        frames are written by chunks of `REPLAY_CHUNK_SIZE` bytes, each chunk
+        being flushed before reading the next one from the store. When current
+        handler has a filter, the frames of each chunk given by the store are read
+        back to be filtered.
+        """
+        frames = []
+        length = 0
+        for frame in replay:
+            if self.event_filter is not None:
+                frame = b"".join(frame for frame in encoder.split_frames(frame) if self._replay_accepted(frame))
+                if not frame:
+                    continue
+            frames.append(frame)
+            length += len(frame)
+            if length >= self.REPLAY_CHUNK_SIZE:
+                await self._send(frames)
+                self._replayed(frames)
+                frames = []
+                length = 0
+        if frames:
+            await self._send(frames)
+            self._replayed(frames)
+
+    def _replay_accepted(self, frame):
+        action, data = encoder.decode_frame(frame)
+        if action is None:
+            return True
+        def fields():
+            try:
+                return fastjson.loads(data)
+            except ValueError:
+                return None
+        return self.event_filter.accepts(action, fields)
+
+    def _replayed(self, chunks):
+        """
+        counts the events replayed to the client, stores giving chunks of several frames
+        """
+        if self._metrics is not None:
+            self._metrics.pushed.inc(sum(len(encoder.split_frames(chunk)) for chunk in chunks))
+
+    async def get(self, action, target):
+        """
+        Opens a new event_source connection, and forwards events until the channel is closed
+
+        If the client gives a `Last-Event-ID` header, the frames it missed are sent first.
+        When topics are enabled, frames are only replayed to clients following a single topic.
+        If compression is enabled, the stream is compressed with the coding accepted by the client.
+        If the `action` and `filter` query arguments are given, only the events they accept are sent.
         Redirects to / if action is not matching Event.LISTEN.
+        Returns HTTP error 400 if topics are enabled, and target is not a valid list of topics.
+        Returns HTTP error 400 if the filter is not valid.
         """
-        log.debug("get({},{})".format(target, action))
-        if action == self._event_class.LISTEN:
-            self.set_header("Content-Type", "text/event-stream")
-            self.set_header("Cache-Control", "no-cache")
-            if self.is_connected(target):
-                self.send_error(423, mesg="Target is already connected")
-                return
-            self.set_connected(target)
-            if self._keepalive:
-                self._keepalive.start()
-            self._lock[target].add_done_callback(self._event_loop)
-        else:
+        log.debug("get(%s,%s)", target, action)
+        if action != self._event_class.LISTEN:
             self.redirect("/", permanent = True)
-    
+            return
+        topics = None
+        replayed = target
+        if self._topics:
+            try:
+                topics = split_topics(target)
+            except ValueError as ve:
+                self.send_error(400, mesg="Topics are not properly formatted: <br />{}".format(ve))
+                return
+            replayed = topics[0] if len(topics) == 1 and not is_pattern(topics[0]) else None
+        try:
+            self.event_filter = EventFilter.from_arguments(self.get_query_arguments("action"),
+                                                           self.get_query_arguments("filter"))
+        except ValueError as ve:
+            self.send_error(400, mesg="Filter is not properly formatted: <br />{}".format(ve))
+            return
+        error = self.check_filter(self.event_filter)
+        if error is not None:
+            self.event_filter = None
+            self.send_error(error[0], mesg=error[1])
+            return
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        if self._compression:
+            self.add_header("Vary", "Accept-Encoding")
+            self._encoding = self.negotiate_encoding()
+        last_event_id = self.request.headers.get("Last-Event-ID")
+        replay = None
+        if last_event_id is not None and replayed is not None and self.has_replay(replayed):
+            # the frames to replay are fixed before subscribing, so the events
+            # posted from now on are only queued
+            log.debug("get(): replaying %s after %s", replayed, last_event_id)
+            replay = self._store.replay(replayed, last_event_id)
+        self.set_connected(target, topics)
+        if self._keepalive is not None:
+            self._keepalive.add(self)
+        try:
+            if replay is not None:
+                await self._replay(replay)
+            await self._event_loop()
+        except tornado.iostream.StreamClosedError:
+            self.set_disconnected()
+        except Exception:
+            self.set_disconnected()
+            raise
+
     def on_connection_close(self):
         """
         overloads RequestHandler's on_connection_close to disconnect
@@ -364,6 +1192,44 @@ class EventSourceHandler(tornado.web.RequestHandler):
 
 ###
 
+def worker_addresses(address, count):
+    """
+    Lists the broker addresses of the workers of a node
+
+    :param address: `host:port` address of the node
+    :param count: number of workers of the node
+    :returns: list of `host:port` addresses, worker `i` listening on `port + i`
+    :raises ValueError: if the port is not a number
+    """
+    host, port = address.rsplit(":", 1)
+    return ["{}:{}".format(host, int(port) + i) for i in range(count)]
+
+def check_parent(pid):
+    """
+    Stops a worker process once the process that forked it is gone
+
+    :param pid: process id of the parent process
+    """
+    if os.getppid() != pid:
+        log.info("parent process %s is gone, stopping", pid)
+        tornado.ioloop.IOLoop.current().stop()
+
+def remove_sockets(path, pid):
+    """
+    Removes the directory of the sockets of the workers, once they are gone
+
+    :param path: path of the directory
+    :param pid: process id of the process which created it, the only one removing it
+    """
+    if os.getpid() == pid:
+        shutil.rmtree(path, ignore_errors = True)
+
+def exit_on_signal(signum, frame):
+    """
+    Exits the parent process on SIGTERM, running the functions registered with atexit
+    """
+    sys.exit(0)
+
 def start():
     """helper method to create a commandline utility"""
     parser = argparse.ArgumentParser(prog = sys.argv[0],
@@ -404,6 +1270,12 @@ def start():
                         action="store_true",
                         help="to enable JSON Event")
 
+    parser.add_argument("-T",
+                        "--topics",
+                        dest="topics",
+                        action="store_true",
+                        help="Targets are dot separated topics, clients following comma separated topics and * or # patterns")
+
     parser.add_argument("-k",
                         "--keepalive",
                         dest="keepalive",
@@ -416,6 +1288,131 @@ def start():
                         action="store_true",
                         help="to generate identifiers")
 
+    parser.add_argument("-g",
+                        "--id-generator",
+                        dest="id_generator",
+                        default=None,
+                        choices=["counter", "snowflake"],
+                        help="counter ids start from 0 on every restart, snowflake ids are unique between nodes and grow with time, "
+                             "and are the default with several workers or nodes, or with a store")
+
+    parser.add_argument("-r",
+                        "--replay-size",
+                        dest="replay_size",
+                        default="0",
+                        help="Number of events kept in memory per target to be replayed on reconnection (0 disables replay)")
+
+    parser.add_argument("-a",
+                        "--replay-age",
+                        dest="replay_age",
+                        default="0",
+                        help="Time during which events are kept to be replayed, in seconds (0 means forever)")
+
+    parser.add_argument("-s",
+                        "--store",
+                        dest="store",
+                        default="",
+                        help="Directory where events are stored to be replayed, even after a restart")
+
+    parser.add_argument("-S",
+                        "--store-size",
+                        dest="store_size",
+                        default="0",
+                        help="Maximum size of the events stored per target, in bytes (0 means unbounded)")
+
+    parser.add_argument("-q",
+                        "--queue-size",
+                        dest="queue_size",
+                        default="0",
+                        help="Maximum number of pending events per target (0 means unbounded)")
+
+    parser.add_argument("-o",
+                        "--overflow",
+                        dest="overflow",
+                        default=EventSourceHandler.OVERFLOW_BLOCK,
+                        choices=EventSourceHandler.OVERFLOWS,
+                        help="What to do with new events when a target's queue is full")
+
+    parser.add_argument("-B",
+                        "--high-watermark",
+                        dest="high_watermark",
+                        default="0",
+                        help="Bytes pending for a client from which it is a slow consumer (0 means unbounded)")
+
+    parser.add_argument("-L",
+                        "--low-watermark",
+                        dest="low_watermark",
+                        default="0",
+                        help="Bytes pending under which a slow consumer recovers (0 means half the high watermark)")
+
+    parser.add_argument("-c",
+                        "--slow-consumer",
+                        dest="slow_policy",
+                        default=EventSourceHandler.SLOW_DROP,
+                        choices=EventSourceHandler.SLOW_POLICIES,
+                        help="What to do with new events of a slow consumer")
+
+    parser.add_argument("-x",
+                        "--conflate",
+                        dest="conflation",
+                        default=EventSourceHandler.CONFLATE_NONE,
+                        choices=EventSourceHandler.CONFLATIONS,
+                        help="Key of the pending events replaced by the next ones, only the latest being sent")
+
+    parser.add_argument("-t",
+                        "--tick",
+                        dest="conflation_tick",
+                        default="0",
+                        help="Minimum time between two writes to a client, in milliseconds (0 means no delay)")
+
+    parser.add_argument("-z",
+                        "--compress",
+                        dest="compression",
+                        action="store_true",
+                        help="Compresses the streams of the clients accepting gzip or deflate")
+
+    parser.add_argument("-l",
+                        "--compress-level",
+                        dest="compression_level",
+                        default="6",
+                        help="zlib compression level, from 1 (fastest) to 9 (smallest)")
+
+    parser.add_argument("-Z",
+                        "--compress-min-size",
+                        dest="compression_min_size",
+                        default="0",
+                        help="Size of the first write of a stream from which the stream is compressed, in bytes")
+
+    parser.add_argument("-w",
+                        "--workers",
+                        dest="workers",
+                        default="1",
+                        help="Number of worker processes sharing the port, 0 for one per CPU")
+
+    parser.add_argument("-n",
+                        "--node",
+                        dest="node",
+                        default="",
+                        help="host:port address where the brokers of this node listen for the other nodes, worker i using port + i")
+
+    parser.add_argument("-p",
+                        "--peers",
+                        dest="peers",
+                        default="",
+                        help="Comma separated host:port addresses of the other nodes, all running the same number of workers")
+
+    parser.add_argument("-u",
+                        "--uvloop",
+                        dest="uvloop",
+                        action="store_true",
+                        help="Runs on the uvloop event loop, if installed")
+
+    parser.add_argument("-m",
+                        "--metrics",
+                        dest="metrics",
+                        action="store_true",
+                        help="Serves the metrics of the listener on /metrics, in the Prometheus text format")
+
     args = parser.parse_args(sys.argv[1:])
 
     if args.debug:
@@ -440,10 +1437,146 @@ def start():
         log.error("keepalive takes a numerical value")
         sys.exit(1)
 
+    try:
+        args.queue_size = int(args.queue_size)
+    except ValueError:
+        log.error("queue size takes a numerical value")
+        sys.exit(1)
+
+    try:
+        args.high_watermark = int(args.high_watermark)
+        args.low_watermark = int(args.low_watermark)
+    except ValueError:
+        log.error("watermarks take numerical values")
+        sys.exit(1)
+
+    try:
+        args.conflation_tick = int(args.conflation_tick)
+    except ValueError:
+        log.error("tick takes a numerical value")
+        sys.exit(1)
+    if args.low_watermark > args.high_watermark:
+        log.error("the low watermark shall not be above the high watermark")
+        sys.exit(1)
+
+    try:
+        args.compression_level = int(args.compression_level)
+        args.compression_min_size = int(args.compression_min_size)
+    except ValueError:
+        log.error("compression level and minimum size take numerical values")
+        sys.exit(1)
+    if not 1 <= args.compression_level <= 9:
+        log.error("the compression level shall be between 1 and 9")
+        sys.exit(1)
+
+    try:
+        args.replay_size = int(args.replay_size)
+        args.replay_age = int(args.replay_age)
+        args.store_size = int(args.store_size)
+    except ValueError:
+        log.error("replay size and age, and store size take numerical values")
+        sys.exit(1)
+
+    try:
+        args.port = int(args.port)
+        args.workers = int(args.workers) or tornado.process.cpu_count()
+        nodes = []
+        if args.node != "":
+            nodes = worker_addresses(args.node, args.workers)
+            peers = [address for peer in args.peers.split(",") if peer != ""
+                             for address in worker_addresses(peer, args.workers)]
+    except ValueError:
+        log.error("port and workers take numerical values, and nodes are host:port addresses")
+        sys.exit(1)
+
+    if args.uvloop:
+        try:
+            import uvloop
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        except ImportError:
+            log.warning("uvloop is not installed, running on the default asyncio event loop")
+
+    if args.id_generator is None:
+        args.id_generator = "snowflake" if args.workers > 1 or nodes or args.store != "" else "counter"
+    elif args.id_generator == "counter" and args.id and args.store != "":
+        # the stored ids would be given again after a restart, and resume clients at the wrong event
+        log.error("counter ids start again on every restart, a store needs [-g|--id-generator] snowflake")
+        sys.exit(1)
+    elif args.id_generator == "counter" and args.id and (args.workers > 1 or nodes):
+        log.warning("counter ids collide between workers and nodes, use [-g|--id-generator] snowflake")
+    if (args.replay_size or args.store) and not args.id:
+        log.warning("replay is only done for events having an id, use it with [-i|--id]")
+
+    worker = 0
+    if args.workers > 1:
+        # workers of a single node are linked through a directory of unix domain sockets
+        if not nodes:
+            path = tempfile.mkdtemp(prefix = "eventsource-")
+            nodes = [os.path.join(path, "worker-{}.sock".format(i)) for i in range(args.workers)]
+            peers = []
+            atexit.register(remove_sockets, path, os.getpid())
+            signal.signal(signal.SIGTERM, exit_on_signal)
+        # each worker binds its own socket on the port, for the kernel to balance connections between them
+        worker = tornado.process.fork_processes(args.workers)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        sockets = tornado.netutil.bind_sockets(args.port, reuse_port = True)
+
+    if args.id_generator == "snowflake":
+        # every node numbers itself from the sorted addresses of all the nodes
+        node = sorted(nodes + peers).index(nodes[worker]) if nodes else 0
+        try:
+            EventId.generator = SnowflakeIdGenerator(node)
+        except ValueError as err:
+            log.error("%s: too many nodes for snowflake ids", err)
+            sys.exit(1)
+    ordered_ids = EventId.generator.ordered
+
+    store = None
+    if args.store != "":
+        # each worker keeps its own copy of the events, replicated by the broker
+        path = os.path.join(args.store, "worker-{}".format(worker)) if args.workers > 1 else args.store
+        store = SegmentEventStore(path, max_age = args.replay_age, max_bytes = args.store_size, ordered_ids = ordered_ids)
+    elif args.replay_size != 0:
+        store = MemoryEventStore.instance(args.replay_size, args.replay_age, ordered_ids = ordered_ids)
+
+    metrics = None
+    if args.metrics:
+        metrics = ListenerMetrics(collect = EventSourceHandler.collect_metrics)
+
+    broker = None
+    if nodes:
+        broker = SocketBroker(nodes[worker], nodes + peers, functools.partial(EventSourceHandler.deliver,
+                                                                              store = store,
+                                                                              metrics = metrics),
+                              replicate = store is not None)
+        broker.start()
+    if args.workers > 1:
+        tornado.ioloop.PeriodicCallback(functools.partial(check_parent, os.getppid()), 1000).start()
+
     ###
+    routes = []
+    if metrics is not None:
+        routes.append((r"/metrics", MetricsHandler, dict(registry = metrics)))
     try:
-        application = tornado.web.Application([
-            (r"/(.*)/(.*)", EventSourceHandler, dict(event_class = chosen_event, keepalive = args.keepalive)),
+        application = tornado.web.Application(routes + [
+            (r"/(.*)/(.*)", EventSourceHandler, dict(event_class = chosen_event,
+                                                      keepalive = args.keepalive,
+                                                      queue_size = args.queue_size,
+                                                      overflow = args.overflow,
+                                                      replay_size = args.replay_size,
+                                                      replay_age = args.replay_age,
+                                                      store = store,
+                                                      broker = broker,
+                                                      high_watermark = args.high_watermark,
+                                                      low_watermark = args.low_watermark,
+                                                      slow_policy = args.slow_policy,
+                                                      conflation = args.conflation,
+                                                      conflation_tick = args.conflation_tick,
+                                                      compression = args.compression,
+                                                      compression_level = args.compression_level,
+                                                      compression_min_size = args.compression_min_size,
+                                                      metrics = metrics,
+                                                      topics = args.topics)),
         ])
 
         if args.ssl_certfile != "" or args.ssl_keyfile != "":
@@ -455,7 +1588,12 @@ def start():
             else:
                 log.error("[-C|--certfile] and [-K|--keyfile] shall be specified *together* to enable SSL use. SSL is disabled.")
 
-        application.listen(int(args.port))
+        if args.workers > 1:
+            if not isinstance(application, tornado.httpserver.HTTPServer):
+                application = tornado.httpserver.HTTPServer(application)
+            application.add_sockets(sockets)
+        else:
+            application.listen(args.port)
         tornado.ioloop.IOLoop.instance().start()
     except ValueError:
         log.error("The port '%d' shall be a numerical value.".format(args.port))
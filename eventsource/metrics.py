@@ -0,0 +1,237 @@
+# -+- encoding: utf-8 -+-
+"""
+.. module:: metrics
+:platform: Unix
+:synopsis: This module counts what the listener does, and serves it in the Prometheus text format
+
+Three kinds of metrics are available, each one optionally split by labels:
+    - **Counter** only grows, like a number of events or of bytes
+    - **Gauge** goes up and down, like a number of connections
+    - **Histogram** counts observations in buckets, like latencies
+
+Metrics are gathered in a `MetricsRegistry`, served by a `MetricsHandler`. Values kept elsewhere,
+like the connections of the listener, are read only when the metrics are rendered, through the
+`collect` function of the registry, so that they cost nothing until they are scraped.
+
+.. note::
+resources:
+    - https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+
+from __future__ import unicode_literals
+
+import bisect
+
+import tornado.web
+
+def _escape(value):
+    return "{}".format(value).replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join("{}=\"{}\"".format(name, _escape(value)) for name, value in zip(names, values)) + "}"
+
+class Metric(object):
+    """
+    Base class of the metrics
+
+    Members:
+        - **name** of the metric
+        - **help** describing the metric
+        - **labels** tuple of the names of the labels splitting the metric
+    """
+    type = "untyped"
+
+    def __init__(self, name, help, labels = ()):
+        """
+        :param name: name of the metric
+        :param help: description of the metric
+        :param labels: names of the labels splitting the metric
+        """
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        if not self.labels:
+            self._values[()] = 0
+
+    def set(self, value, labels = ()):
+        """
+        :param value: new value
+        :param labels: tuple of the values of the labels
+        """
+        self._values[labels] = value
+
+    def clear(self):
+        """
+        Forgets the values of all the labels, to set them again
+        """
+        self._values.clear()
+        if not self.labels:
+            self._values[()] = 0
+
+    def samples(self):
+        """
+        :returns: an iterator over the (name, labels, value) samples of the metric
+        """
+        for labels, value in sorted(self._values.items()):
+            yield self.name, _format_labels(self.labels, labels), value
+
+class Counter(Metric):
+    """
+    Metric which only grows
+
+    `set()` is only meant for counters kept elsewhere, and copied when collected.
+    """
+    type = "counter"
+
+    def inc(self, amount = 1, labels = ()):
+        """
+        :param amount: number added to the counter
+        :param labels: tuple of the values of the labels
+        """
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+class Gauge(Counter):
+    """
+    Metric which goes up and down
+    """
+    type = "gauge"
+
+    def dec(self, amount = 1, labels = ()):
+        """
+        :param amount: number removed from the gauge
+        :param labels: tuple of the values of the labels
+        """
+        self.inc(-amount, labels)
+
+class Histogram(Metric):
+    """
+    Metric counting observations in buckets, with their sum
+    """
+    type = "histogram"
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, help, buckets = BUCKETS):
+        """
+        :param name: name of the metric
+        :param help: description of the metric
+        :param buckets: sorted upper bounds of the buckets, an unbounded bucket being added
+        """
+        Metric.__init__(self, name, help)
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0
+        self._count = 0
+
+    def observe(self, value):
+        """
+        :param value: observed value
+        """
+        self._counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sum += value
+        self._count += 1
+
+    def samples(self):
+        count = 0
+        for bound, bucket in zip(self.buckets + ("+Inf",), self._counts):
+            count += bucket
+            yield self.name + "_bucket", _format_labels(("le",), (bound,)), count
+        yield self.name + "_sum", "", self._sum
+        yield self.name + "_count", "", self._count
+
+class MetricsRegistry(object):
+    """
+    Set of metrics rendered together
+    """
+    def __init__(self, collect = None):
+        """
+        :param collect: function called with the registry before rendering it, to update the metrics
+            which values are kept elsewhere
+        """
+        self.collect = collect
+        self._metrics = []
+
+    def register(self, metric):
+        """
+        :param metric: `Metric` to render along with the others
+        :returns: metric
+        """
+        self._metrics.append(metric)
+        return metric
+
+    def __iter__(self):
+        return iter(self._metrics)
+
+    def render(self):
+        """
+        :returns: all the metrics, in the Prometheus text format
+        """
+        if self.collect is not None:
+            self.collect(self)
+        lines = []
+        for metric in self._metrics:
+            lines.append("# HELP {} {}".format(metric.name, metric.help.replace("\\", "\\\\").replace("\n", "\\n")))
+            lines.append("# TYPE {} {}".format(metric.name, metric.type))
+            for name, labels, value in metric.samples():
+                lines.append("{}{} {}".format(name, labels, value))
+        return "\n".join(lines) + "\n"
+
+class ListenerMetrics(MetricsRegistry):
+    """
+    Metrics of an event source listener
+
+    Counters and the latency histogram are updated by the handlers given this registry. Gauges,
+    and the counters kept by the handlers, are updated by the `collect` function, like
+    `EventSourceHandler.collect_metrics()`.
+    """
+    LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, collect = None):
+        """
+        :param collect: function called with the registry before rendering it
+        """
+        MetricsRegistry.__init__(self, collect)
+        self.connections = self.register(Gauge("eventsource_connections",
+                                               "Open event source connections, per target", ("target",)))
+        self.queued = self.register(Gauge("eventsource_queued_events",
+                                          "Events queued for the clients"))
+        self.pending = self.register(Gauge("eventsource_pending_bytes",
+                                           "Bytes of the events pending for the clients, queued or being flushed"))
+        self.slow = self.register(Gauge("eventsource_slow_consumers",
+                                        "Clients being slow consumers"))
+        self.published = self.register(Counter("eventsource_events_published_total",
+                                               "Events posted on this node, per action", ("action",)))
+        self.relayed = self.register(Counter("eventsource_events_relayed_total",
+                                             "Events relayed from the other nodes"))
+        self.pushed = self.register(Counter("eventsource_events_pushed_total",
+                                            "Events written to the clients, replayed ones included"))
+        self.dropped = self.register(Counter("eventsource_events_dropped_total",
+                                             "Events dropped from full queues or for slow consumers"))
+        self.filtered = self.register(Counter("eventsource_events_filtered_total",
+                                              "Events not queued for the clients which filters rejected them"))
+        self.conflated = self.register(Counter("eventsource_events_conflated_total",
+                                               "Pending events replaced by conflated ones"))
+        self.disconnected = self.register(Counter("eventsource_slow_consumers_disconnected_total",
+                                                  "Slow consumers disconnected"))
+        self.written = self.register(Counter("eventsource_written_bytes_total",
+                                             "Bytes written to the clients, keepalives included"))
+        self.latency = self.register(Histogram("eventsource_publish_flush_seconds",
+                                               "Time from the publication of an event to its flush to a client",
+                                               self.LATENCY_BUCKETS))
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """
+    Handler serving a `MetricsRegistry` on `GET`, in the Prometheus text format
+    """
+    def initialize(self, registry):
+        """
+        :param registry: `MetricsRegistry` to serve
+        """
+        self._registry = registry
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.finish(self._registry.render())
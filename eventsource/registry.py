@@ -0,0 +1,130 @@
+# -+- encoding: utf-8 -+-
+"""
+.. module:: registry
+:platform: Unix
+:synopsis: This module indexes the connected handlers by target and by handler
+
+Every lookup, count and membership test is done in constant time, whatever
+the number of open connections. Once handlers follow patterns of topics, finding
+the subscribers of a target also costs a lookup per level of the target.
+"""
+
+from __future__ import unicode_literals
+
+from eventsource.topics import TopicTrie, check_pattern
+
+class ConnectionRegistry(object):
+    """
+    Two ways index of the open connections:
+        - **target → handlers**, to find the subscribers of a target
+        - **handler → target**, to find what a handler is subscribed to
+
+    A handler subscribes to a target, which is either followed as it is, or given as a
+    list of topics and of patterns of topics, see the topics module. The subscribers of a
+    target are then the handlers following it, or a pattern matching it.
+    """
+    def __init__(self):
+        self._subscribers = TopicTrie()
+        self._targets = {}
+        self._topics = {}
+
+    def add(self, target, handler, topics = None):
+        """
+        Subscribes a handler to a target
+
+        :param target: string identifying a given target
+        :param handler: the subscribing handler
+        :param topics: list of the topics and patterns followed by handler, `None` to follow target as it is
+        :raises ValueError: if a pattern is not valid
+
+        a handler is subscribed to one target at most, a previous subscription is replaced.
+        """
+        if topics is not None:
+            topics = list(topics)
+            for topic in topics:
+                check_pattern(topic)
+        if handler in self._targets:
+            self.remove(handler)
+        if topics is None:
+            self._subscribers.add(target, handler, pattern = False)
+        else:
+            for topic in topics:
+                self._subscribers.add(topic, handler)
+            self._topics[handler] = topics
+        self._targets[handler] = target
+
+    def remove(self, handler):
+        """
+        Unsubscribes a handler
+
+        :param handler: the subscribed handler
+        :returns: the target the handler was subscribed to
+        :raises KeyError: if the handler is not subscribed
+        """
+        target = self._targets.pop(handler)
+        topics = self._topics.pop(handler, None)
+        if topics is None:
+            self._subscribers.remove(target, handler, pattern = False)
+        else:
+            for topic in topics:
+                self._subscribers.remove(topic, handler)
+        return target
+
+    def topics(self, handler):
+        """
+        :param handler: a handler
+        :returns: the list of the topics and patterns followed by handler, or `None` if it follows its target as it is
+        """
+        return self._topics.get(handler)
+
+    def target(self, handler):
+        """
+        :param handler: a handler
+        :returns: the target the handler is subscribed to, or `None`
+        """
+        return self._targets.get(handler)
+
+    def subscribers(self, target):
+        """
+        :param target: string identifying a given target
+        :returns: the set of handlers subscribed to target, or to a pattern matching it, which shall not be modified
+        """
+        return self._subscribers.match(target)
+
+    def is_connected(self, target):
+        """
+        :param target: string identifying a given target
+        :returns: true if at least one handler is subscribed to target, or to a pattern matching it
+        """
+        return self._subscribers.matches(target)
+
+    def is_followed(self, topic):
+        """
+        :param topic: string identifying a given target, topic or pattern
+        :returns: true if at least one handler follows topic itself
+        """
+        return topic in self._subscribers
+
+    def count(self, target = None):
+        """
+        :param target: string identifying a given target, topic or pattern, or `None`
+        :returns: the number of handlers following target itself, or of all handlers if target is `None`
+        """
+        if target is None:
+            return len(self._targets)
+        return len(self._subscribers.get(target))
+
+    def targets(self):
+        """
+        :returns: an iterator over the targets, topics and patterns followed by at least one handler
+        """
+        return iter(self._subscribers)
+
+    def __len__(self):
+        return len(self._targets)
+
+    def __contains__(self, handler):
+        return handler in self._targets
+
+    def __iter__(self):
+        return iter(self._targets)
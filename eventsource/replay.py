@@ -0,0 +1,98 @@
+# -+- encoding: utf-8 -+-
+"""
+.. module:: replay
+:platform: Unix
+:synopsis: This module keeps the last frames sent on a target, to resend them on reconnection
+
+When a client reconnects, it gives the id of the last event it got in the `Last-Event-ID`
+header, and every frame sent on its target since that event can be sent back at once.
+"""
+
+from __future__ import unicode_literals
+
+import time
+from array import array
+
+class ReplayBuffer(object):
+    """
+    Ring buffer of the last encoded frames of a target, indexed by event id
+
+    The buffer holds at most `size` frames, and frames older than `max_age` seconds
+    are forgotten. Ids, times and frames are kept in three rings, times being
+    packed in an array, so that no object is allocated per frame besides its id.
+    """
+    def __init__(self, size = 1000, max_age = 0, ordered_ids = False):
+        """
+        :param size: maximum number of frames kept
+        :param max_age: maximum age of the frames kept, in seconds. If `0`, frames do not expire.
+        :param ordered_ids: if true, ids are numbers growing with time, see `IdGenerator.ordered`
+        """
+        self.size = int(size)
+        self.max_age = max_age
+        self.ordered_ids = ordered_ids
+        self._ids = [None] * self.size
+        self._times = array("d", [0.0]) * self.size
+        self._frames = [None] * self.size
+        self._index = {}
+        self._first = 0
+        self._next = 0
+
+    def __len__(self):
+        return self._next - self._first
+
+    def _evict(self):
+        slot = self._first % self.size
+        id = self._ids[slot]
+        self._ids[slot] = self._frames[slot] = None
+        if self._index.get(id) == self._first:
+            del(self._index[id])
+        self._first += 1
+
+    def append(self, id, frame):
+        """
+        Stores the frame of an event, evicting the oldest one if the buffer is full
+
+        :param id: id of the event
+        :param frame: bytes of the encoded event
+        """
+        if len(self) == self.size:
+            self._evict()
+        id = "{}".format(id)
+        slot = self._next % self.size
+        self._ids[slot] = id
+        self._times[slot] = time.time()
+        self._frames[slot] = frame
+        self._index[id] = self._next
+        self._next += 1
+
+    def prune(self):
+        """
+        Forgets the frames older than `max_age`
+        """
+        if not self.max_age:
+            return
+        deadline = time.time() - self.max_age
+        while len(self) and self._times[self._first % self.size] < deadline:
+            self._evict()
+
+    def frames_after(self, last_id):
+        """
+        Lists the frames sent after a given event
+
+        :param last_id: id of the last event known by a client
+        :returns: list of frames following that event, oldest first.
+            If the id is not in the buffer, every frame kept is returned, or with ordered ids,
+            the frames of the events having a greater id.
+        """
+        self.prune()
+        start = self._index.get("{}".format(last_id))
+        if start is None and self.ordered_ids:
+            try:
+                key = int(last_id)
+            except ValueError:
+                pass
+            else:
+                return [self._frames[seq % self.size] for seq in range(self._first, self._next)
+                        if int(self._ids[seq % self.size]) > key]
+        start = self._first if start is None else start + 1
+        return [self._frames[seq % self.size] for seq in range(start, self._next)]
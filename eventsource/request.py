@@ -1,42 +1,345 @@
+# -+- encoding: utf-8 -+-
+"""
+.. module:: request
+:platform: Unix
+:synopsis: This module publishes events on an eventsource listener
+
+Publishers keep their HTTP connections to the listener open between two events:
+    - **Publisher** holds a pool of keep-alive connections, and can be shared by threads
+    - **AsyncPublisher** sends events through a `CurlAsyncHTTPClient` of its own
+
+Both can send many events in a single request, using the listener's `batch` action.
+"""
+
+from __future__ import unicode_literals, print_function
+
 import sys
+import json
+import select
 import argparse
+import threading
+import http.client as httplib
+from urllib.parse import urlsplit, quote
 
-import json
-import urllib2
+from tornado.httpclient import HTTPRequest
+from tornado.curl_httpclient import CurlAsyncHTTPClient
+
+class PublishError(Exception):
+    """
+    Raised when the listener refuses an event
+        - **code** is the HTTP error code returned by the listener
+        - **mesg** is the message of the error
+    """
+    def __init__(self, code, mesg):
+        Exception.__init__(self, "{}: {}".format(code, mesg))
+        self.code = code
+        self.mesg = mesg
+
+    @classmethod
+    def from_response(cls, code, body):
+        """builds the error from the HTML error page of the listener"""
+        mesg = body.decode("utf-8", "replace").split("<body>")[-1].split("</body>")[0]
+        prefix = "{}: ".format(code)
+        return cls(code, mesg[len(prefix):] if mesg.startswith(prefix) else mesg)
+
+def _encode(data, as_json = False):
+    """
+    :param data: string or object to send
+    :param as_json: if true, data is checked, or encoded, as JSON
+    :returns: bytes of the body of the request
+    """
+    if as_json:
+        if isinstance(data, (bytes, type(""))):
+            data = json.dumps(json.loads(data))
+        else:
+            data = json.dumps(data)
+    if not isinstance(data, bytes):
+        data = data.encode("utf-8")
+    return data
+
+def _path(prefix, action, target):
+    """
+    :returns: the path to post an event of action on target
+    """
+    prefix = "/" + prefix.strip("/") if prefix.strip("/") else ""
+    return "{}/{}/{}".format(prefix, quote(action.encode("utf-8"), safe = ""),
+                             quote(target.encode("utf-8"), safe = ":@"))
+
+def _batch(records):
+    """
+    :param records: iterable of (target, action, value) tuples
+    :returns: bytes of the body of a batch request, with one record per line
+    """
+    return "\n".join(json.dumps(dict(target = target, action = action, value = value))
+                     for target, action, value in records).encode("utf-8")
+
+class Publisher(object):
+    """
+    Sends events to a listener over a pool of keep-alive connections
+
+    Connections are opened when needed, and kept open to send the next events.
+    At most `pool_size` idle connections are kept, the others being closed.
+    """
+    BATCH = "batch"
+
+    def __init__(self, host = "127.0.0.1", port = 8888, ssl = False, prefix = "", pool_size = 4, timeout = None):
+        """
+        :param host: host of the listener
+        :param port: port of the listener
+        :param ssl: if true, connects using HTTPS
+        :param prefix: path prefix of the listener's URLs
+        :param pool_size: maximum number of idle connections kept open
+        :param timeout: timeout of the connections, in seconds
+        """
+        self.host = host
+        self.port = int(port)
+        self.ssl = ssl
+        self.prefix = prefix
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._pool = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self.ssl:
+            return httplib.HTTPSConnection(self.host, self.port, timeout = self.timeout)
+        return httplib.HTTPConnection(self.host, self.port, timeout = self.timeout)
+
+    @staticmethod
+    def _dropped(connection):
+        """tells whether an idle connection was closed by the listener, its socket being readable"""
+        if connection.sock is None:
+            return False
+        readable, _, _ = select.select([connection.sock], [], [], 0)
+        return bool(readable)
+
+    def _acquire(self):
+        while True:
+            with self._lock:
+                if not self._pool:
+                    return self._connect(), False
+                connection = self._pool.pop()
+            if not self._dropped(connection):
+                return connection, True
+            connection.close()
+
+    def _release(self, connection):
+        with self._lock:
+            if len(self._pool) < self.pool_size:
+                self._pool.append(connection)
+                return
+        connection.close()
+
+    def request(self, path, body, content_type = "text/plain"):
+        """
+        Posts a body on the listener, reusing an idle connection if any
+
+        :param path: path of the URL to post to
+        :param body: bytes to post
+        :param content_type: value of the Content-Type header
+        :returns: bytes of the response
+        :raises PublishError: if the listener answers with an error
+
+        idle connections closed by the listener are dropped before sending. A request which
+        could not be sent whole on a reused connection is sent again on a new connection, as
+        the listener cannot have read it. Once sent, a request is never sent again, as the
+        listener may have triggered its event before failing to answer.
+        """
+        connection, reused = self._acquire()
+        while True:
+            try:
+                connection.request("POST", path, body, {"Content-Type": content_type})
+                break
+            except (httplib.HTTPException, IOError):
+                connection.close()
+                if not reused:
+                    raise
+                connection, reused = self._connect(), False
+        try:
+            response = connection.getresponse()
+            data = response.read()
+        except (httplib.HTTPException, IOError):
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(connection)
+        if response.status >= 400:
+            raise PublishError.from_response(response.status, data)
+        return data
+
+    def publish(self, target, action, data = "", as_json = False):
+        """
+        Sends an event
+
+        :param target: token of the channel to send the event to
+        :param action: action of the event
+        :param data: string, or object if as_json is true, to send
+        :param as_json: if true, data is checked, or encoded, as JSON
+        :returns: bytes of the response
+        :raises PublishError: if the listener refuses the event
+        """
+        return self.request(_path(self.prefix, action, target), _encode(data, as_json),
+                            "application/json" if as_json else "text/plain")
+
+    def publish_batch(self, records):
+        """
+        Sends many events in a single request
+
+        :param records: iterable of (target, action, value) tuples
+        :returns: dict with the number of `accepted` events, and the list of `rejected` ones
+        :raises PublishError: if the listener refuses the whole batch
+        """
+        data = self.request(_path(self.prefix, self.BATCH, ""), _batch(records), "application/x-ndjson")
+        return json.loads(data.decode("utf-8"))
+
+    def publish_many(self, records, batch_size = 1000):
+        """
+        Sends events by batches of batch_size
+
+        :param records: iterable of (target, action, value) tuples
+        :param batch_size: number of events sent per request
+        :returns: dict with the number of `accepted` events, and the list of `rejected` ones,
+            their `index` counting from the first record
+        """
+        result = dict(accepted = 0, rejected = [])
+        batch = []
+        sent = 0
+        for record in records:
+            batch.append(record)
+            if len(batch) == batch_size:
+                self._merge(result, self.publish_batch(batch), sent)
+                sent += len(batch)
+                batch = []
+        if batch:
+            self._merge(result, self.publish_batch(batch), sent)
+        return result
+
+    @staticmethod
+    def _merge(result, batch, offset):
+        result["accepted"] += batch["accepted"]
+        for rejected in batch["rejected"]:
+            rejected["index"] += offset
+            result["rejected"].append(rejected)
+
+    def close(self):
+        """
+        Closes all the idle connections
+        """
+        with self._lock:
+            pool, self._pool = self._pool, []
+        for connection in pool:
+            connection.close()
+
+class AsyncPublisher(object):
+    """
+    Sends events to a listener using a `CurlAsyncHTTPClient` of its own, which keeps
+    the connections alive between two requests, leaving the `AsyncHTTPClient` shared by
+    the other requests of the process as it is
+    """
+    BATCH = Publisher.BATCH
+
+    def __init__(self, host = "127.0.0.1", port = 8888, ssl = False, prefix = "", max_clients = 10,
+                 validate_cert = False, user = None, password = None):
+        """
+        :param host: host of the listener
+        :param port: port of the listener
+        :param ssl: if true, connects using HTTPS
+        :param prefix: path prefix of the listener's URLs
+        :param max_clients: maximum number of requests sent at once
+        :param validate_cert: if true, checks the certificate of the listener
+        :param user: username for basic authentication
+        :param password: password for basic authentication
+        """
+        self.http_client = CurlAsyncHTTPClient(force_instance = True, max_clients = max_clients)
+        self.prefix = prefix
+        self._url = "{}://{}:{}".format("https" if ssl else "http", host, port)
+        self._validate_cert = validate_cert
+        self._user = user
+        self._password = password
+
+    async def request(self, path, body, content_type = "text/plain"):
+        """
+        Posts a body on the listener, see `Publisher.request()`
+
+        :returns: a Future resolving to the bytes of the response
+        """
+        response = await self.http_client.fetch(HTTPRequest(url = self._url + path,
+                                                            method = "POST",
+                                                            body = body,
+                                                            headers = {"Content-Type": content_type},
+                                                            validate_cert = self._validate_cert,
+                                                            auth_username = self._user,
+                                                            auth_password = self._password),
+                                                raise_error = False)
+        if response.code >= 400:
+            if not response.body:
+                raise PublishError(response.code, "{}".format(response.error))
+            raise PublishError.from_response(response.code, response.body)
+        return response.body
+
+    def publish(self, target, action, data = "", as_json = False):
+        """
+        Sends an event, see `Publisher.publish()`
+
+        :returns: a Future resolving to the bytes of the response
+        """
+        return self.request(_path(self.prefix, action, target), _encode(data, as_json),
+                            "application/json" if as_json else "text/plain")
+
+    async def publish_batch(self, records):
+        """
+        Sends many events in a single request, see `Publisher.publish_batch()`
+
+        :returns: a Future resolving to the dict of `accepted` and `rejected` events
+        """
+        data = await self.request(_path(self.prefix, self.BATCH, ""), _batch(records), "application/x-ndjson")
+        return json.loads(data.decode("utf-8"))
+
+    def close(self):
+        """
+        Closes the connections of the client of current publisher
+        """
+        self.http_client.close()
+
+_publishers = {}
+
+def _publisher(url):
+    """returns the publisher, and the path, for an URL"""
+    parts = urlsplit(url)
+    key = (parts.scheme, parts.netloc)
+    if key not in _publishers:
+        _publishers[key] = Publisher(parts.hostname, parts.port or (443 if parts.scheme == "https" else 80),
+                                     ssl = parts.scheme == "https")
+    return _publishers[key], (parts.path or "/") + ("?" + parts.query if parts.query else "")
 
 def send_json(url, data):
     """
-    Sends a JSON query to eventsource's URL
+    Sends a JSON query to eventsource's URL, reusing the connection of the previous query
 
     :param url: string url to send to
     :param data: string data to send to given URL
     """
-    if isinstance(data, basestring):
-        data = json.dumps(json.loads(data))
-    else:
-        data = json.dumps(data)
-    req = urllib2.Request(url, data, {"Content-Type": "application/json"})
-    f = urllib2.urlopen(req)
-    try:
-        response = f.read()
-        return response
-    finally:
-        f.close()
+    publisher, path = _publisher(url)
+    return publisher.request(path, _encode(data, True), "application/json")
 
 def send_string(url, data):
     """
-    Sends a string query to eventsource's URL
+    Sends a string query to eventsource's URL, reusing the connection of the previous query
 
     :param url: string url to send to
     :param data: string data to send to given URL
     """
-    f = urllib2.urlopen(url, data)
-    try:
-        response = f.read()
-        return response
-    finally:
-        f.close()
-    
+    publisher, path = _publisher(url)
+    return publisher.request(path, _encode(data))
+
+def _lines(stream):
+    for line in stream:
+        line = line.rstrip("\r\n")
+        if line:
+            yield line
+
 def start():
     """helper method to create a commandline utility"""
     parser = argparse.ArgumentParser(prog = sys.argv[0],
@@ -71,17 +374,51 @@ def start():
                         action="store_true",
                         help="Treat data as JSON")
 
+    parser.add_argument("-s",
+                        "--stdin",
+                        dest="stdin",
+                        action="store_true",
+                        help="Send each line of the standard input as the data of an event, over one connection")
+
+    parser.add_argument("-b",
+                        "--batch-size",
+                        dest="batch_size",
+                        default="1",
+                        help="With --stdin, number of events sent per request")
+
     args = parser.parse_args(sys.argv[1:])
 
+    publisher = Publisher(args.host, args.port, pool_size = 1)
     try:
-        if args.json:
-            print send_json("http://%(host)s:%(port)s/%(action)s/%(token)s" % args.__dict__, args.data)
+        if args.stdin:
+            batch_size = int(args.batch_size)
+            if batch_size > 1:
+                records = ((args.token, args.action, _encode(line, args.json).decode("utf-8"))
+                           for line in _lines(sys.stdin))
+                result = publisher.publish_many(records, batch_size)
+                for rejected in result["rejected"]:
+                    print("Rejected event {index} ({status}): {mesg}".format(**rejected), file = sys.stderr)
+                print("{} events sent".format(result["accepted"]))
+            else:
+                count = 0
+                for line in _lines(sys.stdin):
+                    publisher.publish(args.token, args.action, line, args.json)
+                    count += 1
+                print("{} events sent".format(count))
         else:
-            print send_string("http://%(host)s:%(port)s/%(action)s/%(token)s" % args.__dict__, args.data)
+            print(publisher.publish(args.token, args.action, args.data, args.json).decode("utf-8"))
         sys.exit(0)
-    except Exception, err:
-        print "Unable to send request (%s): %s" % (err, err.readline().split("<body>")[-1].split("</body>")[0])
+    except ValueError as err:
+        print("Invalid value: {}".format(err))
+        sys.exit(1)
+    except PublishError as err:
+        print("Unable to send request ({}): {}".format(err.code, err.mesg))
         sys.exit(1)
+    except (httplib.HTTPException, IOError) as err:
+        print("Unable to send request: {}".format(err))
+        sys.exit(1)
+    finally:
+        publisher.close()
 
 if __name__ == "__main__":
     start()
@@ -0,0 +1,671 @@
+# -+- encoding: utf-8 -+-
+"""
+.. module:: storage
+:platform: Unix
+:synopsis: This module provides the stores keeping the frames of the events to replay them
+
+Two stores are available:
+    - **MemoryEventStore** keeps the last frames of each target in a `ReplayBuffer`,
+      and forgets them when the listener stops
+    - **SegmentEventStore** appends the frames of each target to segment files,
+      so that they can be replayed after a restart of the listener
+
+.. note::
+A segment file is a sequence of length-prefixed records::
+
+    +--------------+----------------+---------------+---------+-------------+
+    | frame length | timestamp      | id length     | id      | frame       |
+    | uint32       | double         | uint16        | utf-8   | bytes       |
+    +--------------+----------------+---------------+---------+-------------+
+
+all integers being big endian. Frames are replayed straight from the memory mapped
+segments, without building an object per event.
+"""
+
+from __future__ import unicode_literals
+
+import os
+import time
+import mmap
+import bisect
+import struct
+import binascii
+import logging
+import threading
+
+from eventsource.replay import ReplayBuffer
+
+log = logging.getLogger("eventsource.storage")
+
+class EventStore(object):
+    """
+    Interface of the stores, keeping the encoded frames of the events posted on each target
+    """
+    def append(self, target, id, frame):
+        """
+        Stores the frame of an event
+
+        :param target: string identifying a given target
+        :param id: id of the event
+        :param frame: bytes of the encoded event
+        """
+        raise NotImplementedError
+
+    def has(self, target):
+        """
+        :param target: string identifying a given target
+        :returns: true if frames are stored for target
+        """
+        raise NotImplementedError
+
+    def replay(self, target, last_id):
+        """
+        Gives the frames sent on a target after a given event
+
+        :param target: string identifying a given target
+        :param last_id: id of the last event known by a client
+        :returns: iterable of bytes, each one holding one or more whole frames following that event,
+            oldest first. If the id is unknown, every frame stored is given, or with ordered ids, the frames
+            following the events having a greater id. Only the frames stored when replay is called are
+            given, the ones stored while the iterable is consumed being left out.
+        """
+        raise NotImplementedError
+
+    def prune(self):
+        """
+        Applies the retention policy of the store, forgetting the frames that expired
+        """
+        pass
+
+    def close(self):
+        """
+        Releases the resources held by the store
+        """
+        pass
+
+class MemoryEventStore(EventStore):
+    """
+    Store keeping the last frames of each target in memory, in a `ReplayBuffer`
+
+    The buffers of the targets having no frame left are dropped when pruning, as well as
+    the ones in which no frame was appended nor replayed for `idle_timeout` seconds, so
+    that the targets no longer used do not keep their buffer, even if frames do not expire.
+    """
+    _stores = {}
+
+    @classmethod
+    def instance(cls, size, max_age = 0, ordered_ids = False, idle_timeout = 300):
+        """
+        Returns the store shared by all the handlers using the same settings
+
+        :param size: maximum number of frames kept per target
+        :param max_age: maximum age of the frames kept, in seconds. If `0`, frames do not expire.
+        :param ordered_ids: if true, ids are numbers growing with time, see `IdGenerator.ordered`
+        :param idle_timeout: time after which the buffer of a target which is not used is dropped, in seconds
+        """
+        key = (size, max_age, ordered_ids, idle_timeout)
+        if key not in cls._stores:
+            cls._stores[key] = cls(size, max_age, ordered_ids, idle_timeout)
+        return cls._stores[key]
+
+    def __init__(self, size = 1000, max_age = 0, ordered_ids = False, idle_timeout = 300):
+        """
+        :param size: maximum number of frames kept per target
+        :param max_age: maximum age of the frames kept, in seconds. If `0`, frames do not expire.
+        :param ordered_ids: if true, ids are numbers growing with time, see `IdGenerator.ordered`
+        :param idle_timeout: time after which the buffer of a target which is not used is dropped, in seconds
+        """
+        self.size = int(size)
+        self.max_age = max_age
+        self.ordered_ids = ordered_ids
+        self.idle_timeout = idle_timeout
+        self._buffers = {}
+        self._used = {}
+
+    def append(self, target, id, frame):
+        if target not in self._buffers:
+            self._buffers[target] = ReplayBuffer(self.size, self.max_age, self.ordered_ids)
+        self._buffers[target].append(id, frame)
+        self._used[target] = time.time()
+
+    def has(self, target):
+        return target in self._buffers
+
+    def replay(self, target, last_id):
+        if target not in self._buffers:
+            return []
+        self._used[target] = time.time()
+        return self._buffers[target].frames_after(last_id)
+
+    def prune(self):
+        idle = time.time() - self.idle_timeout
+        for target, replay in list(self._buffers.items()):
+            replay.prune()
+            if not len(replay) or self._used[target] < idle:
+                del(self._buffers[target])
+                del(self._used[target])
+
+def _key(id):
+    """orders ids numerically when they are numbers"""
+    try:
+        return int(id)
+    except ValueError:
+        return None
+
+class _Segment(object):
+    """
+    A segment file of a target, and the sparse index of its records
+    """
+    HEADER = struct.Struct("!IdH")
+
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+        self.count = 0
+        self.first_time = None
+        self.last_time = None
+        self.first_key = None
+        self.last_key = None
+        self.ordered = True
+        self.index = []
+        self.index_keys = []
+
+    def records(self, data, offset = 0, end = None):
+        """
+        Walks through the records of the segment
+
+        :param data: buffer holding the content of the segment
+        :param offset: position of the first record to read
+        :param end: position where to stop reading, defaults to the end of data
+        :returns: iterator of (offset, id, timestamp, frame offset, frame end) tuples
+        """
+        end = len(data) if end is None else end
+        while offset + self.HEADER.size <= end:
+            length, timestamp, id_length = self.HEADER.unpack_from(data, offset)
+            start = offset + self.HEADER.size + id_length
+            if start + length > end:
+                return
+            id = bytes(data[offset + self.HEADER.size:start]).decode("utf-8")
+            yield offset, id, timestamp, start, start + length
+            offset = start + length
+
+    def track(self, offset, id, timestamp, interval):
+        """
+        Accounts for a record appended to the segment, indexing one record out of `interval`
+        """
+        key = _key(id)
+        if key is None or (self.count and (self.last_key is None or key < self.last_key)):
+            self.ordered = False
+        if self.count == 0:
+            self.first_time = timestamp
+            self.first_key = key
+        self.last_time = timestamp
+        self.last_key = key
+        if self.count % interval == 0 and key is not None:
+            if not self.index_keys or key >= self.index_keys[-1]:
+                self.index.append(offset)
+                self.index_keys.append(key)
+        self.count += 1
+
+    def seek(self, key):
+        """
+        :param key: numerical id being looked for
+        :returns: the offset of the last indexed record which id is not greater than key
+        """
+        position = bisect.bisect_right(self.index_keys, key) - 1
+        return self.index[position] if position >= 0 else 0
+
+    def contains(self, key):
+        """
+        :returns: false if the segment cannot hold the numerical id key, its ids being ordered
+        """
+        if not self.ordered:
+            return True
+        return (key is not None and self.first_key is not None and self.last_key is not None
+                and self.first_key <= key <= self.last_key)
+
+class _Syncer(object):
+    """
+    Syncs the segment files to the disk from a thread of its own, out of the IOLoop
+
+    A file is synced at most once for all the appends made while a sync of it is pending,
+    as syncing any descriptor of a file writes all of its data to the disk.
+    """
+    def __init__(self):
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def schedule(self, f):
+        """
+        Syncs the content written to a file, unless a sync of it is already pending
+
+        :param f: file object of a segment, which may be closed before it is synced
+        """
+        with self._condition:
+            if f.name in self._pending:
+                return
+            self._pending[f.name] = os.dup(f.fileno())
+            if self._thread is None:
+                self._thread = threading.Thread(target = self._run, name = "eventsource-sync")
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                path, fd = self._pending.popitem()
+            try:
+                os.fsync(fd)
+            except OSError as err:
+                log.error("could not sync %s: %s", path, err)
+            finally:
+                os.close(fd)
+
+    def close(self):
+        """
+        Waits for the pending syncs, and stops the thread
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+def _retain_files(path, deadline, max_bytes):
+    """
+    Deletes the oldest segment files of a directory which log is not opened, from their
+    modification time and size, without reading them
+
+    :returns: true if no segment is left
+    """
+    names = sorted(name for name in os.listdir(path) if name.endswith(".log"))
+    stats = [os.stat(os.path.join(path, name)) for name in names]
+    size = sum(stat.st_size for stat in stats)
+    while names:
+        if deadline is not None and stats[0].st_mtime < deadline:
+            pass
+        elif max_bytes and size > max_bytes and len(names) > 1:
+            pass
+        else:
+            break
+        os.unlink(os.path.join(path, names.pop(0)))
+        size -= stats.pop(0).st_size
+    return not names
+
+class _Log(object):
+    """
+    The segment files of a target, in a directory
+    """
+    def __init__(self, path, segment_size, index_interval, ordered_ids = False):
+        self.path = path
+        self.segment_size = segment_size
+        self.index_interval = index_interval
+        self.ordered_ids = ordered_ids
+        self.segments = []
+        self._file = None
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name in sorted(os.listdir(path)):
+            if name.endswith(".log"):
+                self.segments.append(self._load(os.path.join(path, name)))
+        if self.segments:
+            self._file = open(self.segments[-1].path, "ab")
+
+    def _load(self, path):
+        segment = _Segment(path)
+        length = os.path.getsize(path)
+        if length:
+            with open(path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+            try:
+                for offset, id, timestamp, _, end in segment.records(data):
+                    segment.track(offset, id, timestamp, self.index_interval)
+                    segment.size = end
+            finally:
+                data.close()
+        if segment.size < length:
+            log.warning("truncating partial record at the end of %s", path)
+            with open(path, "r+b") as f:
+                f.truncate(segment.size)
+        return segment
+
+    def _roll(self):
+        if self._file is not None:
+            self._file.close()
+        number = 0
+        if self.segments:
+            number = int(os.path.basename(self.segments[-1].path)[:-4]) + 1
+        segment = _Segment(os.path.join(self.path, "{:020d}.log".format(number)))
+        self.segments.append(segment)
+        self._file = open(segment.path, "ab")
+
+    @property
+    def size(self):
+        return sum(segment.size for segment in self.segments)
+
+    def append(self, id, frame, syncer = None):
+        """
+        Appends a record, in a new segment if it does not fit in the last one
+
+        :param syncer: `_Syncer` syncing the segment to the disk, or `None`
+        """
+        id = "{}".format(id).encode("utf-8")
+        length = _Segment.HEADER.size + len(id) + len(frame)
+        if not self.segments or (self.segments[-1].size and self.segments[-1].size + length > self.segment_size):
+            self._roll()
+        segment = self.segments[-1]
+        timestamp = time.time()
+        self._file.write(_Segment.HEADER.pack(len(frame), timestamp, len(id)) + id)
+        self._file.write(frame)
+        self._file.flush()
+        if syncer is not None:
+            syncer.schedule(self._file)
+        segment.track(segment.size, id.decode("utf-8"), timestamp, self.index_interval)
+        segment.size += length
+
+    def _find(self, last_id):
+        """
+        :returns: (segment number, offset) of the first record following the event last_id,
+            or (0, 0) if there is no such event, unless ids are ordered. If several records
+            have that id, the newest one is taken.
+        """
+        last_id = "{}".format(last_id)
+        key = _key(last_id)
+        if key is not None:
+            candidates = [n for n, segment in enumerate(self.segments) if segment.contains(key)]
+        else:
+            candidates = list(range(len(self.segments)))
+        for number in reversed(candidates):
+            segment = self.segments[number]
+            # the ids of an ordered segment are unique, others are read through for their last match
+            ordered = key is not None and segment.ordered
+            offset = segment.seek(key) if ordered else 0
+            found = None
+            with open(segment.path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) if segment.size else b""
+            try:
+                for _, id, _, _, end in segment.records(data, offset):
+                    if id == last_id:
+                        found = end
+                        if ordered:
+                            break
+                    elif ordered and _key(id) > key:
+                        break
+            finally:
+                if segment.size:
+                    data.close()
+            if found is not None:
+                return number, found
+        if key is not None and self.ordered_ids:
+            return self._find_after(key)
+        return 0, 0
+
+    def _find_after(self, key):
+        """
+        :returns: (segment number, offset) of the first record having an id greater than key
+        """
+        for number, segment in enumerate(self.segments):
+            if segment.last_key is None or segment.last_key <= key:
+                continue
+            with open(segment.path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+            try:
+                for offset, id, _, _, _ in segment.records(data, segment.seek(key)):
+                    if _key(id) is not None and _key(id) > key:
+                        return number, offset
+            finally:
+                data.close()
+        return len(self.segments), 0
+
+    def read(self, last_id, chunk_size, deadline = None):
+        """
+        The frames read are the ones stored when this method is called: the events appended
+        while the iterator is consumed are left out.
+
+        :returns: iterator of bytes chunks of at most chunk_size bytes (or one frame, if bigger),
+            holding the frames following the event last_id, and not older than deadline
+        """
+        first, offset = self._find(last_id)
+        return self._read([(segment, segment.size) for segment in self.segments[first:]],
+                          offset, chunk_size, deadline)
+
+    def _read(self, segments, offset, chunk_size, deadline):
+        for segment, size in segments:
+            if size <= offset:
+                offset = 0
+                continue
+            try:
+                with open(segment.path, "rb") as f:
+                    data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+            except (IOError, OSError):
+                # deleted by the retention policy since the replay started
+                offset = 0
+                continue
+            view = memoryview(data)
+            chunk = []
+            try:
+                length = 0
+                for _, _, timestamp, start, end in segment.records(data, offset, size):
+                    if deadline is not None and timestamp < deadline:
+                        continue
+                    chunk.append(view[start:end])
+                    length += end - start
+                    if length >= chunk_size:
+                        yield b"".join(chunk)
+                        chunk = []
+                        length = 0
+                if chunk:
+                    yield b"".join(chunk)
+            finally:
+                del(chunk[:])
+                view.release()
+                data.close()
+            offset = 0
+
+    def retain(self, max_age, max_bytes):
+        """
+        Deletes the oldest segments when they expired, or when the log is bigger than max_bytes.
+        Segments are never rewritten: the expired records of the oldest segment left are skipped
+        when replaying, until the whole segment expires.
+        """
+        deadline = time.time() - max_age if max_age else None
+        while len(self.segments) > 1:
+            oldest = self.segments[0]
+            if deadline is not None and oldest.last_time is not None and oldest.last_time < deadline:
+                pass
+            elif max_bytes and self.size > max_bytes:
+                pass
+            else:
+                break
+            os.unlink(oldest.path)
+            del(self.segments[0])
+        if deadline is not None and self.segments:
+            oldest = self.segments[0]
+            if oldest is self.segments[-1] and oldest.last_time is not None and oldest.last_time < deadline:
+                self._file.close()
+                os.unlink(oldest.path)
+                self.segments = []
+                self._file = None
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class SegmentEventStore(EventStore):
+    """
+    Store appending the frames of each target to segment files in a directory
+
+    Each target gets its own sub directory, where segments are rolled over once they
+    reach `segment_size` bytes. One record out of `index_interval` is kept in a sparse
+    index from event id to offset, to find where to start a replay without reading
+    the whole log.
+
+    An id is looked up from the newest segment back, and the newest record having it is the
+    one a replay follows: ids given again, like counter ids after a restart, resume after their
+    last occurrence, not after the stale events stored before. Only the segments which ids keep
+    growing are skipped from their first and last ids, and searched through the sparse index;
+    the other ones are read through. Ids growing across restarts, like snowflake ids, are
+    still needed for a client to resume after an id given before the restart.
+
+    Segments are capped to `max_bytes` divided by `SEGMENTS`, so that the log of a target does
+    not take more than `max_bytes`, unless a single frame is bigger than a segment, while
+    keeping most of it when its oldest segment is deleted.
+
+    Retention is applied when pruning, by deleting whole segments: segments older than `max_age`
+    seconds are deleted, as well as the oldest segments of a target taking more than `max_bytes`.
+    The expired records of the oldest segment left are skipped when replaying. The logs of
+    the targets are opened when needed, and closed once idle for `idle_timeout` seconds; the
+    retention of the closed ones is applied from a thread, from the modification time and size
+    of their files. The targets having a log are listed once, when the store is created, and
+    kept in memory, so that `has()` does not touch the disk. Syncs to the disk are made from a
+    thread as well, so that none of this blocks the IOLoop on a whole segment or directory.
+    """
+    SEGMENTS = 4
+
+    def __init__(self, path, max_age = 0, max_bytes = 0, segment_size = 16 * 1024 * 1024,
+                 index_interval = 64, chunk_size = 64 * 1024, sync = False, ordered_ids = False,
+                 idle_timeout = 300):
+        """
+        :param path: directory holding the segment files
+        :param max_age: maximum age of the frames kept, in seconds. If `0`, frames do not expire.
+        :param max_bytes: maximum size of the log of a target, in bytes. If `0`, logs are unbounded.
+        :param segment_size: maximum size of a segment, in bytes, lowered to fit `max_bytes`
+        :param index_interval: number of records between two entries of the sparse index
+        :param chunk_size: size of the chunks given when replaying, in bytes
+        :param sync: if true, every append is synced to the disk, from a thread
+        :param ordered_ids: if true, ids are numbers growing with time, see `IdGenerator.ordered`
+        :param idle_timeout: time after which the log of a target which is not used is closed, in seconds
+        """
+        self.path = path
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.segment_size = segment_size
+        if max_bytes:
+            self.segment_size = max(min(segment_size, max_bytes // self.SEGMENTS), 1)
+        self.index_interval = index_interval
+        self.chunk_size = chunk_size
+        self.sync = sync
+        self.ordered_ids = ordered_ids
+        self.idle_timeout = idle_timeout
+        self._logs = {}
+        self._used = {}
+        self._syncer = _Syncer() if sync else None
+        # guards the targets, and the directories of the closed logs pruned from a thread
+        self._lock = threading.Lock()
+        self._pruning = None
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._targets = set(self._target(name) for name in os.listdir(path)) - set([None])
+
+    def _directory(self, target):
+        return os.path.join(self.path, binascii.hexlify(target.encode("utf-8")).decode("ascii"))
+
+    @staticmethod
+    def _target(name):
+        """gives the target of a directory, or `None` if it is not the directory of a target"""
+        try:
+            return binascii.unhexlify(name).decode("utf-8")
+        except (TypeError, ValueError):
+            return None
+
+    def _log(self, target, create = False):
+        if target not in self._logs:
+            if not create and target not in self._targets:
+                return None
+            with self._lock:
+                self._logs[target] = _Log(self._directory(target), self.segment_size,
+                                          self.index_interval, self.ordered_ids)
+                self._targets.add(target)
+        self._used[target] = time.time()
+        return self._logs[target]
+
+    def _deadline(self):
+        return time.time() - self.max_age if self.max_age else None
+
+    def append(self, target, id, frame):
+        target_log = self._log(target, create = True)
+        target_log.append(id, frame, self._syncer)
+        if self.max_bytes and target_log.size > self.max_bytes:
+            target_log.retain(0, self.max_bytes)
+
+    def has(self, target):
+        return target in self._targets
+
+    def replay(self, target, last_id):
+        target_log = self._log(target)
+        if target_log is None:
+            return iter(())
+        return target_log.read(last_id, self.chunk_size, self._deadline())
+
+    def _forget(self, target):
+        self._logs.pop(target).close()
+        del(self._used[target])
+
+    def prune(self):
+        """
+        Applies the retention of the open logs, and starts applying the one of the closed logs
+        from a thread, unless the previous one is still running
+        """
+        idle = time.time() - self.idle_timeout
+        for target in [target for target, used in self._used.items() if used < idle]:
+            self._forget(target)
+        for target, target_log in list(self._logs.items()):
+            target_log.retain(self.max_age, self.max_bytes)
+            if not target_log.segments:
+                self._forget(target)
+                with self._lock:
+                    self._remove(target)
+        if self._pruning is not None and self._pruning.is_alive():
+            return
+        with self._lock:
+            closed = [target for target in self._targets if target not in self._logs]
+        if closed:
+            self._pruning = threading.Thread(target = self._retain_closed, args = (closed, self._deadline()),
+                                             name = "eventsource-prune")
+            self._pruning.daemon = True
+            self._pruning.start()
+
+    def _retain_closed(self, targets, deadline):
+        """
+        applies the retention of the logs of targets which are not opened, from the pruning thread
+        """
+        for target in targets:
+            with self._lock:
+                if target in self._logs:
+                    # opened since, and retained by the next prune
+                    continue
+                try:
+                    if _retain_files(self._directory(target), deadline, self.max_bytes):
+                        self._remove(target)
+                except OSError as err:
+                    log.error("could not prune %s: %s", target, err)
+
+    def _remove(self, target):
+        """
+        forgets a target which log is empty, called with the lock held
+        """
+        self._targets.discard(target)
+        try:
+            os.rmdir(self._directory(target))
+        except OSError:
+            pass
+
+    def close(self):
+        if self._pruning is not None:
+            self._pruning.join()
+            self._pruning = None
+        for log in self._logs.values():
+            log.close()
+        self._logs = {}
+        self._used = {}
+        if self._syncer is not None:
+            self._syncer.close()
@@ -0,0 +1,217 @@
+# -+- encoding: utf-8 -+-
+"""
+.. module:: topics
+:platform: Unix
+:synopsis: This module indexes subscriptions to hierarchical topics and to patterns of topics
+
+Topics are made of levels separated by dots, like `orders.eu.fr`. A pattern is a topic
+having wildcard levels:
+    - `*` matches exactly one level, `orders.*.fr` matching `orders.eu.fr`
+    - `#` matches any number of levels, none included, and shall be the last level,
+      `orders.#` matching `orders`, `orders.eu` and `orders.eu.fr`
+
+Several topics and patterns can be followed at once, separated by commas, like
+`orders.eu.*,alerts.#`.
+
+Plain topics are kept in a dict, and patterns in a trie, one node per level, so that finding
+what follows a topic costs a lookup per level of the topic and per matching wildcard, whatever
+the number of patterns.
+"""
+
+from __future__ import unicode_literals
+
+SEPARATOR = "."
+ANY_LEVEL = "*"
+ANY_LEVELS = "#"
+LIST_SEPARATOR = ","
+
+def is_pattern(topic):
+    """
+    :param topic: string of a topic or of a pattern
+    :returns: true if topic has wildcard levels
+    """
+    return any(level in (ANY_LEVEL, ANY_LEVELS) for level in topic.split(SEPARATOR))
+
+def check_pattern(pattern):
+    """
+    :param pattern: string of a topic or of a pattern
+    :raises ValueError: if `#` is not the last level of pattern
+    """
+    levels = pattern.split(SEPARATOR)
+    if ANY_LEVELS in levels[:-1]:
+        raise ValueError("{} shall be the last level of a pattern: {}".format(ANY_LEVELS, pattern))
+
+def split_topics(topics):
+    """
+    :param topics: string of topics and patterns separated by commas
+    :returns: list of the topics and patterns, without duplicates
+    :raises ValueError: if there is no topic, or if a pattern is not valid
+    """
+    split = []
+    for topic in topics.split(LIST_SEPARATOR):
+        topic = topic.strip()
+        if topic and topic not in split:
+            check_pattern(topic)
+            split.append(topic)
+    if not split:
+        raise ValueError("no topic given: {}".format(topics))
+    return split
+
+def _guess_pattern(topic):
+    """
+    :returns: true if topic is a valid pattern, invalid ones being followed as they are
+    """
+    levels = topic.split(SEPARATOR)
+    return ANY_LEVELS not in levels[:-1] and (ANY_LEVEL in levels or levels[-1] == ANY_LEVELS)
+
+class _Node(object):
+    __slots__ = ("children", "values")
+
+    def __init__(self):
+        self.children = {}
+        self.values = set()
+
+class TopicTrie(object):
+    """
+    Index of the values, like connections or nodes, following topics and patterns
+
+    Plain topics and patterns are told apart by their levels, unless told otherwise when
+    added, so that a topic having a `*` level can still be followed as it is. Topics which
+    are not valid patterns, like `#.a`, are then followed as they are.
+    """
+    def __init__(self):
+        self._topics = {}
+        self._root = _Node()
+        self._patterns = 0
+
+    def add(self, topic, value, pattern = None):
+        """
+        Makes a value follow a topic or a pattern
+
+        :param topic: string of a topic or of a pattern
+        :param value: value following topic
+        :param pattern: true if topic is a pattern, guessed from its levels if `None`
+        :raises ValueError: if topic is given as a pattern, and is not a valid one
+        """
+        if pattern is None:
+            pattern = _guess_pattern(topic)
+        if not pattern:
+            self._topics.setdefault(topic, set()).add(value)
+            return
+        check_pattern(topic)
+        node = self._root
+        for level in topic.split(SEPARATOR):
+            node = node.children.setdefault(level, _Node())
+        if not node.values:
+            self._patterns += 1
+        node.values.add(value)
+
+    def remove(self, topic, value, pattern = None):
+        """
+        Makes a value stop following a topic or a pattern, if it did
+
+        :param topic: string of a topic or of a pattern
+        :param value: value following topic
+        :param pattern: true if topic is a pattern, guessed from its levels if `None`
+        """
+        if pattern is None:
+            pattern = _guess_pattern(topic)
+        if not pattern:
+            values = self._topics.get(topic)
+            if values is not None:
+                values.discard(value)
+                if not values:
+                    del(self._topics[topic])
+            return
+        path = [self._root]
+        levels = topic.split(SEPARATOR)
+        for level in levels:
+            node = path[-1].children.get(level)
+            if node is None:
+                return
+            path.append(node)
+        node = path[-1]
+        if value not in node.values:
+            return
+        node.values.discard(value)
+        if not node.values:
+            self._patterns -= 1
+        # prunes the nodes left without values nor children
+        for level, parent, node in reversed(list(zip(levels, path, path[1:]))):
+            if node.values or node.children:
+                break
+            del(parent.children[level])
+
+    def get(self, topic):
+        """
+        :param topic: string of a topic or of a pattern
+        :returns: the set of the values following topic itself, as a topic or as a pattern
+        """
+        values = self._topics.get(topic, frozenset())
+        if self._patterns and is_pattern(topic):
+            node = self._root
+            for level in topic.split(SEPARATOR):
+                node = node.children.get(level)
+                if node is None:
+                    return values
+            return values | node.values
+        return values
+
+    def match(self, topic):
+        """
+        :param topic: string of a topic
+        :returns: the set of the values following topic, or a pattern matching it, which shall not be modified
+        """
+        values = self._topics.get(topic, frozenset())
+        if not self._patterns:
+            return values
+        matched = set(values)
+        levels = topic.split(SEPARATOR)
+        depth = len(levels)
+        nodes = [(self._root, 0)]
+        while nodes:
+            node, index = nodes.pop()
+            children = node.children
+            rest = children.get(ANY_LEVELS)
+            if rest is not None:
+                matched.update(rest.values)
+            if index == depth:
+                matched.update(node.values)
+                continue
+            child = children.get(levels[index])
+            if child is not None:
+                nodes.append((child, index + 1))
+            child = children.get(ANY_LEVEL)
+            if child is not None:
+                nodes.append((child, index + 1))
+        return matched
+
+    def matches(self, topic):
+        """
+        :param topic: string of a topic
+        :returns: true if a value follows topic, or a pattern matching it
+        """
+        return topic in self._topics or (self._patterns != 0 and len(self.match(topic)) != 0)
+
+    def __contains__(self, topic):
+        """
+        :returns: true if a value follows topic itself, as a topic or as a pattern
+        """
+        return len(self.get(topic)) != 0
+
+    def __iter__(self):
+        """
+        :returns: an iterator over the topics and the patterns followed
+        """
+        for topic in self._topics:
+            yield topic
+        nodes = [(self._root, [])]
+        while nodes:
+            node, levels = nodes.pop()
+            if node.values and levels:
+                yield SEPARATOR.join(levels)
+            for level, child in node.children.items():
+                nodes.append((child, levels + [level]))
+
+    def __len__(self):
+        return len(self._topics) + self._patterns
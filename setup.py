@@ -35,10 +35,16 @@ setup(name="eventsource",
       long_description=long_description,
       author="Bernard Pratz",
       author_email="guyzmo+github@m0g.net",
+      python_requires = '>=3.5',
       install_requires = [
-          'tornado>=4.4',
+          'tornado>=5.1',
           'pycurl',
-      ] + (['future'] if sys.version_info.major == 2 else []),
+      ],
+      extras_require = {
+          'uvloop': ['uvloop'],
+          'orjson': ['orjson'],
+          'ujson': ['ujson'],
+      },
       packages = find_packages(exclude=['examples', 'tests']),
       url='http://packages.python.org/eventsource/',
       include_package_data=True,
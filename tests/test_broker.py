@@ -0,0 +1,93 @@
+# -+- encoding: utf-8 -+-
+"""
+Tests of the subscriptions and of the events relayed between two `SocketBroker` nodes
+running in the same process
+"""
+
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import functools
+
+import tornado.gen
+import tornado.testing
+
+from eventsource.broker import SocketBroker
+from eventsource.listener import EventSourceHandler
+from eventsource.storage import MemoryEventStore
+
+class SocketBrokerTest(tornado.testing.AsyncTestCase):
+    def setUp(self):
+        super(SocketBrokerTest, self).setUp()
+        self.path = tempfile.mkdtemp(prefix = "eventsource-test-")
+        addresses = [os.path.join(self.path, "node-{}.sock".format(n)) for n in range(2)]
+        self.delivered = [[], []]
+        self.nodes = []
+        for n, address in enumerate(addresses):
+            deliver = lambda *event, n = n: self.delivered[n].append(event)
+            self.nodes.append(SocketBroker(address, addresses, deliver))
+        for node in self.nodes:
+            node.start()
+
+    def tearDown(self):
+        for node in self.nodes:
+            node.close()
+        shutil.rmtree(self.path)
+        super(SocketBrokerTest, self).tearDown()
+
+    async def wait(self, condition):
+        for _ in range(200):
+            if condition():
+                return
+            await tornado.gen.sleep(0.01)
+        self.fail("timed out")
+
+    @tornado.testing.gen_test
+    async def test_relay_to_subscribed_node(self):
+        first, second = self.nodes
+        self.assertFalse(first.is_connected("t"))
+        second.subscribe("t")
+        await self.wait(lambda: first.is_connected("t"))
+        first.publish("t", "ping", "1", b"data: 1\r\n\r\n")
+        first.publish("other", "ping", "2", b"data: 2\r\n\r\n")
+        first.publish("t", "close", None, None)
+        await self.wait(lambda: len(self.delivered[1]) == 2)
+        self.assertEqual(self.delivered[1], [("t", "ping", "1", b"data: 1\r\n\r\n"),
+                                             ("t", "close", None, None)])
+        self.assertEqual(self.delivered[0], [])
+
+    @tornado.testing.gen_test
+    async def test_unsubscribe(self):
+        first, second = self.nodes
+        second.subscribe("t")
+        await self.wait(lambda: first.is_connected("t"))
+        second.unsubscribe("t")
+        await self.wait(lambda: not first.is_connected("t"))
+        first.publish("t", "ping", "1", b"data: 1\r\n\r\n")
+        await tornado.gen.sleep(0.05)
+        self.assertEqual(self.delivered[1], [])
+
+    @tornado.testing.gen_test
+    async def test_pattern_subscription(self):
+        first, second = self.nodes
+        second.subscribe("orders.*")
+        await self.wait(lambda: first.is_connected("orders.eu"))
+        self.assertFalse(first.is_connected("alerts.eu"))
+        first.publish("orders.eu", "ping", "1", b"data: 1\r\n\r\n")
+        await self.wait(lambda: self.delivered[1])
+        self.assertEqual(self.delivered[1][0][0], "orders.eu")
+
+    @tornado.testing.gen_test
+    async def test_replicate(self):
+        first, second = self.nodes
+        first.replicate = True
+        store = MemoryEventStore(10)
+        second.deliver = functools.partial(EventSourceHandler.deliver, store = store)
+        # events having an id are sent to every node, even without subscribers
+        first.publish("t", "ping", "1", b"data: 1\r\n\r\n")
+        first.publish("t", "retry", None, b"retry: 1000\r\n\r\n")
+        first.publish("t", "ping", "2", b"data: 2\r\n\r\n")
+        await self.wait(lambda: len(store.replay("t", "unknown")) == 2)
+        self.assertEqual(store.replay("t", "1"), [b"data: 2\r\n\r\n"])
@@ -0,0 +1,160 @@
+# -+- encoding: utf-8 -+-
+"""
+Tests of the parsing of event streams by `EventParser`, whatever the chunks they are read by,
+of the reconnections of the clients, and of the clients
+"""
+
+from __future__ import unicode_literals
+
+import random
+import unittest
+import unittest.mock
+
+import tornado.gen
+import tornado.web
+import tornado.testing
+from tornado.httpclient import AsyncHTTPClient
+
+from eventsource.client import EventParser, EventSourceClient, EventSourceMultiplexer, ReconnectPolicy
+from eventsource.ids import CounterIdGenerator
+from eventsource.listener import EventSourceHandler, EventId, StringIdEvent
+
+STREAM = (b": comment\r\n"
+          b"retry: 2000\r\n"
+          b"event: ping\r\nid: 1\r\ndata: first\r\ndata: line\r\n\r\n"
+          b"id: 2\ndata: second\n\n"
+          b"event: ping\rid: 3\rdata: third\r\r")
+
+def parse(chunks):
+    parser = EventParser()
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    return parser, [(event.name, event.data, event.id) for event in events]
+
+class EventParserTest(unittest.TestCase):
+    expected = [("ping", "first\nline", "1"), ("message", "second", "2"), ("ping", "third", "3")]
+
+    def test_whole_stream(self):
+        parser, events = parse([STREAM])
+        self.assertEqual(events, self.expected)
+        self.assertEqual(parser.retry, 2000)
+        self.assertEqual(parser.last_event_id, "3")
+
+    def test_byte_by_byte(self):
+        _, events = parse([STREAM[index:index + 1] for index in range(len(STREAM))])
+        self.assertEqual(events, self.expected)
+
+    def test_every_split(self):
+        for index in range(1, len(STREAM)):
+            _, events = parse([STREAM[:index], STREAM[index:]])
+            self.assertEqual(events, self.expected, "split at {}".format(index))
+
+    def test_crlf_split_between_chunks(self):
+        # the LF following a CR ending a chunk is not an empty line dispatching the event
+        _, events = parse([b"data: a\r", b"\ndata: b\r", b"\n\r\n"])
+        self.assertEqual(events, [("message", "a\nb", None)])
+
+    def test_event_without_data_is_not_dispatched(self):
+        _, events = parse([b"event: ping\r\n\r\ndata: x\r\n\r\n"])
+        self.assertEqual(events, [("message", "x", None)])
+
+    def test_invalid_retry_is_ignored(self):
+        parser, _ = parse([b"retry: 1000\r\nretry: soon\r\n\r\n"])
+        self.assertEqual(parser.retry, 1000)
+
+    def test_reset_drops_incomplete_event(self):
+        parser = EventParser()
+        parser.feed(b"data: lost\r\nda")
+        parser.reset()
+        self.assertEqual([event.data for event in parser.feed(b"data: kept\r\n\r\n")], ["kept"])
+
+class ReconnectPolicyTest(unittest.TestCase):
+    def delays(self, policy, failures):
+        delays = []
+        for _ in range(failures):
+            policy.failed()
+            delays.append(policy.next_delay())
+        return delays
+
+    def test_window_is_capped(self):
+        policy = ReconnectPolicy(retry = 500, backoff = 100, factor = 2, max_delay = 1000)
+        # the random part drawn at the top of its window
+        with unittest.mock.patch("random.uniform", side_effect = lambda low, high: high):
+            delays = self.delays(policy, 7)
+        self.assertEqual(delays, [600, 700, 900, 1300, 1500, 1500, 1500])
+        self.assertEqual(policy.stats(), dict(attempts = 7, reconnects = 7, failures = 7,
+                                              total_delay = sum(delays), last_delay = 1500))
+
+    def test_full_jitter(self):
+        policy = ReconnectPolicy(retry = 0, backoff = 100, max_delay = 1000)
+        with unittest.mock.patch("random.uniform", wraps = random.uniform) as uniform:
+            delays = self.delays(policy, 1) + [policy.next_delay() for _ in range(200)]
+        self.assertEqual(set(call[0] for call in uniform.call_args_list), set([(0, 100)]))
+        self.assertTrue(all(0 <= delay <= 100 for delay in delays))
+        # drawn over the whole window, not around its middle
+        self.assertLess(min(delays), 25)
+        self.assertGreater(max(delays), 75)
+
+    def test_connection_resets_backoff(self):
+        policy = ReconnectPolicy(backoff = 100, factor = 2, max_delay = 10000)
+        with unittest.mock.patch("random.uniform", side_effect = lambda low, high: high):
+            self.assertEqual(self.delays(policy, 3), [100, 200, 400])
+            policy.connected()
+            self.assertEqual(policy.attempts, 0)
+            self.assertEqual(self.delays(policy, 1), [100])
+        self.assertEqual(policy.failures, 4)
+
+    def test_max_attempts(self):
+        policy = ReconnectPolicy(backoff = 100, max_attempts = 3)
+        self.assertEqual(len([delay for delay in self.delays(policy, 2) if delay is not None]), 2)
+        policy.failed()
+        self.assertIsNone(policy.next_delay())
+        self.assertEqual(policy.reconnects, 2)
+
+class ReconnectTest(tornado.testing.AsyncTestCase):
+    @tornado.testing.gen_test
+    async def test_client_stops_after_max_attempts(self):
+        sock, port = tornado.testing.bind_unused_port()
+        sock.close()
+        policy = ReconnectPolicy(backoff = 10, max_attempts = 3)
+        client = EventSourceClient("127.0.0.1:{}".format(port), "poll", "t", keep_alive = True, policy = policy)
+        client.__aiter__()
+        with self.assertLogs("eventsource.client", "ERROR"):
+            client.connect()
+            self.assertIsNone(await client.next_event())
+        self.assertEqual((policy.failures, policy.reconnects), (3, 2))
+
+class EventSourceClientTest(tornado.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        return tornado.web.Application([(r"/(.*)/(.*)", EventSourceHandler, dict(event_class = StringIdEvent))])
+
+    @tornado.testing.gen_test
+    async def test_listen(self):
+        self.addCleanup(setattr, EventId, "generator", EventId.generator)
+        EventId.generator = CounterIdGenerator()
+        shared = AsyncHTTPClient()
+        configured = AsyncHTTPClient.configured_class()
+        client = EventSourceClient("127.0.0.1:{}".format(self.get_http_port()), "poll", "t").connect()
+        client.__aiter__()
+        while not EventSourceHandler._registry.is_followed("t"):
+            await tornado.gen.sleep(0.01)
+        for value in ["a", "b\nc"]:
+            await self.http_client.fetch(self.get_url("/ping/t"), method = "POST", body = value)
+        events = [await client.next_event() for _ in range(2)]
+        self.assertEqual([(event.name, event.data, event.id) for event in events],
+                         [("ping", "a", "0"), ("ping", "b\nc", "1")])
+        client.end()
+        self.assertIsNone(await client.next_event())
+        # the AsyncHTTPClient shared by the other requests of the process is left alone
+        self.assertIs(AsyncHTTPClient(), shared)
+        self.assertIs(AsyncHTTPClient.configured_class(), configured)
+
+    def test_multiplexer_leaves_shared_client_alone(self):
+        configured = AsyncHTTPClient.configured_class()
+        multiplexer = EventSourceMultiplexer("127.0.0.1:{}".format(self.get_http_port()), "poll")
+        multiplexer.http_client.close()
+        self.assertIs(AsyncHTTPClient.configured_class(), configured)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+# -+- encoding: utf-8 -+-
+"""
+Tests that every installed `fastjson` backend reads and writes the same values as
+the standard library
+"""
+
+from __future__ import unicode_literals
+
+import math
+import unittest
+
+from eventsource import fastjson
+
+class FastJSONTest(unittest.TestCase):
+    def backends(self):
+        default = fastjson.backend
+        self.addCleanup(fastjson.use, default)
+        for name in fastjson.available():
+            fastjson.use(name)
+            yield name
+
+    def test_loads(self):
+        for name in self.backends():
+            self.assertEqual(fastjson.loads('{"a": [1, "b", null]}'), dict(a = [1, "b", None]), name)
+            self.assertEqual(fastjson.loads(b'{"a": 1.5}'), dict(a = 1.5), name)
+
+    def test_loads_invalid(self):
+        for name in self.backends():
+            for data in ["", "{", "price>10", "[1,]"]:
+                with self.assertRaises(ValueError, msg = name):
+                    fastjson.loads(data)
+
+    def test_loads_non_finite(self):
+        for name in self.backends():
+            value = fastjson.loads('[NaN, Infinity, -Infinity, 1e400]')
+            self.assertTrue(math.isnan(value[0]), name)
+            self.assertEqual(value[1:], [float("inf"), float("-inf"), float("inf")], name)
+
+    def test_loads_wide_integers(self):
+        for name in self.backends():
+            for integer in [2 ** 64, -2 ** 63 - 1, 10 ** 30, -10 ** 30]:
+                value = fastjson.loads('{"id": %d}' % integer)["id"]
+                # orjson reads them as floats, see the fastjson module
+                self.assertEqual(type(value), float if name == "orjson" else int, name)
+                self.assertEqual(value, integer if name != "orjson" else float(integer), name)
+            value = fastjson.loads('[%d]' % (2 ** 64 - 1))[0]
+            self.assertEqual((type(value), value), (int, 2 ** 64 - 1), name)
+
+    def test_dumps(self):
+        for name in self.backends():
+            for value in [dict(a = [1, "é", None, 1.5]), [float("inf"), None]]:
+                self.assertEqual(fastjson.loads(fastjson.dumps(value)), value, name)
+            self.assertEqual(fastjson.dumps([10 ** 30, -2 ** 64]).replace(" ", ""),
+                             "[{},{}]".format(10 ** 30, -2 ** 64), name)
+            self.assertIn("NaN", fastjson.dumps([float("nan"), None]), name)
+            self.assertEqual(fastjson.dumps([None]).replace(" ", ""), "[null]", name)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+# -+- encoding: utf-8 -+-
+"""
+Tests of the filters of the subscribers, and of the events delivered to filtering subscribers
+"""
+
+from __future__ import unicode_literals
+
+import unittest
+import unittest.mock
+
+import tornado.web
+import tornado.httputil
+
+from eventsource import encoder
+from eventsource.filters import EventFilter, Predicate, select
+from eventsource.listener import EventSourceHandler, JSONIdEvent
+
+from tests.test_listener import HandlerTestCase
+
+class PredicateTest(unittest.TestCase):
+    def test_parse(self):
+        predicate = Predicate.parse(" user.country != \"fr\"")
+        self.assertEqual((predicate.path, predicate.operator, predicate.value), (("user", "country"), "!=", "fr"))
+        self.assertEqual(Predicate.parse("price>=10").value, 10)
+        self.assertEqual(Predicate.parse("name=bob").value, "bob")
+        for invalid in ["price", ">10", "a..b=1"]:
+            with self.assertRaises(ValueError):
+                Predicate.parse(invalid)
+
+    def test_holds(self):
+        fields = {"price": 12, "user": {"tags": ["a", "b"]}}
+        self.assertTrue(Predicate.parse("price>10").holds(fields))
+        self.assertTrue(Predicate.parse("user.tags.1=b").holds(fields))
+        self.assertFalse(Predicate.parse("missing=1").holds(fields))
+        self.assertFalse(Predicate.parse("price>ten").holds(fields))
+
+class EventFilterTest(unittest.TestCase):
+    def test_normalized_form(self):
+        compiled = EventFilter.compile(["pong", "ping"], ["price > 10", "user.country=fr"])
+        self.assertEqual(str(compiled), "action=ping,pong&filter=price>10&filter=user.country=\"fr\"")
+        self.assertIs(EventFilter.compile(["ping", "pong"], ["user.country = fr", "price>10"]), compiled)
+        built = EventFilter(["ping", "pong"], [Predicate.parse("user.country=fr"), Predicate.parse("price >10")])
+        self.assertEqual(built, compiled)
+        self.assertEqual(hash(built), hash(compiled))
+        self.assertNotEqual(EventFilter(["ping"]), compiled)
+
+    def test_select_evaluates_each_normalized_filter_once(self):
+        handlers = [unittest.mock.Mock(event_filter = EventFilter(None, [Predicate.parse(predicate)]))
+                    for predicate in ["price>10", "price > 10", "price< 10"]]
+        handlers.append(unittest.mock.Mock(event_filter = None))
+        fields = unittest.mock.Mock(return_value = {"price": 12})
+        with unittest.mock.patch.object(EventFilter, "accepts", autospec = True,
+                                        side_effect = EventFilter.accepts) as accepts:
+            self.assertEqual(select(handlers, "ping", fields), [handlers[0], handlers[1], handlers[3]])
+        self.assertEqual(accepts.call_count, 2)
+        fields.assert_called_once_with()
+
+class FilteredDeliveryTest(HandlerTestCase):
+    """
+    posts events on a target followed by subscribers giving different filters
+    """
+    def filtered_handler(self, actions = None, predicates = ()):
+        request = tornado.httputil.HTTPServerRequest(method = "GET", uri = "/poll/t",
+                                                     connection = unittest.mock.Mock())
+        handler = EventSourceHandler(tornado.web.Application(), request, event_class = JSONIdEvent)
+        handler.event_filter = EventFilter.compile(actions, predicates)
+        handler.set_connected("t")
+        self.addCleanup(handler.set_disconnected)
+        return handler
+
+    def test_each_subscriber_gets_the_events_it_accepts(self):
+        expensive = self.filtered_handler(predicates = ["price>10"])
+        cheap = self.filtered_handler(actions = ["ping"], predicates = ["price <= 10"])
+        unfiltered = self.filtered_handler()
+        for price in (5, 50):
+            expensive.buffer_event("t", "ping", '{"price": %d}' % price)
+        expensive.buffer_event("t", "retry", "3000")
+        self.assertEqual(self.queued(expensive), [("ping", '{"price":50}'), ("retry", "3000")])
+        self.assertEqual(self.queued(cheap), [("ping", '{"price":5}'), ("retry", "3000")])
+        self.assertEqual(self.queued(unfiltered), [("ping", '{"price":5}'), ("ping", '{"price":50}'), ("retry", "3000")])
+
+    def test_rejected_event_is_not_encoded(self):
+        expensive = self.filtered_handler(predicates = ["price>10"])
+        other = self.filtered_handler(predicates = ["price > 10"])
+        with unittest.mock.patch("eventsource.encoder.encode_event", wraps = encoder.encode_event) as encode_event:
+            self.assertIsNone(expensive.buffer_event("t", "ping", '{"price": 5}'))
+            expensive.buffer_event("t", "ping", '{"price": 50}')
+        self.assertEqual(encode_event.call_count, 1)
+        self.assertEqual(self.queued(expensive), [("ping", '{"price":50}')])
+        self.assertEqual(self.queued(other), [("ping", '{"price":50}')])
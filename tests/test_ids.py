@@ -0,0 +1,77 @@
+# -+- encoding: utf-8 -+-
+"""
+Tests of the ids given to the events by `CounterIdGenerator` and `SnowflakeIdGenerator`
+"""
+
+from __future__ import unicode_literals
+
+import threading
+import unittest
+import unittest.mock
+
+from eventsource.ids import CounterIdGenerator, SnowflakeIdGenerator
+
+class CounterIdGeneratorTest(unittest.TestCase):
+    def test_count(self):
+        generator = CounterIdGenerator(5)
+        self.assertEqual([generator.next_id() for _ in range(3)], [5, 6, 7])
+        self.assertFalse(generator.ordered)
+
+class SnowflakeIdGeneratorTest(unittest.TestCase):
+    def fields(self, id):
+        """
+        :returns: (timestamp, node, sequence) of a snowflake id
+        """
+        return (id >> (SnowflakeIdGenerator.NODE_BITS + SnowflakeIdGenerator.SEQUENCE_BITS),
+                (id >> SnowflakeIdGenerator.SEQUENCE_BITS) & SnowflakeIdGenerator.MAX_NODE,
+                id & ((1 << SnowflakeIdGenerator.SEQUENCE_BITS) - 1))
+
+    def test_ordered(self):
+        generator = SnowflakeIdGenerator(3)
+        ids = [generator.next_id() for _ in range(10000)]
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertEqual(set(self.fields(id)[1] for id in ids), {3})
+        self.assertTrue(generator.ordered)
+
+    def test_sequence_overflow(self):
+        generator = SnowflakeIdGenerator(1)
+        with unittest.mock.patch.object(generator, "_now", return_value = 1000):
+            ids = [generator.next_id() for _ in range(5000)]
+        self.assertEqual(ids, sorted(set(ids)))
+        # past 4096 ids in a millisecond, the block of the next millisecond is taken
+        self.assertEqual(self.fields(ids[4095]), (1000, 1, 4095))
+        self.assertEqual(self.fields(ids[4096]), (1001, 1, 0))
+        # and once the clock reaches it, ids go on from there
+        with unittest.mock.patch.object(generator, "_now", return_value = 1001):
+            self.assertEqual(self.fields(generator.next_id()), (1001, 1, 5000 - 4096))
+
+    def test_clock_going_back(self):
+        generator = SnowflakeIdGenerator()
+        with unittest.mock.patch.object(generator, "_now", return_value = 1000):
+            first = generator.next_id()
+        with unittest.mock.patch.object(generator, "_now", return_value = 10):
+            second = generator.next_id()
+        self.assertGreater(second, first)
+
+    def test_nodes(self):
+        generators = [SnowflakeIdGenerator(node) for node in (0, SnowflakeIdGenerator.MAX_NODE)]
+        for generator in generators:
+            generator._now = lambda: 1000
+        self.assertNotEqual(generators[0].next_id(), generators[1].next_id())
+        with self.assertRaises(ValueError):
+            SnowflakeIdGenerator(SnowflakeIdGenerator.MAX_NODE + 1)
+
+    def test_threads(self):
+        generator = SnowflakeIdGenerator()
+        ids = []
+        def take():
+            ids.extend([generator.next_id() for _ in range(5000)])
+        threads = [threading.Thread(target = take) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(ids)), 20000)
+
+if __name__ == "__main__":
+    unittest.main()
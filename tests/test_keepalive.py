@@ -0,0 +1,81 @@
+# -+- encoding: utf-8 -+-
+"""
+Tests of the keepalive messages sent to idle connections by `KeepaliveWheel`
+"""
+
+from __future__ import unicode_literals
+
+import unittest.mock
+
+import tornado.testing
+
+from eventsource.keepalive import KeepaliveWheel
+
+from tests.test_listener import HandlerTestCase
+
+class Connection(object):
+    def __init__(self):
+        self.last_write = 0
+        self.frames = []
+
+    def push_keepalive(self, frame):
+        self.frames.append(frame)
+
+class KeepaliveWheelTest(tornado.testing.AsyncTestCase):
+    """
+    turns a wheel of 4 slots of 250ms by hand, at given times
+    """
+    def setUp(self):
+        tornado.testing.AsyncTestCase.setUp(self)
+        self.wheel = KeepaliveWheel(1000, slots = 4)
+        self.addCleanup(self.wheel._timer.stop)
+
+    def tick(self, now, count = 1):
+        with unittest.mock.patch("time.time", return_value = now):
+            for _ in range(count):
+                self.wheel._tick()
+
+    def add(self, now):
+        connection = Connection()
+        with unittest.mock.patch("time.time", return_value = now):
+            self.wheel.add(connection)
+        return connection
+
+    def test_keepalive_after_interval(self):
+        connection = self.add(100)
+        self.tick(100.75, 3)
+        self.assertEqual(connection.frames, [])
+        self.tick(101, 1)
+        self.assertEqual(len(connection.frames), 1)
+        self.assertTrue(connection.frames[0].startswith(b": keepalive "))
+        # the connection comes back one interval later
+        self.tick(102, 4)
+        self.assertEqual(len(connection.frames), 2)
+
+    def test_recent_write_is_skipped(self):
+        connection = self.add(100)
+        connection.last_write = 100.5
+        self.tick(101, 4)
+        self.assertEqual(connection.frames, [])
+        # the connection is moved to the slot of its new deadline
+        self.tick(101.5, 2)
+        self.assertEqual(len(connection.frames), 1)
+
+    def test_removed_connection(self):
+        connection = self.add(100)
+        self.assertTrue(self.wheel._timer.is_running())
+        self.wheel.remove(connection)
+        self.assertEqual(len(self.wheel), 0)
+        self.assertFalse(self.wheel._timer.is_running())
+        self.tick(101, 4)
+        self.assertEqual(connection.frames, [])
+
+class ClosedHandlerTest(HandlerTestCase):
+    def test_closed_handler_leaves_the_wheel(self):
+        handler = self.handler(keepalive = 1000)
+        wheel = KeepaliveWheel.instance(1000)
+        wheel.add(handler)
+        self.assertIn(handler, wheel._slot_of)
+        handler.set_disconnected()
+        self.assertNotIn(handler, wheel._slot_of)
+        self.assertFalse(any(handler in slot for slot in wheel._slots))
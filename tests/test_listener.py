@@ -0,0 +1,358 @@
+# -+- encoding: utf-8 -+-
+"""
+Tests of `EventSourceHandler` and of its events
+"""
+
+from __future__ import unicode_literals
+
+import json
+import shutil
+import time
+import tempfile
+import unittest
+import unittest.mock
+import zlib
+
+import tornado.gen
+import tornado.web
+import tornado.httpclient
+import tornado.httputil
+import tornado.testing
+from tornado.queues import QueueEmpty, QueueFull
+
+from eventsource import encoder
+from eventsource.client import EventParser
+from eventsource.ids import CounterIdGenerator
+from eventsource.listener import EventSourceHandler, EventId, StringIdEvent, JSONIdEvent
+from eventsource.storage import MemoryEventStore, SegmentEventStore
+
+class EventIdTest(unittest.TestCase):
+    def test_control_events_have_no_id(self):
+        self.addCleanup(setattr, EventId, "generator", EventId.generator)
+        EventId.generator = CounterIdGenerator()
+        events = [StringIdEvent("t", action, value) for action, value in
+                  [("ping", "a"), ("retry", "3000"), ("ping", "b"), ("close", None), ("ping", "c")]]
+        self.assertEqual([event.id for event in events], [0, None, 1, None, 2])
+
+class HandlerTestCase(tornado.testing.AsyncTestCase):
+    """
+    feeds the queue of a connected handler, which event loop is not running
+    """
+    def handler(self, **kwargs):
+        request = tornado.httputil.HTTPServerRequest(method = "GET", uri = "/poll/t",
+                                                     connection = unittest.mock.Mock())
+        kwargs.setdefault("event_class", StringIdEvent)
+        handler = EventSourceHandler(tornado.web.Application(), request, **kwargs)
+        handler.set_connected("t")
+        self.addCleanup(handler.set_disconnected)
+        return handler
+
+    def post(self, handler, action, value, target = "t"):
+        event = handler._event_class(target, action, value)
+        item = (event, None) if action == event.FINISH else (event, handler.encode(event))
+        return handler.enqueue(item)
+
+    def queued(self, handler):
+        items = []
+        try:
+            while True:
+                item = handler._queue.get_nowait()
+                handler._release(item)
+                items.append((item[0].action, item[0].value[0] if item[1] is not None else None))
+        except QueueEmpty:
+            return items
+
+class FanOutTest(HandlerTestCase):
+    def test_event_is_encoded_once(self):
+        handlers = [self.handler() for _ in range(3)]
+        with unittest.mock.patch("eventsource.encoder.encode_event", wraps = encoder.encode_event) as encode_event:
+            handlers[0].buffer_event("t", "ping", "a")
+            handlers[1].buffer_event("t", "ping", "b")
+        self.assertEqual(encode_event.call_count, 2)
+        frames = [[handler._queue.get_nowait()[1] for _ in range(2)] for handler in handlers]
+        self.assertEqual([encoder.decode_frame(frame) for frame in frames[0]], [("ping", "a"), ("ping", "b")])
+        # every subscriber is given the very same frames
+        for subscriber_frames in frames[1:]:
+            self.assertTrue(all(frame is first for frame, first in zip(subscriber_frames, frames[0])))
+
+class OverflowTest(HandlerTestCase):
+    @tornado.testing.gen_test
+    async def test_overflow_block(self):
+        handler = self.handler(queue_size = 1, overflow = EventSourceHandler.OVERFLOW_BLOCK)
+        await handler.buffer_event("t", "ping", "a")
+        blocked = handler.buffer_event("t", "ping", "b")
+        await tornado.gen.sleep(0)
+        self.assertFalse(blocked.done())
+        # the blocked event is queued as soon as there is room
+        self.assertEqual(self.queued(handler), [("ping", "a"), ("ping", "b")])
+        await blocked
+
+    def test_overflow_drop(self):
+        handler = self.handler(queue_size = 2, overflow = EventSourceHandler.OVERFLOW_DROP)
+        for value in "abc":
+            self.assertIsNone(handler.buffer_event("t", "ping", value))
+        self.assertEqual(self.queued(handler), [("ping", "b"), ("ping", "c")])
+        self.assertEqual(handler.backpressure("t")["dropped"], 1)
+
+    def test_drops_are_logged_once_per_interval(self):
+        self.addCleanup(setattr, EventSourceHandler, "_drops_logged", EventSourceHandler._drops_logged)
+        EventSourceHandler._drops_logged = (0, EventSourceHandler._overflows)
+        handler = self.handler(queue_size = 1, overflow = EventSourceHandler.OVERFLOW_DROP)
+        slow = self.handler(high_watermark = 1, slow_policy = EventSourceHandler.SLOW_DROP)
+        with self.assertLogs("eventsource.listener", "WARNING") as logs:
+            for value in "abcd":
+                handler.buffer_event("t", "ping", value)
+            with unittest.mock.patch("time.time", return_value = time.time() + EventSourceHandler.DROP_LOG_INTERVAL + 1):
+                handler.buffer_event("t", "ping", "e")
+        # the events dropped from the slow consumer are not blamed on the queue
+        self.assertEqual([record.getMessage() for record in logs.records if record.funcName == "_log_drops"],
+                         ["enqueue(t): queue is full, 1 events dropped since the last warning",
+                          "enqueue(t): queue is full, 3 events dropped since the last warning"])
+        self.assertEqual(slow.backpressure("t")["dropped"], 8)
+
+    def test_overflow_reject(self):
+        handler = self.handler(queue_size = 1, overflow = EventSourceHandler.OVERFLOW_REJECT)
+        handler.buffer_event("t", "ping", "a")
+        with self.assertRaises(QueueFull):
+            handler.buffer_event("t", "ping", "b")
+        self.assertEqual(self.queued(handler), [("ping", "a")])
+        self.assertEqual(handler.backpressure("t")["dropped"], 0)
+
+class SlowConsumerTest(HandlerTestCase):
+    def slow_handler(self, policy):
+        handler = self.handler(high_watermark = 1, low_watermark = 0, slow_policy = policy)
+        self.post(handler, "ping", "a")
+        self.assertTrue(handler.is_slow("t"))
+        return handler
+
+    def test_slow_drop(self):
+        handler = self.slow_handler(EventSourceHandler.SLOW_DROP)
+        self.post(handler, "ping", "b")
+        self.assertEqual(self.queued(handler), [("ping", "a")])
+        self.assertEqual(handler.backpressure("t")["dropped"], 1)
+
+    def test_slow_coalesce(self):
+        handler = self.slow_handler(EventSourceHandler.SLOW_COALESCE)
+        self.post(handler, "retry", "3000")
+        self.post(handler, "ping", "b")
+        self.post(handler, "ping", "c")
+        self.assertEqual(self.queued(handler), [("retry", "3000"), ("ping", "c")])
+
+    def test_slow_coalesce_bounded_queue(self):
+        handler = self.handler(queue_size = 2, high_watermark = 1, slow_policy = EventSourceHandler.SLOW_COALESCE,
+                               event_class = type(str("TwoActionsEvent"), (StringIdEvent,),
+                                                  dict(ACTIONS = ["ping", "pong", "retry", "close"])))
+        for action, value in [("ping", "a"), ("pong", "b"), ("retry", "3000")]:
+            self.post(handler, action, value)
+        # the queue is filled again without waiting, the oldest event making room for the last one
+        self.assertEqual(len(handler._queue._putters), 0)
+        self.assertEqual(handler._pending, sum(len(item[1]) for item in list(handler._queue._queue)))
+        self.assertEqual(self.queued(handler), [("pong", "b"), ("retry", "3000")])
+        self.assertEqual(handler.backpressure("t")["dropped"], 1)
+
+    def test_slow_coalesce_releases_conflated(self):
+        handler = self.handler(queue_size = 1, high_watermark = 1, slow_policy = EventSourceHandler.SLOW_COALESCE,
+                               conflation = EventSourceHandler.CONFLATE_ACTION)
+        self.post(handler, "ping", "a")
+        self.post(handler, "retry", "3000")
+        self.assertEqual(handler._conflated, {})
+        self.assertEqual(self.queued(handler), [("retry", "3000")])
+
+    def test_slow_disconnect(self):
+        handler = self.slow_handler(EventSourceHandler.SLOW_DISCONNECT)
+        self.post(handler, "ping", "b")
+        handler.request.connection.close.assert_called_once_with()
+        self.assertEqual(handler.subscribers("t"), set())
+
+    def test_slow_consumer_recovers(self):
+        handler = self.slow_handler(EventSourceHandler.SLOW_DROP)
+        handler._sent([frame for _, frame in [handler._queue.get_nowait()]])
+        self.assertFalse(handler.is_slow("t"))
+
+class ConflationTest(HandlerTestCase):
+    def test_no_conflation(self):
+        handler = self.handler()
+        for value in "abc":
+            self.post(handler, "ping", value)
+        self.assertEqual(self.queued(handler), [("ping", "a"), ("ping", "b"), ("ping", "c")])
+
+    def test_conflate_target(self):
+        handler = self.handler(conflation = EventSourceHandler.CONFLATE_TARGET)
+        for value in "abc":
+            self.post(handler, "ping", value)
+        self.assertEqual(self.queued(handler), [("ping", "c")])
+        # once flushed, the next event is queued again
+        self.post(handler, "ping", "d")
+        self.assertEqual(self.queued(handler), [("ping", "d")])
+        self.assertEqual(handler.backpressure("t")["conflated"], 2)
+
+    def test_conflate_action(self):
+        handler = self.handler(conflation = EventSourceHandler.CONFLATE_ACTION,
+                               event_class = type(str("TwoActionsEvent"), (StringIdEvent,),
+                                                  dict(ACTIONS = ["ping", "pong", "retry", "close"])))
+        for action, value in [("ping", "a"), ("pong", "b"), ("ping", "c"), ("pong", "d")]:
+            self.post(handler, action, value)
+        self.assertEqual(self.queued(handler), [("ping", "c"), ("pong", "d")])
+
+    def test_control_events_are_not_conflated(self):
+        handler = self.handler(conflation = EventSourceHandler.CONFLATE_TARGET)
+        self.post(handler, "ping", "a")
+        self.post(handler, "retry", "3000")
+        self.post(handler, "ping", "b")
+        self.post(handler, "retry", "5000")
+        self.assertEqual(self.queued(handler), [("ping", "b"), ("retry", "3000"), ("retry", "5000")])
+
+    def test_events_are_not_moved_before_close(self):
+        handler = self.handler(conflation = EventSourceHandler.CONFLATE_TARGET)
+        self.post(handler, "ping", "a")
+        self.post(handler, "close", None)
+        self.post(handler, "ping", "b")
+        self.assertEqual(self.queued(handler), [("ping", "a"), ("close", None), ("ping", "b")])
+
+class BatchTest(tornado.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        return tornado.web.Application([(r"/(.*)/(.*)", EventSourceHandler, dict(event_class = StringIdEvent))])
+
+    def test_parse_lines(self):
+        handler = EventSourceHandler(self._app, tornado.httputil.HTTPServerRequest(
+            method = "POST", uri = "/batch/t", connection = unittest.mock.Mock()), event_class = StringIdEvent)
+        body = '{"action": "ping", "value": "a"}\n\n{"action": "ping", "value": 12, "target": "u"}\n[1]\n'
+        self.assertEqual(handler.parse_batch(body, "t"),
+                         [("t", "ping", "a"), ("u", "ping", "12"), (400, "Record is not an object with an action")])
+        self.assertEqual(handler.parse_batch(' [{"action": "ping"}, {"value": "a"}]', "t"),
+                         [("t", "ping", ""), (400, "Record is not an object with an action")])
+        self.assertEqual(handler.parse_batch('[{"action": "ping", "target": 5}, {"action": "ping", "target": null}]', "t"),
+                         [(400, "Record target is not a string")] * 2)
+        with self.assertRaises(ValueError):
+            handler.parse_batch('{"action": "ping"', "t")
+
+    @tornado.testing.gen_test
+    async def test_post_batch(self):
+        chunks = []
+        response = self.http_client.fetch(self.get_url("/poll/batched"), streaming_callback = chunks.append,
+                                          request_timeout = 5)
+        while not EventSourceHandler._registry.is_followed("batched"):
+            await tornado.gen.sleep(0.01)
+        body = json.dumps([dict(action = "ping", value = "a"), dict(action = "pong", value = "b"),
+                           dict(action = "ping", value = "c", target = "unknown"), dict(value = "d"),
+                           dict(action = "ping", value = "e", target = None), dict(action = "ping", value = "f")])
+        posted = await self.http_client.fetch(self.get_url("/batch/batched"), method = "POST", body = body)
+        self.assertEqual(json.loads(posted.body.decode("utf-8")),
+                         dict(accepted = 2, rejected = [dict(index = 1, status = 404, mesg = "Unknown action requested"),
+                                                        dict(index = 2, status = 404, mesg = "Target is not connected"),
+                                                        dict(index = 3, status = 400,
+                                                             mesg = "Record is not an object with an action"),
+                                                        dict(index = 4, status = 400,
+                                                             mesg = "Record target is not a string")]))
+        with self.assertRaises(tornado.httpclient.HTTPClientError) as raised:
+            await self.http_client.fetch(self.get_url("/batch/batched"), method = "POST", body = "[{")
+        self.assertEqual(raised.exception.code, 400)
+        await self.http_client.fetch(self.get_url("/close/batched"), method = "POST", body = "")
+        await response
+        parser = EventParser()
+        self.assertEqual([event.data for chunk in chunks for event in parser.feed(chunk)], ["a", "f"])
+
+class CompressionTest(HandlerTestCase):
+    def negotiated(self, accept_encoding, **kwargs):
+        handler = self.handler(compression = True, **kwargs)
+        handler.request.headers["Accept-Encoding"] = accept_encoding
+        return handler.negotiate_encoding()
+
+    def test_negotiate_encoding(self):
+        self.assertEqual(self.negotiated("gzip, deflate"), "gzip")
+        self.assertEqual(self.negotiated("gzip;q=0.5, deflate"), "deflate")
+        self.assertEqual(self.negotiated("deflate; q=0.2, *;q=0.5"), "gzip")
+        self.assertEqual(self.negotiated("br, GZIP"), "gzip")
+        self.assertIsNone(self.negotiated("gzip;q=0, br"))
+        self.assertIsNone(self.negotiated(""))
+        self.assertIsNone(self.negotiated("identity"))
+        handler = self.handler()
+        handler.request.headers["Accept-Encoding"] = "gzip"
+        self.assertIsNone(handler.negotiate_encoding())
+
+    def written(self, handler, *writes):
+        """
+        pushes frames on handler, and gives the data written for each push
+        """
+        written = []
+        with unittest.mock.patch.object(handler, "write", written.append), \
+                unittest.mock.patch.object(handler, "flush"):
+            for frames in writes:
+                handler.push_frames(frames)
+        return written
+
+    def test_compressed_stream(self):
+        handler = self.handler(compression = True, compression_min_size = 100)
+        handler._encoding = "gzip"
+        first, second = [encoder.encode_event("ping", ["a" * 100], id = 1)], [encoder.encode_event("ping", ["b"], id = 2)]
+        written = self.written(handler, first, second)
+        self.assertEqual(handler._headers["Content-Encoding"], "gzip")
+        # each write is flushed, and can be read without waiting for the next one
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.assertEqual(decompressor.decompress(written[0]), encoder.encode_batch(first))
+        self.assertEqual(decompressor.decompress(written[1]), encoder.encode_batch(second))
+
+    def test_compression_min_size(self):
+        handler = self.handler(compression = True, compression_min_size = 100)
+        handler._encoding = "deflate"
+        first, second = [encoder.encode_event("ping", ["a"], id = 1)], [encoder.encode_event("ping", ["b" * 100], id = 2)]
+        # the stream is left uncompressed when its first write is too small
+        self.assertEqual(self.written(handler, first, second), [encoder.encode_batch(first), encoder.encode_batch(second)])
+        self.assertNotIn("Content-Encoding", handler._headers)
+        self.assertIsNone(handler._encoding)
+
+    def test_keepalive_before_events(self):
+        handler = self.handler(compression = True, compression_min_size = 100, keepalive = 1000)
+        handler._encoding = "gzip"
+        keepalive, event = encoder.encode_comment("keepalive"), encoder.encode_event("ping", ["a" * 100], id = 1)
+        with unittest.mock.patch.object(handler, "write") as write, unittest.mock.patch.object(handler, "flush"):
+            handler.push_keepalive(keepalive)
+            handler.push_frames([event])
+        # the size of the keepalive does not leave the stream uncompressed
+        self.assertEqual(handler._headers["Content-Encoding"], "gzip")
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.assertEqual([decompressor.decompress(call[0][0]) for call in write.call_args_list], [keepalive, event])
+
+class FilteredReplayTest(tornado.testing.AsyncHTTPTestCase):
+    """
+    replays to a filtering client the events kept by the stores, given frame by frame,
+    or by chunks of several frames
+    """
+    def get_app(self):
+        self.path = tempfile.mkdtemp(prefix = "eventsource-test-")
+        self.addCleanup(shutil.rmtree, self.path)
+        self.store = self.make_store()
+        self.addCleanup(self.store.close)
+        return tornado.web.Application([(r"/(.*)/(.*)", EventSourceHandler,
+                                         dict(event_class = JSONIdEvent, store = self.store))])
+
+    def make_store(self):
+        return MemoryEventStore(100)
+
+    async def listen(self, query, last_event_id):
+        chunks = []
+        response = self.http_client.fetch(self.get_url("/poll/t?" + query),
+                                          headers = {"Last-Event-ID": last_event_id},
+                                          streaming_callback = chunks.append, request_timeout = 5)
+        while not EventSourceHandler._registry.is_followed("t"):
+            await tornado.gen.sleep(0.01)
+        await self.http_client.fetch(self.get_url("/close/t"), method = "POST", body = "{}")
+        await response
+        return [(event.name, event.data) for chunk in chunks for event in self.parser.feed(chunk)]
+
+    @tornado.testing.gen_test
+    async def test_filtered_replay(self):
+        self.parser = EventParser()
+        for id, (action, price) in enumerate([("ping", 5), ("ping", 50), ("retry", None), ("ping", 20)]):
+            if action == "retry":
+                frame = encoder.encode_retry(1000)
+            else:
+                frame = encoder.encode_event(action, ['{"price": %d}' % price], id = id)
+            self.store.append("t", id, frame)
+        events = await self.listen("filter=price>10", "unknown")
+        self.assertEqual(events, [("ping", '{"price": 50}'), ("ping", '{"price": 20}')])
+        self.assertEqual(self.parser.retry, 1000)
+
+class FilteredSegmentReplayTest(FilteredReplayTest):
+    def make_store(self):
+        return SegmentEventStore(self.path)
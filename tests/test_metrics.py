@@ -0,0 +1,147 @@
+# -+- encoding: utf-8 -+-
+"""
+Tests of the metrics, of their Prometheus text format, and of the metrics of `EventSourceHandler`
+"""
+
+from __future__ import unicode_literals
+
+import shutil
+import tempfile
+import unittest
+
+import tornado.gen
+import tornado.web
+import tornado.testing
+
+from eventsource import encoder
+from eventsource.listener import EventSourceHandler, StringIdEvent
+from eventsource.metrics import Counter, Gauge, Histogram, ListenerMetrics, MetricsHandler, MetricsRegistry
+from eventsource.storage import SegmentEventStore
+
+from tests.test_listener import HandlerTestCase
+
+def samples(metrics):
+    """
+    renders metrics, and reads back the value of every sample
+    """
+    values = {}
+    for line in metrics.render().splitlines():
+        if not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            values[name] = float(value)
+    return values
+
+class TextFormatTest(unittest.TestCase):
+    def test_render(self):
+        registry = MetricsRegistry()
+        counter = registry.register(Counter("events_total", "Events\nposted", ("action",)))
+        gauge = registry.register(Gauge("connections", "Open connections"))
+        histogram = registry.register(Histogram("latency_seconds", "Latency", (0.1, 1)))
+        counter.inc(labels = ("ping",))
+        counter.inc(2, labels = ("say \"hi\"",))
+        gauge.inc(3)
+        gauge.dec()
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value)
+        self.assertEqual(registry.render(), "\n".join([
+            "# HELP events_total Events\\nposted",
+            "# TYPE events_total counter",
+            "events_total{action=\"ping\"} 1",
+            "events_total{action=\"say \\\"hi\\\"\"} 2",
+            "# HELP connections Open connections",
+            "# TYPE connections gauge",
+            "connections 2",
+            "# HELP latency_seconds Latency",
+            "# TYPE latency_seconds histogram",
+            "latency_seconds_bucket{le=\"0.1\"} 1",
+            "latency_seconds_bucket{le=\"1\"} 2",
+            "latency_seconds_bucket{le=\"+Inf\"} 3",
+            "latency_seconds_sum 5.55",
+            "latency_seconds_count 3",
+        ]) + "\n")
+
+    def test_collect(self):
+        registry = MetricsRegistry(collect = lambda registry: gauge.set(7))
+        gauge = registry.register(Gauge("connections", "Open connections"))
+        self.assertEqual(samples(registry), {"connections": 7})
+
+class HandlerMetricsTest(HandlerTestCase):
+    def setUp(self):
+        HandlerTestCase.setUp(self)
+        self.metrics = ListenerMetrics(collect = EventSourceHandler.collect_metrics)
+
+    def test_publish(self):
+        handler = self.handler(metrics = self.metrics)
+        handler.buffer_event("t", "ping", "a")
+        handler.buffer_event("t", "ping", "b")
+        values = samples(self.metrics)
+        self.assertEqual(values["eventsource_events_published_total{action=\"ping\"}"], 2)
+        self.assertEqual(values["eventsource_connections{target=\"t\"}"], 1)
+        self.assertGreaterEqual(values["eventsource_queued_events"], 2)
+
+    def test_drop(self):
+        handler = self.handler(metrics = self.metrics, queue_size = 1, overflow = EventSourceHandler.OVERFLOW_DROP)
+        dropped = samples(self.metrics)["eventsource_events_dropped_total"]
+        for value in "abc":
+            handler.buffer_event("t", "ping", value)
+        self.assertEqual(samples(self.metrics)["eventsource_events_dropped_total"], dropped + 2)
+
+    def test_disconnect(self):
+        handler = self.handler(metrics = self.metrics, high_watermark = 1, slow_policy = EventSourceHandler.SLOW_DISCONNECT)
+        disconnected = samples(self.metrics)["eventsource_slow_consumers_disconnected_total"]
+        handler.buffer_event("t", "ping", "a")
+        self.assertEqual(samples(self.metrics)["eventsource_pending_bytes"], len(handler._queue.get_nowait()[1]))
+        # the pending bytes reached the high watermark, the next event disconnects the slow consumer
+        handler.buffer_event("t", "ping", "b")
+        values = samples(self.metrics)
+        self.assertEqual(values["eventsource_slow_consumers_disconnected_total"], disconnected + 1)
+        self.assertNotIn("eventsource_connections{target=\"t\"}", values)
+        self.assertEqual(values["eventsource_slow_consumers"], 0)
+
+class MetricsHandlerTest(tornado.testing.AsyncHTTPTestCase):
+    """
+    streams events to a client, and scrapes the metrics served on /metrics
+    """
+    def get_app(self):
+        self.path = tempfile.mkdtemp(prefix = "eventsource-test-")
+        self.addCleanup(shutil.rmtree, self.path)
+        self.store = SegmentEventStore(self.path)
+        self.addCleanup(self.store.close)
+        self.metrics = ListenerMetrics(collect = EventSourceHandler.collect_metrics)
+        return tornado.web.Application([
+            (r"/metrics", MetricsHandler, dict(registry = self.metrics)),
+            (r"/(.*)/(.*)", EventSourceHandler, dict(event_class = StringIdEvent, store = self.store,
+                                                      metrics = self.metrics)),
+        ])
+
+    async def scrape(self):
+        response = await self.http_client.fetch(self.get_url("/metrics"))
+        self.assertEqual(response.headers["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        values = {}
+        for line in response.body.decode("utf-8").splitlines():
+            if not line.startswith("#"):
+                name, value = line.rsplit(" ", 1)
+                values[name] = float(value)
+        return values
+
+    @tornado.testing.gen_test
+    async def test_stream(self):
+        for id in range(3):
+            self.store.append("m", id, encoder.encode_event("ping", ["replayed"], id = id))
+        chunks = []
+        response = self.http_client.fetch(self.get_url("/poll/m"), headers = {"Last-Event-ID": "unknown"},
+                                          streaming_callback = chunks.append, request_timeout = 5)
+        while not EventSourceHandler._registry.is_followed("m"):
+            await tornado.gen.sleep(0.01)
+        values = await self.scrape()
+        self.assertEqual(values["eventsource_connections{target=\"m\"}"], 1)
+        await self.http_client.fetch(self.get_url("/ping/m"), method = "POST", body = "live")
+        await self.http_client.fetch(self.get_url("/close/m"), method = "POST", body = "")
+        await response
+        values = await self.scrape()
+        self.assertEqual(values["eventsource_events_published_total{action=\"ping\"}"], 1)
+        # the 3 replayed events, given by the store as one chunk, and the live one
+        self.assertEqual(values["eventsource_events_pushed_total"], 4)
+        self.assertEqual(values["eventsource_publish_flush_seconds_count"], 1)
+        self.assertEqual(values["eventsource_written_bytes_total"], sum(len(chunk) for chunk in chunks))
+        self.assertNotIn("eventsource_connections{target=\"m\"}", values)
@@ -0,0 +1,128 @@
+# -+- encoding: utf-8 -+-
+"""
+Tests of the frames kept by `ReplayBuffer`, and of their replay to reconnecting clients
+"""
+
+from __future__ import unicode_literals
+
+import time
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+import tornado.gen
+import tornado.web
+import tornado.httputil
+import tornado.testing
+from tornado.queues import QueueFull
+
+from eventsource.client import EventParser
+from eventsource.ids import CounterIdGenerator
+from eventsource.listener import EventSourceHandler, EventId, StringIdEvent
+from eventsource.replay import ReplayBuffer
+from eventsource.storage import MemoryEventStore, SegmentEventStore
+
+from tests.test_listener import HandlerTestCase
+
+class ReplayBufferTest(unittest.TestCase):
+    def test_frames_after(self):
+        buffer = ReplayBuffer(3)
+        for id in range(5):
+            buffer.append(id, "frame {}".format(id).encode("utf-8"))
+        self.assertEqual(len(buffer), 3)
+        self.assertEqual(buffer.frames_after(2), [b"frame 3", b"frame 4"])
+        self.assertEqual(buffer.frames_after(4), [])
+        # unknown or evicted ids get every frame kept
+        self.assertEqual(buffer.frames_after(0), [b"frame 2", b"frame 3", b"frame 4"])
+
+    def test_ordered_ids(self):
+        buffer = ReplayBuffer(10, ordered_ids = True)
+        for id in range(0, 10, 2):
+            buffer.append(id, "frame {}".format(id).encode("utf-8"))
+        self.assertEqual(buffer.frames_after(5), [b"frame 6", b"frame 8"])
+
+class RejectedReplayTest(HandlerTestCase):
+    def test_rejected_event_is_not_kept(self):
+        handler = self.handler(replay_size = 10, queue_size = 1, overflow = EventSourceHandler.OVERFLOW_REJECT)
+        handler.buffer_event("t", "ping", "a")
+        with self.assertRaises(QueueFull):
+            handler.buffer_event("t", "ping", "b")
+        self.assertEqual([frame.count(b"data: a") for frame in handler._store.replay("t", "unknown")], [1])
+
+class IdleReplayTest(HandlerTestCase):
+    def test_idle_target_is_not_found_after_pruning(self):
+        store = MemoryEventStore(10, idle_timeout = 60)
+        handler = self.handler(store = store)
+        handler.buffer_event("t", "ping", "a")
+        handler.set_disconnected()
+        # the events posted are kept for the clients reconnecting
+        store.prune()
+        self.assertIsNone(handler.check_event("t", "ping"))
+        with unittest.mock.patch("time.time", return_value = time.time() + 61):
+            store.prune()
+        self.assertFalse(store.has("t"))
+        self.assertEqual(handler.check_event("t", "ping"), (404, "Target is not connected"))
+
+class ReplayDuringPostTest(tornado.testing.AsyncTestCase):
+    @tornado.testing.gen_test
+    async def test_event_posted_during_replay_is_sent_once(self):
+        self.addCleanup(setattr, EventId, "generator", EventId.generator)
+        EventId.generator = CounterIdGenerator()
+        path = tempfile.mkdtemp(prefix = "eventsource-test-")
+        self.addCleanup(shutil.rmtree, path)
+        # two frames per segment: the event posted while "b" is sent goes in the segment of "c"
+        store = SegmentEventStore(path, segment_size = 100, chunk_size = 1)
+        self.addCleanup(store.close)
+        request = tornado.httputil.HTTPServerRequest(method = "GET", uri = "/poll/t",
+                                                     headers = tornado.httputil.HTTPHeaders({"Last-Event-ID": "0"}),
+                                                     connection = unittest.mock.Mock())
+        handler = EventSourceHandler(tornado.web.Application(), request, event_class = StringIdEvent, store = store)
+        self.addCleanup(handler.set_disconnected)
+        for value in "abc":
+            handler.buffer_event("t", "ping", value)
+        sent = []
+        async def send(frames):
+            if not sent:
+                handler.buffer_event("t", "ping", "d")
+            sent.extend(frames)
+        async def event_loop():
+            pass
+        with unittest.mock.patch.object(handler, "REPLAY_CHUNK_SIZE", 1), \
+                unittest.mock.patch.object(handler, "_send", send), \
+                unittest.mock.patch.object(handler, "_event_loop", event_loop):
+            await handler.get("poll", "t")
+        parser = EventParser()
+        self.assertEqual([event.data for frame in sent for event in parser.feed(frame)], ["b", "c"])
+        self.assertEqual([item[0].value for item in handler._queue._queue], [["d"]])
+
+class LastEventIdTest(tornado.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        self.addCleanup(setattr, EventId, "generator", EventId.generator)
+        EventId.generator = CounterIdGenerator()
+        return tornado.web.Application([(r"/(.*)/(.*)", EventSourceHandler,
+                                         dict(event_class = StringIdEvent, replay_size = 10))])
+
+    @tornado.testing.gen_test
+    async def test_resume(self):
+        chunks = []
+        first = self.http_client.fetch(self.get_url("/poll/resumed"), streaming_callback = chunks.append,
+                                       request_timeout = 5)
+        while not EventSourceHandler._registry.is_followed("resumed"):
+            await tornado.gen.sleep(0.01)
+        for value in "abc":
+            await self.http_client.fetch(self.get_url("/ping/resumed"), method = "POST", body = value)
+        await self.http_client.fetch(self.get_url("/close/resumed"), method = "POST", body = "")
+        await first
+        # the client reconnects after the second event, and gets the third one, posted meanwhile
+        chunks = []
+        second = self.http_client.fetch(self.get_url("/poll/resumed"), headers = {"Last-Event-ID": "1"},
+                                        streaming_callback = chunks.append, request_timeout = 5)
+        while not EventSourceHandler._registry.is_followed("resumed"):
+            await tornado.gen.sleep(0.01)
+        await self.http_client.fetch(self.get_url("/ping/resumed"), method = "POST", body = "d")
+        await self.http_client.fetch(self.get_url("/close/resumed"), method = "POST", body = "")
+        await second
+        parser = EventParser()
+        events = [(event.id, event.data) for chunk in chunks for event in parser.feed(chunk)]
+        self.assertEqual(events, [("2", "c"), ("3", "d")])
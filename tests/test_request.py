@@ -0,0 +1,146 @@
+# -+- encoding: utf-8 -+-
+"""
+Tests of the connections kept by `Publisher`, which shall never post an event twice
+"""
+
+from __future__ import unicode_literals
+
+import io
+import sys
+import json
+import time
+import threading
+import unittest
+import unittest.mock
+import http.server
+
+import tornado.web
+import tornado.testing
+from tornado.httpclient import AsyncHTTPClient
+from tornado.curl_httpclient import CurlAsyncHTTPClient
+
+from eventsource.request import Publisher, AsyncPublisher, _publisher, start
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        server.received.append((self.path, body))
+        behaviour = server.behaviours.pop(0) if server.behaviours else "answer"
+        if behaviour == "no answer":
+            # the event is read, but the connection is lost before answering
+            self.close_connection = True
+            return
+        answer = b"ok"
+        if self.path == "/batch/":
+            answer = json.dumps(dict(accepted = len(body.splitlines()), rejected = [])).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(answer)))
+        self.end_headers()
+        self.wfile.write(answer)
+        # closes the connection once idle, without telling the client
+        self.close_connection = behaviour == "close when idle"
+
+    def log_message(self, *args):
+        pass
+
+class PublisherTest(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.server.received = []
+        self.server.behaviours = []
+        thread = threading.Thread(target = self.server.serve_forever, args = (0.01,))
+        thread.daemon = True
+        thread.start()
+        self.publisher = Publisher("127.0.0.1", self.server.server_address[1], timeout = 5)
+
+    def tearDown(self):
+        self.publisher.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_is_reused(self):
+        self.publisher.publish("t", "ping", "a")
+        self.publisher.publish("t", "ping", "b")
+        self.assertEqual(self.server.received, [("/ping/t", b"a"), ("/ping/t", b"b")])
+        self.assertEqual(len(self.publisher._pool), 1)
+
+    def test_connection_closed_when_idle(self):
+        self.server.behaviours = ["close when idle"]
+        self.publisher.publish("t", "ping", "a")
+        time.sleep(0.1)
+        self.assertEqual(self.publisher.publish("t", "ping", "b"), b"ok")
+        self.assertEqual(self.server.received, [("/ping/t", b"a"), ("/ping/t", b"b")])
+
+    def test_event_read_is_not_sent_again(self):
+        self.server.behaviours = ["answer", "no answer"]
+        self.publisher.publish("t", "ping", "a")
+        with self.assertRaises(IOError):
+            self.publisher.publish("t", "ping", "b")
+        self.assertEqual(self.server.received, [("/ping/t", b"a"), ("/ping/t", b"b")])
+        # the connection lost is not pooled
+        self.assertEqual(self.publisher.publish("t", "ping", "c"), b"ok")
+
+    def start(self, lines, *options):
+        argv = ["eventsource-request", "t", "ping", "-P", str(self.server.server_address[1]), "--stdin"]
+        with unittest.mock.patch.object(sys, "argv", argv + list(options)), \
+             unittest.mock.patch.object(sys, "stdin", io.StringIO("\n".join(lines))), \
+             unittest.mock.patch.object(sys, "stdout", io.StringIO()) as stdout, \
+             self.assertRaises(SystemExit) as exit:
+            start()
+        return exit.exception.code, stdout.getvalue()
+
+    def test_json_lines_sent_by_batch(self):
+        self.assertEqual(self.start(['{ "a": 1 }', '"b"', "2"], "-b", "2", "--json"), (0, "3 events sent\n"))
+        values = [[json.loads(record)["value"] for record in body.splitlines()] for _, body in self.server.received]
+        # the values are sent as in a request per event
+        self.assertEqual(values, [['{"a": 1}', '"b"'], ["2"]])
+        self.assertEqual(self.start(["a", "b"], "-b", "2"), (0, "2 events sent\n"))
+        self.assertEqual(self.server.received[-1][1], b'{"target": "t", "action": "ping", "value": "a"}\n'
+                                                      b'{"target": "t", "action": "ping", "value": "b"}')
+
+    def test_invalid_json_line_is_not_sent(self):
+        code, output = self.start(["1", "not json"], "-b", "2", "--json")
+        self.assertEqual(code, 1)
+        self.assertTrue(output.startswith("Invalid value: "))
+        self.assertEqual(self.server.received, [])
+
+    def test_publisher_keeps_query(self):
+        publisher, path = _publisher("http://127.0.0.1:8888/ping/t?a=1&b=2")
+        self.assertEqual(path, "/ping/t?a=1&b=2")
+        self.assertIs(_publisher("http://127.0.0.1:8888")[0], publisher)
+        self.assertEqual(_publisher("http://127.0.0.1:8888")[1], "/")
+
+class _Recorder(tornado.web.RequestHandler):
+    def initialize(self, received):
+        self.received = received
+
+    def post(self, action, target):
+        self.received.append((action, target, self.request.body))
+        self.write("ok")
+
+class AsyncPublisherTest(tornado.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        self.received = []
+        return tornado.web.Application([(r"/(.*)/(.*)", _Recorder, dict(received = self.received))])
+
+    @tornado.testing.gen_test
+    async def test_publish(self):
+        publisher = AsyncPublisher("127.0.0.1", self.get_http_port())
+        self.addCleanup(publisher.close)
+        self.assertEqual(await publisher.publish("t", "ping", "a"), b"ok")
+        self.assertEqual(self.received, [("ping", "t", b"a")])
+
+    def test_shared_client_is_left_alone(self):
+        shared = AsyncHTTPClient()
+        configured = AsyncHTTPClient.configured_class()
+        AsyncPublisher("127.0.0.1", self.get_http_port()).close()
+        self.assertIs(AsyncHTTPClient(), shared)
+        self.assertIs(AsyncHTTPClient.configured_class(), configured)
+        self.assertNotEqual(configured, CurlAsyncHTTPClient)
+        self.assertEqual(self.fetch("/ping/t", method = "POST", body = "b").body, b"ok")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,208 @@
+# -+- encoding: utf-8 -+-
+"""
+Tests of the retention and of the replay of the frames kept by `SegmentEventStore`
+"""
+
+from __future__ import unicode_literals
+
+import os
+import time
+import shutil
+import struct
+import tempfile
+import unittest
+import unittest.mock
+
+from eventsource.ids import SnowflakeIdGenerator
+from eventsource.storage import SegmentEventStore
+
+def frame(id):
+    return "id: {}\r\ndata: {:06d}\r\n\r\n".format(id, id).encode("utf-8")
+
+def replayed(store, target, last_id):
+    return b"".join(store.replay(target, last_id))
+
+class SegmentEventStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix = "eventsource-test-")
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        shutil.rmtree(self.path)
+
+    def store(self, **kwargs):
+        store = SegmentEventStore(self.path, **kwargs)
+        self.stores.append(store)
+        return store
+
+    def size(self):
+        return sum(os.path.getsize(os.path.join(path, name))
+                   for path, _, names in os.walk(self.path) for name in names)
+
+    def test_replay_after_id(self):
+        store = self.store(segment_size = 256, index_interval = 4, chunk_size = 100)
+        for id in range(100):
+            store.append("t", id, frame(id))
+        self.assertTrue(store.has("t"))
+        self.assertFalse(store.has("other"))
+        self.assertEqual(replayed(store, "t", 89), b"".join(frame(id) for id in range(90, 100)))
+        self.assertEqual(replayed(store, "t", 99), b"")
+        # every chunk holds whole frames
+        for chunk in store.replay("t", 0):
+            self.assertTrue(chunk.endswith(b"\r\n\r\n"))
+
+    def test_replay_unknown_id(self):
+        store = self.store()
+        for id in range(10):
+            store.append("t", id, frame(id))
+        self.assertEqual(replayed(store, "t", "unknown"), b"".join(frame(id) for id in range(10)))
+        self.assertEqual(list(store.replay("other", 0)), [])
+
+    def test_replay_after_greater_ordered_id(self):
+        store = self.store(ordered_ids = True)
+        for id in range(0, 20, 2):
+            store.append("t", id, frame(id))
+        self.assertEqual(replayed(store, "t", 13), b"".join(frame(id) for id in range(14, 20, 2)))
+
+    def test_replay_after_restart(self):
+        store = self.store()
+        for id in range(10):
+            store.append("t", id, frame(id))
+        store.close()
+        self.assertEqual(replayed(self.store(), "t", 4), b"".join(frame(id) for id in range(5, 10)))
+
+    def test_resume_after_restart(self):
+        store = self.store(ordered_ids = True)
+        generator = SnowflakeIdGenerator()
+        for id in [generator.next_id() for _ in range(5)]:
+            store.append("t", id, frame(id))
+        store.close()
+        # the restarted listener takes a new generator, a restart taking more than a millisecond
+        time.sleep(0.002)
+        store = self.store(ordered_ids = True)
+        generator = SnowflakeIdGenerator()
+        ids = [generator.next_id() for _ in range(3)]
+        for id in ids:
+            store.append("t", id, frame(id))
+        self.assertEqual(replayed(store, "t", ids[0]), b"".join(frame(id) for id in ids[1:]))
+
+    def test_resume_after_ids_given_again(self):
+        for segment_size in (256, 16 * 1024 * 1024):
+            target = "t{}".format(segment_size)
+            store = self.store(segment_size = segment_size, index_interval = 2)
+            for id in range(5):
+                store.append(target, id, frame(id))
+            store.close()
+            # counter ids start again after a restart, on frames told apart from the stale ones
+            store = self.store(segment_size = segment_size, index_interval = 2)
+            for id in range(2):
+                store.append(target, id, frame(id + 100))
+            self.assertEqual(replayed(store, target, 0), frame(101))
+            self.assertEqual(replayed(store, target, 3), frame(4) + frame(100) + frame(101))
+
+    def test_append_during_replay(self):
+        store = self.store(segment_size = 256, chunk_size = 1)
+        for id in range(10):
+            store.append("t", id, frame(id))
+        replay = store.replay("t", 4)
+        chunks = [next(replay)]
+        # the events appended meanwhile are left to the live stream
+        for id in range(10, 20):
+            store.append("t", id, frame(id))
+        chunks.extend(replay)
+        self.assertEqual(b"".join(chunks), b"".join(frame(id) for id in range(5, 10)))
+
+    def test_partial_record_is_truncated(self):
+        store = self.store()
+        for id in range(3):
+            store.append("t", id, frame(id))
+        store.close()
+        path = os.path.join(store._directory("t"), "{:020d}.log".format(0))
+        size = os.path.getsize(path)
+        with open(path, "ab") as f:
+            f.write(b"\x00\x00")
+        # an empty segment, as left by a crash right after a roll
+        open(os.path.join(store._directory("t"), "{:020d}.log".format(1)), "wb").close()
+        self.assertEqual(replayed(self.store(), "t", 0), frame(1) + frame(2))
+        self.assertEqual(os.path.getsize(path), size)
+
+    def test_max_bytes_below_segment_size(self):
+        store = self.store(max_bytes = 10000)
+        for id in range(5000):
+            store.append("t", id, frame(id))
+        # most of the log is kept when its oldest segment is deleted
+        self.assertTrue(10000 // 2 < self.size() <= 10000)
+        self.assertTrue(replayed(store, "t", "unknown").endswith(frame(4999)))
+
+    def test_expired_logs_are_deleted(self):
+        store = self.store(max_age = 1)
+        store.append("t", 1, frame(1))
+        segment = store._logs["t"].segments[0]
+        segment.first_time = segment.last_time = 0
+        store.prune()
+        self.assertFalse(os.path.exists(store._directory("t")))
+        self.assertFalse(store.has("t"))
+
+    def test_expired_closed_logs_are_deleted(self):
+        store = self.store(max_age = 1, idle_timeout = 0)
+        store.append("t", 1, frame(1))
+        store.close()
+        os.utime(os.path.join(store._directory("t"), "{:020d}.log".format(0)), (0, 0))
+        store.prune()
+        # the retention of closed logs is applied from a thread, waited for by close()
+        store.close()
+        self.assertFalse(os.path.exists(store._directory("t")))
+        self.assertFalse(store.has("t"))
+
+    def test_expired_records_are_not_replayed(self):
+        store = self.store(max_age = 60)
+        store.append("t", 1, frame(1))
+        store.append("t", 2, frame(2))
+        # the first record is backdated, as if it was appended two minutes ago
+        with open(store._logs["t"].segments[0].path, "r+b") as f:
+            f.seek(4)
+            f.write(struct.pack("!d", time.time() - 120))
+        self.assertEqual(replayed(store, "t", "unknown"), frame(2))
+
+    def test_idle_logs_are_closed(self):
+        store = self.store(idle_timeout = 0)
+        store.append("t", 1, frame(1))
+        store.prune()
+        self.assertEqual(store._logs, {})
+        self.assertEqual(replayed(store, "t", "unknown"), frame(1))
+
+    def test_prune_closed_logs(self):
+        store = self.store(max_bytes = 400, segment_size = 100)
+        for id in range(20):
+            store.append("t", id, frame(id))
+        store.close()
+        # the log of a target which is not used is not opened to apply the retention
+        store = self.store(max_age = 3600, max_bytes = 200)
+        store.prune()
+        store.close()
+        self.assertNotIn("t", store._logs)
+        self.assertLessEqual(self.size(), 200)
+        self.assertTrue(store.has("t"))
+
+    def test_has_does_not_touch_the_disk(self):
+        store = self.store()
+        store.append("t", 1, frame(1))
+        store.close()
+        store = self.store()
+        with unittest.mock.patch("os.listdir", side_effect = AssertionError), \
+                unittest.mock.patch("os.stat", side_effect = AssertionError):
+            self.assertTrue(store.has("t"))
+            self.assertFalse(store.has("other"))
+        self.assertNotIn("t", store._logs)
+
+    def test_sync(self):
+        store = self.store(sync = True)
+        for id in range(10):
+            store.append("t", id, frame(id))
+        store.close()
+        self.assertEqual(replayed(self.store(), "t", 8), frame(9))
+
+if __name__ == "__main__":
+    unittest.main()
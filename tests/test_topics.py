@@ -0,0 +1,171 @@
+# -+- encoding: utf-8 -+-
+"""
+Tests of the topics and patterns followed through `TopicTrie` and `ConnectionRegistry`,
+and of the handlers following them
+"""
+
+from __future__ import unicode_literals
+
+import unittest
+
+from eventsource.registry import ConnectionRegistry
+from eventsource.topics import TopicTrie, is_pattern, split_topics
+
+from tests.test_listener import HandlerTestCase
+
+class TopicsTest(unittest.TestCase):
+    def test_is_pattern(self):
+        self.assertTrue(is_pattern("a.*.c"))
+        self.assertTrue(is_pattern("a.#"))
+        self.assertFalse(is_pattern("a.b*.c"))
+
+    def test_split_topics(self):
+        self.assertEqual(split_topics(" a.b, c.*,a.b,"), ["a.b", "c.*"])
+        with self.assertRaises(ValueError):
+            split_topics(" , ")
+        with self.assertRaises(ValueError):
+            split_topics("a.#.c")
+
+class TopicTrieTest(unittest.TestCase):
+    def trie(self, *topics):
+        trie = TopicTrie()
+        for topic in topics:
+            trie.add(topic, topic)
+        return trie
+
+    def test_match_topic(self):
+        trie = self.trie("a.b", "a.b.c")
+        self.assertEqual(trie.match("a.b"), {"a.b"})
+        self.assertEqual(trie.match("a"), set())
+        self.assertFalse(trie.matches("a.b.c.d"))
+
+    def test_match_any_level(self):
+        trie = self.trie("a.*", "*.b", "*")
+        self.assertEqual(trie.match("a.b"), {"a.*", "*.b"})
+        self.assertEqual(trie.match("a"), {"*"})
+        # `*` matches exactly one level
+        self.assertEqual(trie.match("a.b.c"), set())
+
+    def test_match_any_levels(self):
+        trie = self.trie("a.#", "a.*.#", "#")
+        # `#` matches no level at all
+        self.assertEqual(trie.match("a"), {"a.#", "#"})
+        self.assertEqual(trie.match("a.b"), {"a.#", "a.*.#", "#"})
+        self.assertEqual(trie.match("a.b.c.d"), {"a.#", "a.*.#", "#"})
+        self.assertEqual(trie.match("b"), {"#"})
+
+    def test_invalid_pattern(self):
+        trie = TopicTrie()
+        with self.assertRaises(ValueError):
+            trie.add("a.#.c", "value", pattern = True)
+        # unless told otherwise, it is followed as it is
+        trie.add("a.#.c", "value")
+        self.assertEqual(trie.match("a.#.c"), {"value"})
+        self.assertEqual(trie.match("a.b.c"), set())
+
+    def test_wildcard_followed_as_topic(self):
+        trie = TopicTrie()
+        trie.add("a.*", "value", pattern = False)
+        self.assertEqual(trie.match("a.b"), set())
+        self.assertEqual(trie.match("a.*"), {"value"})
+
+    def test_remove_prunes_nodes(self):
+        trie = self.trie("a.b.*", "a.#", "a.b")
+        trie.remove("a.b.*", "a.b.*")
+        # the node of `a` is kept for `a.#`, the ones below it are pruned
+        self.assertEqual(list(trie._root.children), ["a"])
+        self.assertEqual(list(trie._root.children["a"].children), ["#"])
+        self.assertEqual(trie.match("a.b.c"), {"a.#"})
+        trie.remove("a.#", "a.#")
+        trie.remove("a.b", "a.b")
+        self.assertEqual(trie._root.children, {})
+        self.assertEqual(trie._topics, {})
+        self.assertEqual(len(trie), 0)
+        self.assertFalse(trie.matches("a.b"))
+
+    def test_remove_unknown(self):
+        trie = self.trie("a.*")
+        trie.remove("a.*", "other")
+        trie.remove("a.b.*", "a.*")
+        trie.remove("b", "b")
+        self.assertEqual(trie.match("a.b"), {"a.*"})
+        self.assertEqual(len(trie), 1)
+
+    def test_shared_pattern(self):
+        trie = TopicTrie()
+        trie.add("a.*", 1)
+        trie.add("a.*", 2)
+        trie.remove("a.*", 1)
+        self.assertEqual(trie.match("a.b"), {2})
+        self.assertEqual(trie.get("a.*"), {2})
+        self.assertEqual(len(trie), 1)
+
+    def test_iter(self):
+        trie = self.trie("a", "a.*", "a.b.#")
+        self.assertEqual(sorted(trie), ["a", "a.*", "a.b.#"])
+        self.assertIn("a.*", trie)
+        self.assertNotIn("a.b", trie)
+
+class ConnectionRegistryTest(unittest.TestCase):
+    def test_subscribers(self):
+        registry = ConnectionRegistry()
+        registry.add("a.b", "plain", ["a.b"])
+        registry.add("a.*,c", "pattern", ["a.*", "c"])
+        self.assertEqual(registry.subscribers("a.b"), {"plain", "pattern"})
+        self.assertEqual(registry.subscribers("c"), {"pattern"})
+        self.assertTrue(registry.is_connected("a.z"))
+        # patterns are followed, not the topics they match
+        self.assertFalse(registry.is_followed("a.z"))
+        self.assertEqual(registry.count("a.*"), 1)
+        self.assertEqual(registry.topics("pattern"), ["a.*", "c"])
+
+    def test_target_followed_as_it_is(self):
+        registry = ConnectionRegistry()
+        registry.add("a.*", "target")
+        self.assertEqual(registry.subscribers("a.*"), {"target"})
+        self.assertEqual(registry.subscribers("a.b"), set())
+        self.assertIsNone(registry.topics("target"))
+
+    def test_remove(self):
+        registry = ConnectionRegistry()
+        registry.add("a.*,c", "pattern", ["a.*", "c"])
+        self.assertEqual(registry.remove("pattern"), "a.*,c")
+        self.assertFalse(registry.is_connected("a.b"))
+        self.assertEqual(list(registry.targets()), [])
+        with self.assertRaises(KeyError):
+            registry.remove("pattern")
+
+    def test_resubscribe(self):
+        registry = ConnectionRegistry()
+        registry.add("a.*", "handler", ["a.*"])
+        registry.add("b", "handler", ["b"])
+        self.assertEqual(registry.subscribers("a.b"), set())
+        self.assertEqual(registry.subscribers("b"), {"handler"})
+        self.assertEqual(len(registry), 1)
+
+class TopicsHandlerTest(HandlerTestCase):
+    def topic_handler(self, target):
+        handler = self.handler(topics = True)
+        handler.set_connected(target, split_topics(target))
+        return handler
+
+    def test_post_on_patterns(self):
+        handler = self.topic_handler("a.*")
+        self.assertEqual(handler.check_event("a.*", "ping")[0], 400)
+        self.assertEqual(handler.check_event("a.b,a.c", "ping")[0], 400)
+        self.assertIsNone(handler.check_event("a.b", "ping"))
+
+    def test_close_topic(self):
+        alone = self.topic_handler("a.b")
+        pattern = self.topic_handler("a.*")
+        several = self.topic_handler("a.b,c")
+        for handler in (alone, pattern, several):
+            self.post(handler, "ping", "x", target = "a.b")
+            self.post(handler, "close", None, target = "a.b")
+        # only the streams following the topic alone are closed
+        self.assertEqual(self.queued(alone), [("ping", "x"), ("close", None)])
+        self.assertEqual(self.queued(pattern), [("ping", "x")])
+        self.assertEqual(self.queued(several), [("ping", "x")])
+
+if __name__ == "__main__":
+    unittest.main()